@@ -0,0 +1,162 @@
+"""
+Benchmark de lectura de archivos Excel
+Compara read_excel_file (formato detectado por el contenido y una sola
+lectura) con la estrategia anterior: dos motores × tres juegos de parámetros,
+reabriendo el libro completo en cada fallo. Mide el tiempo total sobre libros
+válidos y sobre archivos que no se pueden leer o que no son lo que dice su
+extensión.
+Con --memory compara el pico de memoria (tracemalloc) de pd.read_excel con
+la lectura en streaming de read_excel_file sobre una hoja grande, relativo al
+tamaño del DataFrame final.
+
+Uso:
+    python benchmarks/bench_excel_ingest.py
+    python benchmarks/bench_excel_ingest.py --rows 50000
+    python benchmarks/bench_excel_ingest.py --memory --rows 1000000
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+import tracemalloc
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from excel_ingest import read_excel_file  # noqa: E402
+
+
+def legacy_read_excel_file(file_source):
+    """read_excel_file antes de la detección de formato (para comparar)"""
+    for engine in ['openpyxl', 'xlrd']:
+        for params in [{}, {'na_values': ['', 'N/A', 'NULL', 'null']}, {'keep_default_na': False}]:
+            try:
+                with pd.ExcelFile(file_source, engine=engine) as excel_file:
+                    sheets_info = {}
+                    for sheet_name in excel_file.sheet_names:
+                        try:
+                            df = pd.read_excel(excel_file, sheet_name=sheet_name, **params)
+                            df = df.dropna(how='all')
+                            unnamed_cols = [c for c in df.columns if isinstance(c, str) and c.startswith('Unnamed')]
+                            if unnamed_cols:
+                                df = df.drop(columns=unnamed_cols)
+                            for col in df.columns:
+                                try:
+                                    df[col] = pd.to_numeric(df[col])
+                                except (ValueError, TypeError):
+                                    pass
+                            if not df.empty:
+                                sheets_info[sheet_name] = {'dataframe': df, 'shape': df.shape}
+                        except Exception:
+                            continue
+                    if sheets_info:
+                        return sheets_info
+            except Exception:
+                continue
+    return None
+
+
+def make_frame(rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(7)
+    return pd.DataFrame({
+        "Región": rng.choice(["Norte", "Sur", "Este", "Oeste"], rows),
+        "Ventas": rng.normal(1000, 200, rows).round(2),
+        "Unidades": rng.integers(1, 100, rows),
+        "Fecha": pd.date_range("2024-01-01", periods=rows, freq="h"),
+        "Nota": [None if i % 7 == 0 else f"nota {i % 50}" for i in range(rows)],
+    })
+
+
+def make_files(rows: int) -> dict:
+    """nombre -> contenido: libros válidos, disfrazados y dañados"""
+    frame = make_frame(rows)
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        frame.to_excel(writer, sheet_name="Ventas", index=False)
+        frame.head(rows // 4).to_excel(writer, sheet_name="Resumen", index=False)
+    xlsx = buffer.getvalue()
+
+    # Libro cuya hoja tiene el XML dañado: openpyxl falla al leerla
+    damaged = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(xlsx)) as source, zipfile.ZipFile(damaged, "w", zipfile.ZIP_DEFLATED) as target:
+        for item in source.infolist():
+            content = source.read(item.filename)
+            if item.filename.startswith("xl/worksheets/"):
+                content = content[:len(content) // 2]
+            target.writestr(item, content)
+
+    csv_text = frame.to_csv(index=False, sep=";", decimal=",")
+    return {
+        "xlsx válido": xlsx,
+        "csv con extensión .xls": csv_text.encode("utf-8"),
+        "xlsx truncado": xlsx[:len(xlsx) // 2],
+        "xlsx con hoja dañada": damaged.getvalue(),
+        "bytes aleatorios .xls": np.random.default_rng(1).bytes(len(xlsx)),
+    }
+
+
+def timed(reader, data: bytes, repeat: int):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = reader(io.BytesIO(data))
+        best = min(best, time.perf_counter() - start)
+    rows = sum(info["shape"][0] for info in result.values()) if result else 0
+    return best, rows
+
+
+def measure_memory(reader, data: bytes):
+    """(segundos, pico de memoria, tamaño del DataFrame) de una lectura"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        frame = reader(data)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak, int(frame.memory_usage(index=True, deep=True).sum())
+
+
+def memory_main(rows: int):
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        make_frame(rows).to_excel(writer, sheet_name="Ventas", index=False)
+    data = buffer.getvalue()
+    readers = {
+        "pd.read_excel": lambda content: pd.read_excel(io.BytesIO(content), engine="openpyxl").dropna(how="all"),
+        "streaming": lambda content: read_excel_file(content)["Ventas"]["dataframe"],
+    }
+    print(f"{rows} filas, xlsx de {len(data) / 2 ** 20:.1f} MB")
+    print(f"{'lector':<16}{'segundos':>10}{'pico MB':>10}{'frame MB':>10}{'pico/frame':>12}")
+    for label, reader in readers.items():
+        seconds, peak, size = measure_memory(reader, data)
+        print(f"{label:<16}{seconds:>10.1f}{peak / 2 ** 20:>10.1f}{size / 2 ** 20:>10.1f}{peak / size:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000, help="Filas de la hoja principal")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--memory", action="store_true", help="Medir el pico de memoria en lugar del tiempo")
+    args = parser.parse_args()
+
+    if args.memory:
+        memory_main(args.rows)
+        return
+
+    print(f"{'archivo':<26}{'anterior ms':>13}{'filas':>9}{'actual ms':>12}{'filas':>9}")
+    for label, data in make_files(args.rows).items():
+        legacy, legacy_rows = timed(legacy_read_excel_file, data, args.repeat)
+        current, current_rows = timed(read_excel_file, data, args.repeat)
+        print(f"{label:<26}{legacy * 1e3:>13.0f}{legacy_rows:>9}{current * 1e3:>12.0f}{current_rows:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Benchmark de importación masiva en ProfileManager
+Compara agregar N entradas a la base de conocimientos con un guardado por
+entrada contra `with pm.batch():`, e importa catálogos CSV de N vehículos
+(con --memory mide además la memoria retenida y el pico de la importación y
+la exportación en streaming, en JSON y SQLite)
+
+Uso:
+    python benchmarks/bench_profile_import.py --rows 1000 10000
+    python benchmarks/bench_profile_import.py --rows 100000 --memory
+"""
+
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from profile_manager import ProfileManager  # noqa: E402
+
+SAMPLE_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ejemplo_catalogo_vehiculos.csv")
+
+
+class CountingProfileManager(ProfileManager):
+    """ProfileManager que cuenta las escrituras reales del archivo"""
+
+    writes = 0
+
+    def _save_profiles(self):
+        if not self._batch_depth:
+            self.writes += 1
+        super()._save_profiles()
+
+
+def make_catalog(path: str, rows: int):
+    """Generar un catálogo de `rows` vehículos a partir del CSV de ejemplo"""
+    with open(SAMPLE_CSV, "r", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames
+        sample = list(reader)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        for i in range(rows):
+            row = dict(sample[i % len(sample)])
+            row["id"] = f"VEH{i:06d}"
+            writer.writerow(row)
+
+
+def bench_kb(workdir: str, rows: int, batched: bool):
+    path = os.path.join(workdir, f"kb_{rows}_{int(batched)}.json")
+    pm = CountingProfileManager(path)
+    pm.create_profile("Bench")
+    value = "Entrada de prueba con un texto de tamaño similar a una ficha real. " * 8
+    start = time.perf_counter()
+    if batched:
+        with pm.batch():
+            for i in range(rows):
+                pm.add_to_knowledge_base("Bench", 1, f"clave_{i}", value)
+    else:
+        for i in range(rows):
+            pm.add_to_knowledge_base("Bench", 1, f"clave_{i}", value)
+    return time.perf_counter() - start, pm.writes - 1, os.path.getsize(path)
+
+
+def bench_catalog(workdir: str, rows: int):
+    csv_path = os.path.join(workdir, f"catalog_{rows}.csv")
+    make_catalog(csv_path, rows)
+    pm = CountingProfileManager(os.path.join(workdir, f"catalog_{rows}.json"))
+    start = time.perf_counter()
+    name = pm.import_vehicle_catalog_from_csv(csv_path)
+    elapsed = time.perf_counter() - start
+    assert name, "la importación falló"
+    return elapsed, pm.writes, os.path.getsize(pm.profiles_file)
+
+
+def bench_catalog_memory(workdir: str, rows: int, suffix: str):
+    """(segundos, MB retenidos, MB de pico sobre lo retenido al importar, MB de pico al exportar)"""
+    csv_path = os.path.join(workdir, f"catalog_{rows}.csv")
+    if not os.path.exists(csv_path):
+        make_catalog(csv_path, rows)
+    pm = ProfileManager(os.path.join(workdir, f"catalog_mem_{rows}{suffix}"))
+    tracemalloc.start()
+    start = time.perf_counter()
+    name = pm.import_vehicle_catalog_from_csv(csv_path)
+    elapsed = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    assert name, "la importación falló"
+    tracemalloc.reset_peak()
+    pm.export_all_profiles_to_csv(os.path.join(workdir, f"export_{rows}.csv"))
+    current, export_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, retained / 1e6, (peak - retained) / 1e6, (export_peak - current) / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--max-unbatched", type=int, default=2000,
+                        help="No medir sin batch por encima de este número de filas (crece O(n²))")
+    parser.add_argument("--memory", action="store_true",
+                        help="Medir memoria de importación/exportación del catálogo (más lento: usa tracemalloc)")
+    args = parser.parse_args()
+
+    if args.memory:
+        print(f"{'backend':<10}{'filas':>8}{'segundos':>11}{'retenido MB':>13}{'pico import':>13}{'pico export':>13}")
+        with tempfile.TemporaryDirectory() as workdir:
+            for rows in args.rows:
+                for suffix in (".json", ".db"):
+                    elapsed, retained, peak, export_peak = bench_catalog_memory(workdir, rows, suffix)
+                    print(f"{suffix[1:]:<10}{rows:>8}{elapsed:>11.2f}{retained:>13.1f}{peak:>13.1f}{export_peak:>13.1f}")
+        return
+
+    print(f"{'escenario':<32}{'filas':>8}{'segundos':>11}{'escrituras':>12}{'MB':>8}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for rows in args.rows:
+            scenarios = [("kb, batch", lambda: bench_kb(workdir, rows, True)),
+                         ("catálogo CSV (batch)", lambda: bench_catalog(workdir, rows))]
+            if rows <= args.max_unbatched:
+                scenarios.insert(0, ("kb, un guardado por entrada", lambda: bench_kb(workdir, rows, False)))
+            for label, run in scenarios:
+                elapsed, writes, size = run()
+                print(f"{label:<32}{rows:>8}{elapsed:>11.2f}{writes:>12}{size / 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
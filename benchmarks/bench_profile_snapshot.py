@@ -0,0 +1,124 @@
+"""
+Benchmark de lecturas concurrentes con escrituras en ProfileManager
+Varios hilos lectores resuelven, como el bot por cada mensaje, el conjunto de
+perfiles del chat, la clave de versiones activas y entradas de la base de
+conocimientos, mientras un hilo escritor actualiza dos entradas juntas en un
+batch y guarda. Modos:
+  live      leen el diccionario vivo sin protección (pueden ver la mitad de un cambio)
+  lock      lectores y escritor comparten un lock (el escritor lo retiene mientras guarda)
+  snapshot  leen la instantánea inmutable de get_profile_snapshot(), sin lock
+Informa lecturas por segundo, escrituras confirmadas y lecturas inconsistentes
+(las dos entradas con distinto valor).
+
+Uso:
+    python benchmarks/bench_profile_snapshot.py
+    python benchmarks/bench_profile_snapshot.py --vehicles 5000 --readers 8 --seconds 5
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_profile_import import make_catalog  # noqa: E402
+from profile_manager import ProfileManager  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ("live", "lock", "snapshot")
+
+
+def setup(workdir: str, vehicles: int, ext: str) -> str:
+    """Almacenamiento con dos perfiles activos y un catálogo de `vehicles` vehículos"""
+    csv_path = os.path.join(workdir, "catalog.csv")
+    make_catalog(csv_path, vehicles)
+    path = os.path.join(workdir, f"profiles.{ext}")
+    pm = ProfileManager(path)
+    with pm.batch():
+        pm.import_profile_from_csv(os.path.join(ROOT, "ejemplo_perfil_soporte.csv"))
+        catalog = pm.import_vehicle_catalog_from_csv(csv_path)
+        for priority, name in enumerate(pm.profiles["profiles"], 1):
+            pm.add_active_profile(name, priority)
+        pm.add_to_knowledge_base(catalog, 1, "contador_a", "0")
+        pm.add_to_knowledge_base(catalog, 1, "contador_b", "0")
+    return path
+
+
+def run(path: str, mode: str, readers: int, seconds: float):
+    pm = ProfileManager(path)
+    catalog = next(name for name in pm.profiles["profiles"] if name.startswith("Catálogo"))
+    lock = threading.Lock()
+    stop = threading.Event()
+    counts = [0] * readers
+    torn = [0] * readers
+    writes = [0]
+    if mode == "snapshot":
+        pm.get_profile_snapshot()
+
+    def read_once():
+        source = pm.get_profile_snapshot() if mode == "snapshot" else pm
+        profiles = source.get_chat_profiles(1000, "private")
+        source.get_active_version_key(profiles)
+        profile = source.get_profile(catalog)
+        kb = source.get_version(catalog, profile["active_version"])["knowledge_base"]
+        first = kb["contador_a"]["value"]
+        entries = sum(1 for _ in zip(kb, range(200)))
+        return first != kb["contador_b"]["value"] or not entries
+
+    def reader(idx: int):
+        while not stop.is_set():
+            if mode == "lock":
+                with lock:
+                    inconsistent = read_once()
+            else:
+                inconsistent = read_once()
+            counts[idx] += 1
+            torn[idx] += inconsistent
+
+    def writer():
+        value = 0
+        while not stop.is_set():
+            value += 1
+            if mode == "lock":
+                lock.acquire()
+            try:
+                with pm.batch():
+                    pm.add_to_knowledge_base(catalog, 1, "contador_a", str(value))
+                    pm.add_to_knowledge_base(catalog, 1, "contador_b", str(value))
+            finally:
+                if mode == "lock":
+                    lock.release()
+            writes[0] += 1
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)] + [threading.Thread(target=writer)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / seconds, writes[0], sum(torn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vehicles", type=int, default=2000, help="Vehículos del catálogo")
+    parser.add_argument("--readers", type=int, default=4, help="Hilos lectores")
+    parser.add_argument("--seconds", type=float, default=3.0, help="Duración de cada modo")
+    parser.add_argument("--sqlite", action="store_true", help="Usar el backend SQLite en lugar de JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = setup(workdir, args.vehicles, "db" if args.sqlite else "json")
+        print(f"{'modo':<10}{'lecturas/s':>12}{'escrituras':>12}{'inconsistentes':>16}")
+        for mode in MODES:
+            reads, writes, torn = run(path, mode, args.readers, args.seconds)
+            print(f"{mode:<10}{reads:>12.0f}{writes:>12}{torn:>16}")
+
+
+if __name__ == "__main__":
+    main()
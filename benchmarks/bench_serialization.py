@@ -0,0 +1,119 @@
+"""
+Benchmark de formatos de serialización de los almacenes en disco
+Mide guardado, carga y tamaño con cada formato de serialization.py sobre las
+formas de datos reales: bot_profiles.json (perfiles de ejemplo más un catálogo
+de N vehículos, ya empaquetado en blobs), conversation_memory.json (chats con
+MAX_MEMORY_ENTRIES mensajes) y user_data_{chat_id}.json (10 conjuntos de datos).
+El catálogo sintético repite los 10 vehículos del CSV de ejemplo, así que la
+compresión zstd de bot_profiles es más optimista que con un catálogo real.
+
+Uso:
+    python benchmarks/bench_serialization.py
+    python benchmarks/bench_serialization.py --vehicles 20000 --chats 2000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import serialization  # noqa: E402
+from bench_profile_import import make_catalog  # noqa: E402
+from profile_manager import ProfileManager  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FORMATS = ["json", "json-compact", "orjson", "msgpack", "json-compact+zstd", "orjson+zstd", "msgpack+zstd"]
+
+
+def profiles_data(workdir: str, vehicles: int) -> dict:
+    """Contenido de bot_profiles.json tal como lo escribe JsonProfileStore"""
+    csv_path = os.path.join(workdir, "catalog.csv")
+    make_catalog(csv_path, vehicles)
+    path = os.path.join(workdir, "profiles.json")
+    pm = ProfileManager(path, store_format="json-compact")
+    with pm.batch():
+        for name in ("ejemplo_perfil_soporte.csv", "ejemplo_perfil_ventas.csv"):
+            pm.import_profile_from_csv(os.path.join(ROOT, name))
+        pm.import_vehicle_catalog_from_csv(csv_path)
+        pm.create_version("Catálogo de Vehículos")
+    return serialization.load_file(path)
+
+
+def memory_data(chats: int, entries: int = 20) -> dict:
+    """conversation_memory.json: chat_id -> últimos mensajes (texto variado, no repetido)"""
+    rng = random.Random(42)
+    words = ("hola modelo color rojo transmisión automática garantía años kilómetros motor potencia "
+             "versión disponible precio financiamiento entrega asientos puertas equipamiento pantalla "
+             "sensores cámara consumo ciudad carretera familia viaje prueba manejo concesionario").split()
+
+    def text(n):
+        return " ".join(rng.choice(words) for _ in range(n)).capitalize() + "."
+
+    return {
+        str(1000000 + chat): [
+            {"role": "user" if i % 2 == 0 else "assistant", "content": text(15 if i % 2 == 0 else 80),
+             "timestamp": datetime(2026, 1, 1, 9, rng.randrange(60), rng.randrange(60)).isoformat()}
+            for i in range(entries)
+        ]
+        for chat in range(chats)
+    }
+
+
+def user_data(datasets: int = 10) -> dict:
+    """user_data_{chat_id}.json: últimos conjuntos de datos analizados"""
+    categories = [f"Categoría {i}" for i in range(12)]
+    return {
+        "datasets": [
+            {"timestamp": datetime.now().isoformat(), "data_type": "ventas", "categories": categories,
+             "values": {c: 1234.5 + i for i, c in enumerate(categories)},
+             "analysis": "Las ventas se concentran en tres categorías que suman el 60% del total. " * 5,
+             "chart_type": "bar", "title": "Ventas por categoría"}
+            for _ in range(datasets)
+        ],
+        "analyses": []
+    }
+
+
+def bench(path: str, data, fmt: str, repeat: int):
+    """(segundos de guardado, segundos de carga, bytes) con el mejor de `repeat`"""
+    save = load = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        serialization.dump_file(path, data, fmt)
+        save = min(save, time.perf_counter() - start)
+        start = time.perf_counter()
+        loaded = serialization.load_file(path)
+        load = min(load, time.perf_counter() - start)
+    assert loaded == data, f"{fmt}: el contenido leído no coincide"
+    return save, load, os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vehicles", type=int, default=5000, help="Vehículos del catálogo de bot_profiles.json")
+    parser.add_argument("--chats", type=int, default=500, help="Chats de conversation_memory.json")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        stores = [("bot_profiles", profiles_data(workdir, args.vehicles)),
+                  ("conversation_memory", memory_data(args.chats)),
+                  ("user_data", user_data())]
+        print(f"{'archivo':<21}{'formato':<19}{'guardar ms':>12}{'cargar ms':>11}{'KB':>10}")
+        for label, data in stores:
+            for fmt in FORMATS:
+                effective = serialization.resolve_format(fmt)
+                if effective != fmt:
+                    continue  # falta la librería opcional
+                save, load, size = bench(os.path.join(workdir, f"{label}.bin"), data, fmt, args.repeat)
+                print(f"{label:<21}{fmt:<19}{save * 1e3:>12.1f}{load * 1e3:>11.1f}{size / 1e3:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
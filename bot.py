@@ -1,7 +1,6 @@
 import os
 import signal
 import asyncio
-import json
 import tempfile
 import shutil
 import io
@@ -9,9 +8,6 @@ from typing import Optional, Dict, List
 from datetime import datetime
 
 from dotenv import load_dotenv  # pyright: ignore[reportMissingImports]
-import httpx  # pyright: ignore[reportMissingImports]
-from google.oauth2 import service_account  # pyright: ignore[reportMissingImports]
-from google.auth.transport.requests import Request as GoogleRequest  # pyright: ignore[reportMissingImports]
 
 # Sistema de gestión de perfiles
 try:
@@ -21,6 +17,13 @@ except ImportError:
     print("Profile management not available")
     PROFILES_AVAILABLE = False
 
+from token_usage import TokenUsageTracker, BUDGET_OK, BUDGET_HARD, trim_to_lines
+from context_provider import FileContextProvider
+from context_feed import ContextSubscriber
+from serialization import dump_file, load_file
+from gemini_client import query_gemini
+from excel_ingest import ExcelIngestPool, IngestCancelled, IngestQueueFull, IngestTimeout, read_excel_file
+
 # procesamiento de voz
 try:
     import whisper
@@ -75,6 +78,47 @@ if PROFILES_AVAILABLE:
 else:
     PROFILE_MANAGER = None
 
+# contexto sincronizado desde la app de entrenamiento, cacheado en memoria
+PROFILE_CONTEXT = FileContextProvider(
+    "active_profile_context.txt",
+    fallback=PROFILE_MANAGER.get_packed_context if PROFILE_MANAGER else None,
+    check_interval_ms=int(os.getenv("PROFILE_CONTEXT_CHECK_MS", "500"))
+)
+if PROFILE_MANAGER:
+    # el fallback (sin archivo sincronizado) se recalcula con cada cambio de perfiles, propio o recargado
+    PROFILE_MANAGER.subscribe(lambda event, provider=PROFILE_CONTEXT: provider.invalidate())
+
+# distribución push: con CONTEXT_FEED_PATH el contexto llega publicado por la app de entrenamiento
+# a través del feed SQLite y este proceso confirma cada versión aplicada
+CONTEXT_FEED_PATH = os.getenv("CONTEXT_FEED_PATH")
+if CONTEXT_FEED_PATH:
+    PROFILE_CONTEXT = ContextSubscriber(
+        CONTEXT_FEED_PATH,
+        worker_id=os.getenv("BOT_WORKER_ID"),
+        fallback=PROFILE_CONTEXT.get,
+        poll_interval=int(os.getenv("CONTEXT_FEED_POLL_MS", "200")) / 1000.0,
+        on_update=lambda version, snapshot_id: print(f"Contexto v{version} ({snapshot_id}) aplicado")
+    ).start()
+
+# lectura de Excel en un pool de procesos acotado: un libro grande no bloquea al resto de los chats
+EXCEL_POOL = ExcelIngestPool(
+    workers=int(os.getenv("EXCEL_INGEST_WORKERS", "0")) or None,
+    max_queue=int(os.getenv("EXCEL_INGEST_QUEUE", "8")),
+    timeout=float(os.getenv("EXCEL_INGEST_TIMEOUT", "120")),
+    max_rows=int(os.getenv("EXCEL_MAX_ROWS", "0")) or None
+)
+
+# modo de contexto: "full" vuelca el perfil completo, "retrieval" inyecta solo pasajes relevantes (BM25)
+PROFILE_CONTEXT_MODE = os.getenv("PROFILE_CONTEXT_MODE", "full").lower()
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "8"))
+
+# contabilidad de tokens y presupuestos (ver TOKEN_BUDGET_* en .env)
+TOKEN_USAGE = TokenUsageTracker.from_env()
+# al superar el presupuesto suave se recorta el contexto; al superar el duro además se usa el modelo pequeño
+BUDGET_CONTEXT_CHARS = int(os.getenv("TOKEN_BUDGET_CONTEXT_CHARS", "6000"))
+BUDGET_MEMORY_ENTRIES = int(os.getenv("TOKEN_BUDGET_MEMORY_ENTRIES", "6"))
+GEMINI_FALLBACK_API_URL = os.getenv("GEMINI_FALLBACK_API_URL")
+
 # configuración de procesamiento de voz
 WHISPER_MODEL_NAME = os.getenv("WHISPER_MODEL", "base")
 AUDIO_RESPONSE_ENABLED = os.getenv("AUDIO_RESPONSE_ENABLED", "true").lower() == "true"
@@ -86,8 +130,8 @@ def load_memory():
     global CONVERSATION_MEMORY
     try:
         if os.path.exists(MEMORY_FILE):
-            with open(MEMORY_FILE, 'r', encoding='utf-8') as f:
-                CONVERSATION_MEMORY = json.load(f)
+            # JSON guarda las claves como texto y msgpack como número: usar siempre el id numérico del chat
+            CONVERSATION_MEMORY = {int(chat_id): entries for chat_id, entries in load_file(MEMORY_FILE).items()}
     except Exception as e:
         print(f"Error loading memory: {e}")
         CONVERSATION_MEMORY = {}
@@ -95,8 +139,8 @@ def load_memory():
 def save_memory():
     """Save conversation memory to file"""
     try:
-        with open(MEMORY_FILE, 'w', encoding='utf-8') as f:
-            json.dump(CONVERSATION_MEMORY, f, ensure_ascii=False, indent=2)
+        # formato según STORE_FORMAT (ver serialization.py)
+        dump_file(MEMORY_FILE, CONVERSATION_MEMORY)
     except Exception as e:
         print(f"Error saving memory: {e}")
 
@@ -253,148 +297,6 @@ def transcribe_audio(audio_path: str, language_hint: str = None):
             return "No pude transcribir el audio. Por favor, intenta enviar un mensaje de texto.", "es"
 
 # funciones de procesamiento de excel y graficos
-def read_excel_file(file_source):
-    """
-    Read Excel file and return dataframes and sheet info with robust error handling
-    Args:
-        file_source: Can be a file path (str) or BytesIO object
-    """
-    if not EXCEL_CHARTS_AVAILABLE:
-        raise Exception("Excel processing not available")
-    
-    try:
-        # múltiples intentos con diferentes motores y parámetros
-        engines_to_try = ['openpyxl', 'xlrd']
-        read_params = [
-            {},  # parámetros por defecto
-            {'na_values': ['', 'N/A', 'NULL', 'null']},  # manejar valores vacíos
-            {'keep_default_na': False},  # no convertir a NaN
-        ]
-        
-        for engine in engines_to_try:
-            for params in read_params:
-                try:
-                    # Usar context manager para asegurar que el archivo se cierre automáticamente
-                    with pd.ExcelFile(file_source, engine=engine) as excel_file:
-                        sheets_info = {}
-                        
-                        for sheet_name in excel_file.sheet_names:
-                            try:
-                                # leer con los parámetros actuales
-                                df = pd.read_excel(excel_file, sheet_name=sheet_name, **params)
-                                
-                                # limpiar el dataframe
-                                df = df.dropna(how='all')  # remover filas completamente vacías
-                                
-                                # Limpiar columnas sin nombre solo si existen
-                                unnamed_cols = [col for col in df.columns if isinstance(col, str) and col.startswith('Unnamed')]
-                                if unnamed_cols:
-                                    df = df.drop(columns=unnamed_cols)
-                                
-                                # Intentar convertir columnas a numérico cuando sea posible
-                                for col in df.columns:
-                                    try:
-                                        # Intentar conversión a numérico (sin el errors='ignore' deprecado)
-                                        df[col] = pd.to_numeric(df[col])
-                                    except (ValueError, TypeError):
-                                        # Si falla, mantener la columna como está
-                                        pass
-                                
-                                if not df.empty:
-                                    # Información de columnas numéricas
-                                    numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
-                                    print(f"Sheet '{sheet_name}': {len(numeric_cols)} numeric columns found: {numeric_cols[:5]}")
-                                    
-                                    sheets_info[sheet_name] = {
-                                        'dataframe': df,
-                                        'columns': list(df.columns),
-                                        'shape': df.shape,
-                                        'dtypes': df.dtypes.to_dict()
-                                    }
-                            except Exception as e:
-                                print(f"Error reading sheet {sheet_name} with {engine}: {e}")
-                                continue
-                        
-                        if sheets_info:
-                            print(f"Successfully read Excel file using {engine} engine")
-                            return sheets_info
-                        
-                except Exception as e:
-                    print(f"Failed to read with {engine}: {e}")
-                    continue
-        
-        # si todos los métodos fallan
-        raise Exception("Could not read Excel file with any available method")
-        
-    except Exception as e:
-        print(f"Error reading Excel file: {e}")
-        return None
-
-def get_comprehensive_data_analysis(df: pd.DataFrame) -> dict:
-    """
-    Realiza un análisis completo de un DataFrame y retorna información útil
-    """
-    if not EXCEL_CHARTS_AVAILABLE:
-        return {}
-    
-    try:
-        analysis = {
-            'total_rows': len(df),
-            'total_columns': len(df.columns),
-            'column_names': list(df.columns),
-            'numeric_columns': [],
-            'text_columns': [],
-            'date_columns': [],
-            'statistics': {},
-            'sample_data': {},
-            'data_quality': {}
-        }
-        
-        # Analizar cada columna
-        for col in df.columns:
-            col_data = df[col]
-            
-            # Detectar tipo de columna
-            if pd.api.types.is_numeric_dtype(col_data):
-                analysis['numeric_columns'].append(col)
-                # Estadísticas para columnas numéricas
-                analysis['statistics'][col] = {
-                    'count': int(col_data.count()),
-                    'mean': float(col_data.mean()) if col_data.count() > 0 else 0,
-                    'median': float(col_data.median()) if col_data.count() > 0 else 0,
-                    'std': float(col_data.std()) if col_data.count() > 1 else 0,
-                    'min': float(col_data.min()) if col_data.count() > 0 else 0,
-                    'max': float(col_data.max()) if col_data.count() > 0 else 0,
-                    'sum': float(col_data.sum()) if col_data.count() > 0 else 0
-                }
-            elif pd.api.types.is_datetime64_any_dtype(col_data):
-                analysis['date_columns'].append(col)
-            else:
-                analysis['text_columns'].append(col)
-                # Info para columnas de texto
-                unique_count = col_data.nunique()
-                analysis['statistics'][col] = {
-                    'unique_values': int(unique_count),
-                    'most_common': str(col_data.mode()[0]) if len(col_data.mode()) > 0 else 'N/A'
-                }
-            
-            # Muestra de datos (primeros 3 valores no nulos)
-            sample = col_data.dropna().head(3).tolist()
-            analysis['sample_data'][col] = [str(x) for x in sample]
-            
-            # Calidad de datos
-            null_count = col_data.isnull().sum()
-            analysis['data_quality'][col] = {
-                'null_count': int(null_count),
-                'null_percentage': float(null_count / len(col_data) * 100) if len(col_data) > 0 else 0
-            }
-        
-        return analysis
-    
-    except Exception as e:
-        print(f"Error in comprehensive analysis: {e}")
-        return {}
-
 def analyze_data_for_chart(df: pd.DataFrame, chart_type: str = "auto"):
     """Analyze dataframe to determine best chart type and data"""
     if not EXCEL_CHARTS_AVAILABLE:
@@ -1352,8 +1254,7 @@ def store_analyzed_data(chat_id: int, data_type: str, categories: list, values:
         # cargar almacenamiento de datos existente
         storage_file = f"user_data_{chat_id}.json"
         if os.path.exists(storage_file):
-            with open(storage_file, 'r', encoding='utf-8') as f:
-                user_data = json.load(f)
+            user_data = load_file(storage_file)
         else:
             user_data = {'datasets': [], 'analyses': []}
         
@@ -1375,8 +1276,7 @@ def store_analyzed_data(chat_id: int, data_type: str, categories: list, values:
             user_data['datasets'] = user_data['datasets'][-10:]
         
         # guardar datos actualizados
-        with open(storage_file, 'w', encoding='utf-8') as f:
-            json.dump(user_data, f, ensure_ascii=False, indent=2)
+        dump_file(storage_file, user_data)
         
         return True
         
@@ -1389,11 +1289,10 @@ def get_last_analyzed_data(chat_id: int):
     try:
         storage_file = f"user_data_{chat_id}.json"
         if os.path.exists(storage_file):
-            with open(storage_file, 'r', encoding='utf-8') as f:
-                user_data = json.load(f)
-                datasets = user_data.get('datasets', [])
-                if datasets:
-                    return datasets[-1]  # devolver último conjunto de datos
+            user_data = load_file(storage_file)
+            datasets = user_data.get('datasets', [])
+            if datasets:
+                return datasets[-1]  # devolver último conjunto de datos
         return None
     except Exception as e:
         print(f"Error getting last analyzed data: {e}")
@@ -1404,9 +1303,8 @@ def get_stored_datasets(chat_id: int):
     try:
         storage_file = f"user_data_{chat_id}.json"
         if os.path.exists(storage_file):
-            with open(storage_file, 'r', encoding='utf-8') as f:
-                user_data = json.load(f)
-                return user_data.get('datasets', [])
+            user_data = load_file(storage_file)
+            return user_data.get('datasets', [])
         return []
     except Exception as e:
         print(f"Error retrieving stored datasets: {e}")
@@ -1625,6 +1523,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/echo <texto> - El bot devuelve el texto provisto\n"
         "/clear - Limpiar historial de conversación\n"
         "/memory - Ver historial de conversación\n"
+        "/usage - Ver consumo de tokens de hoy\n"
         "/audiolimit - Ver límite actual de caracteres para audio\n"
         "/setaudiolimit <número> - Cambiar límite de caracteres para audio\n"
         "/charthelp - Ayuda para generación de gráficos\n"
@@ -1632,6 +1531,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/creargrafica - Crear gráfico basado en análisis previo\n"
         "/datahistory - Ver historial de análisis de datos\n"
         "/cleardata - Limpiar historial de datos\n"
+        "/cancelexcel - Cancelar la lectura de un archivo Excel en curso\n"
         "🎤 Envía un mensaje de voz y recibirás transcripción + respuesta en audio" if VOICE_AVAILABLE else "🎤 Funcionalidad de voz temporalmente deshabilitada" + "\n"
         "📊 Envía un archivo Excel (.xlsx) para generar gráficos y análisis matemáticos" if EXCEL_CHARTS_AVAILABLE else "📊 Funcionalidad de Excel temporalmente deshabilitada" + "\n"
         "📈 Escribe datos descriptivos para generar gráficos automáticamente" if EXCEL_CHARTS_AVAILABLE else ""
@@ -1788,6 +1688,13 @@ async def clear_data_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     except Exception as e:
         await update.message.reply_text(f"❌ Error eliminando datos: {e}")
 
+async def cancel_excel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cancel this chat's Excel file still being read"""
+    if EXCEL_POOL.cancel(update.effective_chat.id):
+        await update.message.reply_text("🛑 Lectura del archivo Excel cancelada.")
+    else:
+        await update.message.reply_text("📊 No hay ningún archivo Excel en proceso.")
+
 async def analyze_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Analyze text data without generating chart"""
     chat_id = update.effective_chat.id
@@ -1905,7 +1812,7 @@ async def echo_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     gemini_key = os.getenv("GEMINI_API_KEY")
     if gemini_url and gemini_key:
         try:
-            response_text = await query_gemini_with_memory(text, chat_id, gemini_url, gemini_key)
+            response_text = await query_gemini_with_memory(text, chat_id, gemini_url, gemini_key, chat_type=update.effective_chat.type)
         except Exception as e:
             response_text = f"Error al llamar a Gemini: {e}"
     else:
@@ -1993,6 +1900,34 @@ async def set_audio_limit_command(update: Update, context: ContextTypes.DEFAULT_
     except ValueError:
         await update.message.reply_text("❌ Por favor ingresa un número válido")
 
+async def usage_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show today's token usage for this chat"""
+    chat_id = update.effective_chat.id
+    chat_usage = TOKEN_USAGE.get_chat_usage(chat_id)
+    
+    if not chat_usage:
+        await update.message.reply_text("No hay consumo de tokens registrado hoy.")
+        return
+    
+    status_text = {"ok": "✅ dentro del presupuesto", "soft": "⚠️ presupuesto suave superado (contexto reducido)", "hard": "⛔ presupuesto duro superado (modelo reducido)"}
+    chat_profiles = None
+    profile_state = PROFILE_MANAGER.get_profile_snapshot() if PROFILE_MANAGER else None
+    if profile_state:
+        chat_profiles = profile_state.get_chat_route(chat_id, update.effective_chat.type)
+    profile_key = profile_state.get_active_version_key(chat_profiles) if profile_state else ""
+    budget = TOKEN_USAGE.budget_status(chat_id, profile_key)
+    
+    usage_text = (
+        "📈 Consumo de tokens de hoy:\n\n"
+        f"• Llamadas: {chat_usage.get('calls', 0)}\n"
+        f"• Tokens de prompt: {chat_usage.get('prompt_tokens', 0)}\n"
+        f"• Tokens de respuesta: {chat_usage.get('response_tokens', 0)}\n"
+        f"• Total: {chat_usage.get('total_tokens', 0)}\n"
+        f"• Estimadas localmente: {chat_usage.get('estimated_calls', 0)}\n\n"
+        f"Estado: {status_text.get(budget, budget)}"
+    )
+    await update.message.reply_text(usage_text)
+
 async def memory_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     memory = get_chat_memory(chat_id)
@@ -2215,7 +2150,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if gemini_url and gemini_key:
         try:
-            response_text = await query_gemini_with_memory(user_message, chat_id, gemini_url, gemini_key)
+            response_text = await query_gemini_with_memory(user_message, chat_id, gemini_url, gemini_key, chat_type=update.effective_chat.type)
         except Exception as e:
             response_text = f"Error al llamar a Gemini: {e}"
     else:
@@ -2287,7 +2222,7 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
             if gemini_url and gemini_key:
                 try:
-                    response_text = await query_gemini_with_memory(transcription, chat_id, gemini_url, gemini_key)
+                    response_text = await query_gemini_with_memory(transcription, chat_id, gemini_url, gemini_key, chat_type=update.effective_chat.type)
                 except Exception as e:
                     response_text = f"Error al llamar a Gemini: {e}"
             else:
@@ -2353,13 +2288,37 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Descargar como bytes
         file_bytes = await file.download_as_bytearray()
         
-        # Crear objeto BytesIO para leer en memoria
-        file_buffer = io.BytesIO(file_bytes)
+        # leer y analizar en el pool de procesos; un archivo anterior del mismo chat se reemplaza
+        EXCEL_POOL.cancel(chat_id)
+        await processing_msg.edit_text("📊 Leyendo y analizando archivo Excel...")
         
-        # leer archivo Excel directamente desde memoria
-        await processing_msg.edit_text("📊 Leyendo archivo Excel...")
+        async def show_sample(sheet_name: str, sample: dict):
+            # primeras filas ya leídas: mostrar las columnas mientras se lee el resto
+            columns = ", ".join(sample["columns"][:8])
+            if len(sample["columns"]) > 8:
+                columns += f" (y {len(sample['columns']) - 8} más)"
+            await processing_msg.edit_text(
+                f"📊 Leyendo hoja '{sheet_name}'...\n\n"
+                f"Columnas: {columns or 'sin encabezados'}\n"
+                "El análisis completo llegará en cuanto termine la lectura."
+            )
         
-        sheets_info = read_excel_file(file_buffer)
+        try:
+            result = await EXCEL_POOL.run(bytes(file_bytes), key=chat_id, on_sample=show_sample)
+        except IngestQueueFull:
+            await processing_msg.edit_text("⏳ Hay muchos archivos en proceso. Intenta de nuevo en unos minutos.")
+            return
+        except IngestTimeout:
+            await processing_msg.edit_text(
+                f"⏱️ El archivo tardó más de {EXCEL_POOL.timeout:.0f} s en leerse y se canceló.\n\n"
+                "💡 Intenta con un archivo más pequeño o con menos hojas."
+            )
+            return
+        except IngestCancelled:
+            await processing_msg.edit_text("🛑 Lectura del archivo cancelada.")
+            return
+        
+        sheets_info = result.get("sheets")
         
         if not sheets_info:
             await processing_msg.edit_text(
@@ -2375,18 +2334,12 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        # Realizar análisis completo de cada hoja
-        await processing_msg.edit_text("📊 Analizando datos...")
-        
-        detailed_analysis = {}
+        # Análisis completo de cada hoja (ya calculado en el pool)
+        detailed_analysis = result["analysis"]
         sheets_summary = []
         
         for name, info in sheets_info.items():
-            df = info['dataframe']
-            
-            # Análisis completo de esta hoja
-            analysis = get_comprehensive_data_analysis(df)
-            detailed_analysis[name] = analysis
+            analysis = detailed_analysis[name]
             
             # Resumen para mostrar al usuario
             numeric_cols = len(analysis['numeric_columns'])
@@ -2404,6 +2357,8 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if num_cols_text:
                 sheet_info += f": {num_cols_text}"
             sheet_info += f"\n   • {text_cols} de texto, {date_cols} de fecha"
+            if info.get('truncated'):
+                sheet_info += f"\n   • ⚠️ Solo se leyeron las primeras {EXCEL_POOL.max_rows} filas"
             
             sheets_summary.append(sheet_info)
         
@@ -2491,8 +2446,11 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "🔄 Intenta de nuevo o contacta soporte si el problema persiste."
             )
 
-async def query_gemini_with_memory(prompt: str, chat_id: int, api_url: str, api_key: str, timeout: Optional[float] = 15.0) -> str:
-    """Send prompt with conversation history to Gemini API and return the text response."""
+async def query_gemini_with_memory(prompt: str, chat_id: int, api_url: str, api_key: str, timeout: Optional[float] = 15.0, chat_type: Optional[str] = None) -> str:
+    """Send prompt with conversation history to Gemini API and return the text response.
+
+    If profile sets are routed per chat or chat type, the chat's own set is used.
+    """
     # obtener historial de conversación
     memory = get_chat_memory(chat_id)
     
@@ -2525,19 +2483,37 @@ async def query_gemini_with_memory(prompt: str, chat_id: int, api_url: str, api_
     time_context = f"INFORMACIÓN DEL SISTEMA: Hoy es {day_name}, {date_str}. La hora actual es {time_str} ({tz.zone}). Usa esta información para responder preguntas sobre la fecha y hora actuales."
     conversation_parts.append({"text": f"system: {time_context}"})
     
-    # agregar contexto del perfil activo si existe
-    # Primero intentar leer desde archivo de sincronización (tiempo real)
-    profile_context = ""
-    if os.path.exists("active_profile_context.txt"):
-        try:
-            with open("active_profile_context.txt", 'r', encoding='utf-8') as f:
-                profile_context = f.read().strip()
-        except Exception as e:
-            print(f"Error leyendo contexto sincronizado: {e}")
+    # conjunto asignado al chat o a su tipo (None = el global sincronizado); todas las lecturas
+    # salen de una misma instantánea inmutable, aunque otro proceso edite los perfiles
+    chat_profiles = None
+    profile_state = None
+    if PROFILE_MANAGER:
+        PROFILE_MANAGER.reload_if_changed()
+        profile_state = PROFILE_MANAGER.get_profile_snapshot()
+        chat_profiles = profile_state.get_chat_route(chat_id, chat_type)
     
-    # Si no existe archivo, usar PROFILE_MANAGER
-    if not profile_context and PROFILE_MANAGER:
-        profile_context = PROFILE_MANAGER.get_active_profile_context()
+    # agregar contexto del perfil activo si existe
+    if PROFILE_CONTEXT_MODE == "retrieval" and PROFILE_MANAGER:
+        # solo los pasajes de KB/documentos relevantes al mensaje actual
+        profile_context = PROFILE_MANAGER.get_retrieval_context(prompt, RETRIEVAL_TOP_K, active_profiles=chat_profiles,
+                                                                state=profile_state)
+        report = PROFILE_MANAGER.last_retrieval_report
+        print(f"Contexto recuperado: {report.get('retrieved_tokens', 0)} tokens vs {report.get('full_tokens', 0)} completo ({report.get('reduction_pct', 0):.0f}% menos)")
+    elif chat_profiles is not None:
+        # contexto compilado por conjunto de perfiles, compartido entre chats (LRU)
+        profile_context = PROFILE_MANAGER.get_chat_context_snapshot(chat_id, chat_type, state=profile_state).text
+    else:
+        # el proveedor mantiene el archivo de sincronización en memoria y usa PROFILE_MANAGER como fallback
+        profile_context = PROFILE_CONTEXT.get()
+    
+    # aplicar presupuesto de tokens: recortar contexto y/o cambiar a modelo pequeño
+    profile_key = profile_state.get_active_version_key(chat_profiles) if profile_state else ""
+    budget = TOKEN_USAGE.budget_status(chat_id, profile_key)
+    if budget != BUDGET_OK:
+        profile_context = trim_to_lines(profile_context, BUDGET_CONTEXT_CHARS)
+        memory = memory[-BUDGET_MEMORY_ENTRIES:]
+        if budget == BUDGET_HARD and GEMINI_FALLBACK_API_URL:
+            api_url = GEMINI_FALLBACK_API_URL
     
     # Agregar contexto si existe
     if profile_context:
@@ -2553,155 +2529,10 @@ async def query_gemini_with_memory(prompt: str, chat_id: int, api_url: str, api_
     # unir contexto de conversación
     full_context = "\n".join([part["text"] for part in conversation_parts])
     
-    return await query_gemini(full_context, api_url, api_key, timeout)
-
-async def query_gemini(prompt: str, api_url: str, api_key: str, timeout: Optional[float] = 15.0) -> str:
-    """Send prompt to Gemini API and return the text response.
-
-    This expects the Gemini endpoint to accept a JSON payload like {"input": "..."}
-    and return a JSON with a `text` field. Adjust the payload parsing if your API
-    differs.
-    """
-    # preparar headers y url dependiendo de si la API key debe pasarse como parámetro de consulta (común para API keys) o como token Bearer.
-    # passed as a query parameter (common for API keys) o como token Bearer.
-    headers = {"Content-Type": "application/json"}
-    url = api_url
-
-    # si un archivo JSON de cuenta de servicio está disponible en el entorno, preferir token OAuth Bearer
-    sa_path = os.getenv("GEMINI_SA_PATH") or os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-    if sa_path and os.path.exists(sa_path):
-        # obtener un token de acceso con scope cloud-platform
-        creds = service_account.Credentials.from_service_account_file(sa_path, scopes=["https://www.googleapis.com/auth/cloud-platform"])
-        creds.refresh(GoogleRequest())
-        token = creds.token
-        headers["Authorization"] = f"Bearer {token}"
-        # no agregar API key cuando se usa OAuth
-        url = api_url
-    else:
-        # si la api_url no incluye ya un parámetro de API key, adjuntarlo para
-        # servicios que esperan ?key=API_KEY (por ejemplo, algunos puntos finales de Google cuando se usan API keys).
-        if api_key:
-            if "key=" not in api_url:
-                sep = "&" if "?" in api_url else "?"
-                url = f"{api_url}{sep}key={api_key}"
-            else:
-                url = api_url
-        else:
-            url = api_url
-
-        # si la url no contiene un parámetro de API key y la api_key parece
-        # un token (cadena larga), aún intentamos establecerlo como Bearer en el encabezado de Authorization
-        # encabezado en caso de que el servicio espere OAuth Bearer.
-        if api_key and "key=" not in url:
-            headers["Authorization"] = f"Bearer {api_key}"
-
-    # si la api_url no incluye ya un parámetro de API key, adjuntarlo para
-    # servicios que esperan ?key=API_KEY (por ejemplo, algunos puntos finales de Google cuando se usan API keys).
-    if api_key:
-        if "key=" not in api_url:
-            sep = "&" if "?" in api_url else "?"
-            url = f"{api_url}{sep}key={api_key}"
-        else:
-            url = api_url
-    else:
-        # no se proporcionó api_key: nada que agregar
-        url = api_url
-
-    # si la url no contiene un parámetro de API key y la api_key parece
-    # un token (cadena larga), aún intentamos establecerlo como Bearer en el encabezado de Authorization
-    # encabezado en caso de que el servicio espere OAuth Bearer.
-    if api_key and "key=" not in url:
-        headers["Authorization"] = f"Bearer {api_key}"
-
-    # elegir payloads dependiendo de la familia del punto final.
-    is_generate_content = (":generateContent" in url) or ("generativelanguage.googleapis.com" in url)
-    is_vertex_predict = (":predict" in url) or ("aiplatform.googleapis.com" in url)
-
-    if is_generate_content:
-        # Gemini APIs de lenguaje generativo esperan `contents`
-        payload_candidates = [
-            {"contents": [{"role": "user", "parts": [{"text": prompt}]}]},
-        ]
-    elif is_vertex_predict:
-        # Vertex AI Predict-style espera `instances` con un array `content`
-        payload_candidates = [
-            {"instances": [{"content": [{"role": "user", "parts": [{"text": prompt}]}]}]},
-        ]
-    else:
-        # intentar un conjunto más amplio (excluyendo las variantes problemáticas `input`)
-        payload_candidates = [
-            {"contents": [{"role": "user", "parts": [{"text": prompt}]}]},
-            {"prompt": {"text": prompt}},
-            {"instances": [{"content": prompt}]},
-            {"instances": [{"content": [{"type": "text", "text": prompt}]}]},
-        ]
-
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        last_exc = None
-        for payload in payload_candidates:
-            try:
-                r = await client.post(url, json=payload, headers=headers)
-                # si es exitoso (2xx), parsear y devolver
-                if 200 <= r.status_code < 300:
-                    try:
-                        data = r.json()
-                    except Exception:
-                        return r.text
-
-                    # parsear varias formas comunes de respuesta
-                    if isinstance(data, dict):
-                        # texto directo
-                        if "text" in data:
-                            return data["text"]
-                        # salida anidada.text
-                        if "output" in data and isinstance(data["output"], dict) and "text" in data["output"]:
-                            return data["output"]["text"]
-                        # Gemini candidates[].content.parts[].text (candidatos de Gemini)
-                        if "candidates" in data and isinstance(data["candidates"], list) and data["candidates"]:
-                            cand0 = data["candidates"][0]
-                            if isinstance(cand0, dict):
-                                # algunos endpoints devuelven texto de nivel superior
-                                if "text" in cand0:
-                                    return cand0["text"]
-                                # lenguaje generativo: content.parts
-                                content = cand0.get("content")
-                                if isinstance(content, dict):
-                                    parts = content.get("parts")
-                                    if isinstance(parts, list) and parts:
-                                        part0 = parts[0]
-                                        if isinstance(part0, dict) and "text" in part0:
-                                            return part0["text"]
-                        # fallback stringify si la estructura es desconocida
-                        return str(data)
-                    return r.text
-                else:
-                    # registrar cuerpo de error para depuración, pero intentar siguiente payload
-                    last_exc = (r.status_code, r.text)
-            except Exception as e:
-                last_exc = e
-
-        # si llegamos aquí, todos los payloads fallaron; proporcionar error útil
-        if isinstance(last_exc, tuple):
-            status, body = last_exc
-            raise RuntimeError(f"Request failed with status {status}: {body}")
-        raise RuntimeError(f"Request failed: {last_exc}")
-
-    # intentar varias formas comunes de respuesta
-    if isinstance(data, dict):
-        # común: {"text": "..."}
-        if "text" in data:
-            return data["text"]
-        # otra forma común: {"output": {"text": "..."}}
-        if "output" in data and isinstance(data["output"], dict) and "text" in data["output"]:
-            return data["output"]["text"]
-        # si la API devuelve una lista de fragmentos
-        if "candidates" in data and isinstance(data["candidates"], list) and data["candidates"]:
-            first = data["candidates"][0]
-            if isinstance(first, dict) and "text" in first:
-                return first["text"]
-
-    # fallback: stringify toda la respuesta
-    return str(data)
+    usage = {}
+    response_text = await query_gemini(full_context, api_url, api_key, timeout, usage=usage)
+    TOKEN_USAGE.record(chat_id, profile_key, full_context, response_text, usage)
+    return response_text
 
 
 def main():
@@ -2716,6 +2547,7 @@ def main():
     app.add_handler(CommandHandler("echo", echo_command))
     app.add_handler(CommandHandler("clear", clear_command))
     app.add_handler(CommandHandler("memory", memory_command))
+    app.add_handler(CommandHandler("usage", usage_command))
     app.add_handler(CommandHandler("audiolimit", audio_limit_command))
     app.add_handler(CommandHandler("setaudiolimit", set_audio_limit_command))
     app.add_handler(CommandHandler("charthelp", chart_help_command))
@@ -2723,9 +2555,11 @@ def main():
     app.add_handler(CommandHandler("creargrafica", create_chart_command))
     app.add_handler(CommandHandler("datahistory", data_history_command))
     app.add_handler(CommandHandler("cleardata", clear_data_command))
+    app.add_handler(CommandHandler("cancelexcel", cancel_excel_command))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     app.add_handler(MessageHandler(filters.VOICE, handle_voice))
-    app.add_handler(MessageHandler(filters.Document.ALL, handle_document))
+    # block=False: mientras un archivo se lee en el pool, las demás actualizaciones siguen procesándose
+    app.add_handler(MessageHandler(filters.Document.ALL, handle_document, block=False))
 
     print("Bot con memoria en ejecución... presiona Ctrl+C para detenerlo.")
 
@@ -2733,6 +2567,10 @@ def main():
     def _stop(signum, frame):
         print("Deteniendo bot...")
         save_memory()  # guardar memoria antes de cerrar
+        TOKEN_USAGE.save()  # guardar consumo de tokens pendiente
+        if isinstance(PROFILE_CONTEXT, ContextSubscriber):
+            PROFILE_CONTEXT.stop()
+        EXCEL_POOL.shutdown()
         app.stop()
 
     try:
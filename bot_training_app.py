@@ -7,6 +7,8 @@ CON AUTENTICACIÓN Y SINCRONIZACIÓN EN TIEMPO REAL
 import streamlit as st
 import os
 from profile_manager import ProfileManager
+from token_usage import estimate_tokens
+from context_feed import ContextFeed, format_status
 from datetime import datetime
 import json
 import hashlib
@@ -235,6 +237,11 @@ def logout():
     st.session_state.login_time = None
     st.rerun()
 
+@st.cache_resource
+def get_context_feed():
+    """Feed SQLite por el que se publica el contexto a todos los procesos del bot"""
+    return ContextFeed(os.getenv("CONTEXT_FEED_PATH", "context_feed.db"))
+
 def sync_context_to_bot():
     """Sincronizar contexto del perfil activo al bot EN TIEMPO REAL
     
@@ -243,8 +250,10 @@ def sync_context_to_bot():
     try:
         pm = st.session_state.profile_manager
         
-        # Usar contexto combinado de múltiples perfiles
-        context = pm.get_multi_profile_context()
+        # Usar contexto combinado de múltiples perfiles (compilado desde fragmentos cacheados),
+        # ajustado al presupuesto de tokens si está configurado
+        snapshot = pm.get_packed_context_snapshot()
+        context = snapshot.text
         
         # Guardar contexto en archivo que el bot lee
         with open("active_profile_context.txt", 'w', encoding='utf-8') as f:
@@ -257,12 +266,22 @@ def sync_context_to_bot():
             "profile": pm.profiles.get("active_profile"),  # Retrocompatibilidad
             "active_profiles": active_profiles,
             "context_length": len(context),
+            "snapshot_id": snapshot.id,
+            "pack_report": pm.last_pack_report,
+            "dedup_tokens_saved": pm.get_dedup_report().get("tokens_saved", 0),
             "multi_profile_mode": len(active_profiles) > 1
         }
         
         with open("sync_status.json", 'w', encoding='utf-8') as f:
             json.dump(sync_info, f, ensure_ascii=False, indent=2)
         
+        # Publicar la versión nueva para los bots suscritos al feed
+        feed_version = get_context_feed().publish(context, snapshot.id, metadata={
+            "active_profiles": [ap["name"] for ap in active_profiles],
+            "context_length": len(context)
+        })
+        st.session_state.last_feed_version = feed_version
+        
         return True
     except Exception as e:
         st.error(f"Error sincronizando: {e}")
@@ -290,6 +309,9 @@ if not check_session():
     st.stop()
 
 pm = st.session_state.profile_manager
+# Cada sesión tiene su propio gestor: recoger lo que guardaron otras sesiones o
+# procesos antes de editar (con SQLite, guardar sobre datos viejos lanza StaleStoreError)
+pm.reload_if_changed(0)
 
 # Sistema de Tema (Modo Oscuro/Claro)
 if 'dark_mode' not in st.session_state:
@@ -1135,7 +1157,7 @@ elif page == "📊  Perfiles":
                         profile_data = pm.get_profile(export_profile)
                         st.download_button(
                             "⬇️ Descargar archivo",
-                            json.dumps(profile_data, ensure_ascii=False, indent=2),
+                            json.dumps(profile_data, ensure_ascii=False, indent=2, default=dict),
                             file_name=export_filename,
                             mime="application/json"
                         )
@@ -1545,9 +1567,15 @@ documents,documento1::contenido del documento 1||documento2::contenido del docum
                             with open(temp_path, 'wb') as f:
                                 f.write(uploaded_catalog.getvalue())
                             
-                            # Importar catálogo
+                            # Importar catálogo (fila a fila, con barra de progreso)
                             profile_name_to_use = catalog_profile_name if catalog_profile_name else None
-                            imported_name = pm.import_vehicle_catalog_from_csv(temp_path, profile_name_to_use)
+                            progress_bar = st.progress(0.0, text="Importando vehículos...")
+                            imported_name = pm.import_vehicle_catalog_from_csv(
+                                temp_path, profile_name_to_use,
+                                progress=lambda rows, fraction: progress_bar.progress(
+                                    fraction, text=f"Importando vehículos... {rows} filas")
+                            )
+                            progress_bar.empty()
                             
                             # Limpiar archivo temporal
                             os.remove(temp_path)
@@ -1834,6 +1862,17 @@ elif page == "📝  Editor de Versiones":
                                 st.rerun()
                             except ValueError as e:
                                 st.error(f"❌ {e}")
+                
+                with col3:
+                    # Las versiones etiquetadas se conservan al compactar (Configuración → General)
+                    version_tags = pm.get_version_tags(selected_profile, int(selected_version))
+                    if version_tags:
+                        st.caption("🏷️ " + ", ".join(version_tags))
+                    new_tag = st.text_input("Etiqueta", key=f"tag_{selected_profile}_{selected_version}",
+                                            placeholder="producción", label_visibility="collapsed")
+                    if st.button("🏷️ Etiquetar versión", use_container_width=True) and new_tag.strip():
+                        pm.tag_version(selected_profile, int(selected_version), new_tag)
+                        st.rerun()
 
 # ===== PÁGINA: DOCUMENTOS =====
 elif page == "📚  Documentos":
@@ -1876,6 +1915,8 @@ elif page == "📚  Documentos":
                                     st.write(f"**Tipo:** {doc['type']}")
                                     added = datetime.fromisoformat(doc['added_at']).strftime("%d/%m/%Y %H:%M")
                                     st.write(f"**Agregado:** {added}")
+                                    passages = pm.get_document_passages(selected_profile, int(selected_version), idx)
+                                    st.write(f"**Pasajes:** {len(passages)}")
                                     st.text_area("Contenido", value=doc['content'], height=200, disabled=True, key=f"doc_{idx}")
                                 
                                 with col2:
@@ -1999,6 +2040,33 @@ elif page == "⚙️  Configuración":
         if st.button("💾 Forzar Guardado"):
             pm._save_profiles()
             st.success("✅ Perfiles guardados")
+        
+        st.markdown("---")
+        st.markdown("**🧹 Retención de versiones**")
+        st.caption("Se conservan siempre la versión activa y, si se indica, las etiquetadas.")
+        retention = pm.get_version_retention()
+        col_keep, col_tagged, col_auto = st.columns(3)
+        with col_keep:
+            keep_last = st.number_input("Conservar últimas N (0 = todas)", min_value=0,
+                                        value=int(retention["keep_last"]), step=1)
+        with col_tagged:
+            keep_tagged = st.checkbox("Conservar etiquetadas", value=retention["keep_tagged"])
+        with col_auto:
+            auto_prune = st.checkbox("Aplicar al crear versiones", value=retention["auto"])
+        
+        col_save, col_compact = st.columns(2)
+        with col_save:
+            if st.button("💾 Guardar política", use_container_width=True):
+                pm.set_version_retention(keep_last, keep_tagged, auto_prune)
+                st.success("✅ Política de retención guardada")
+        with col_compact:
+            if st.button("🧹 Compactar ahora", use_container_width=True, disabled=keep_last == 0):
+                report = pm.compact_versions(keep_last, keep_tagged)
+                st.success(f"✅ {report['versions_removed']} versión(es) eliminada(s); "
+                           f"{report['reclaimed_bytes'] / 1e6:.1f} MB recuperados "
+                           f"({report['bytes_before'] / 1e6:.1f} → {report['bytes_after'] / 1e6:.1f} MB)")
+                st.caption(f"Carga {report['load_seconds_before'] * 1e3:.0f} → {report['load_seconds_after'] * 1e3:.0f} ms · "
+                           f"guardado {report['save_seconds_before'] * 1e3:.0f} → {report['save_seconds_after'] * 1e3:.0f} ms")
     
     with tab2:
         st.subheader("Vista Previa del Contexto Activo")
@@ -2020,20 +2088,61 @@ elif page == "⚙️  Configuración":
             st.text_area("Contexto completo que se enviará al bot:", value=context, height=400)
             
             # Estadísticas del contexto
-            col1, col2, col3 = st.columns(3)
+            compact_context = pm.get_multi_profile_context(compact=True)
+            col1, col2, col3, col4 = st.columns(4)
             with col1:
                 st.metric("Caracteres", len(context))
             with col2:
-                st.metric("Palabras", len(context.split()))
+                st.metric("Tokens (legible)", estimate_tokens(context))
             with col3:
+                st.metric("Tokens (compacto)", estimate_tokens(compact_context),
+                          delta=estimate_tokens(compact_context) - estimate_tokens(context), delta_color="inverse")
+            with col4:
                 st.metric("Perfiles Activos", len(active_profiles))
             
+            with st.expander("Ver forma compacta (la que recibe el bot en modo compacto)"):
+                st.text_area("Contexto compacto:", value=compact_context, height=300)
+            
+            # Contenido repetido entre perfiles eliminado al compilar
+            dedup_report = pm.get_dedup_report()
+            if dedup_report.get("duplicates"):
+                st.caption(f"♻️ {len(dedup_report['duplicates'])} párrafos duplicados entre perfiles eliminados: "
+                           f"{dedup_report['bytes_saved']} bytes / ~{dedup_report['tokens_saved']} tokens ahorrados")
+                with st.expander("Ver duplicados eliminados"):
+                    for dup in dedup_report["duplicates"]:
+                        st.caption(f"• {dup['section']} de {dup['profile']} (se conserva en {dup['kept_in']}): "
+                                   f"{dup['preview']}…")
+            
             st.download_button(
                 "⬇️ Descargar Contexto",
                 context,
                 file_name="bot_context.txt",
                 mime="text/plain"
             )
+            
+            # Comparar con el modo de recuperación (PROFILE_CONTEXT_MODE=retrieval en el bot)
+            st.markdown("---")
+            st.subheader("🔍 Prueba de Recuperación de Pasajes")
+            test_query = st.text_input("Mensaje de prueba", placeholder="Ej: SUV automática de 7 asientos")
+            if test_query:
+                retrieval_context = pm.get_retrieval_context(test_query)
+                report = pm.last_retrieval_report
+                
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("Tokens (completo)", report["full_tokens"])
+                with col2:
+                    st.metric("Tokens (recuperación)", report["retrieved_tokens"])
+                with col3:
+                    st.metric("Reducción", f"{report['reduction_pct']:.0f}%")
+                
+                if report["passages"]:
+                    for profile_name, title, score in report["passages"]:
+                        st.caption(f"• {title} ({profile_name}) — puntuación {score}")
+                else:
+                    st.caption("Ningún pasaje relevante: solo se envían las secciones siempre activas")
+                
+                st.text_area("Contexto con pasajes recuperados:", value=retrieval_context, height=300)
         else:
             st.info("No hay perfil activo para mostrar")
     
@@ -2048,11 +2157,95 @@ elif page == "⚙️  Configuración":
         3. Guardar todos los cambios antes de probar
         """)
         
+        # Forma del contexto que recibe el bot
+        render_modes = {"compact": "Compacta (clave: valor, sin decoración)", "pretty": "Legible (con separadores y emojis)"}
+        current_mode = "compact" if pm.is_compact_context() else "pretty"
+        render_mode = st.radio("Formato del contexto enviado al bot", list(render_modes),
+                               format_func=render_modes.get, index=list(render_modes).index(current_mode))
+        if render_mode != current_mode:
+            pm.set_context_render_mode(render_mode)
+        
+        # Deduplicación de contenido entre perfiles
+        dedup = st.checkbox("Eliminar párrafos duplicados entre perfiles", value=pm.is_context_dedup_enabled(),
+                            help="Se conserva la copia del perfil de mayor prioridad")
+        if dedup != pm.is_context_dedup_enabled():
+            pm.set_context_dedup(dedup)
+        
+        # Presupuesto de tokens del contexto combinado
+        budget = st.number_input(
+            "Presupuesto de tokens del contexto (0 = sin límite)",
+            min_value=0, step=500, value=pm.get_context_token_budget(),
+            help="Siempre se conservan el system prompt y las restricciones del perfil de prioridad 1; "
+                 "el resto se llena por prioridad hasta el presupuesto"
+        )
+        if budget != pm.get_context_token_budget():
+            pm.set_context_token_budget(budget)
+        
+        if budget:
+            pm.get_packed_context_snapshot(budget)
+            report = pm.last_pack_report
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("Tokens (completo)", report["original_tokens"])
+            with col2:
+                st.metric("Tokens (empaquetado)", report["tokens"])
+            if report["over_budget"]:
+                st.warning("⚠️ El system prompt y las restricciones del perfil principal ya superan el presupuesto")
+            for item in report["truncated"]:
+                st.caption(f"✂️ Recortado: {item['section']} ({item['profile']}) "
+                           f"{item['tokens']} → {item['kept_tokens']} tokens")
+            for item in report["dropped"]:
+                st.caption(f"🗑️ Descartado: {item['section']} ({item['profile']}) — {item['tokens']} tokens")
+        
         if st.button("🔄 Sincronizar Ahora"):
             # Usar la función de sincronización actualizada
             if sync_context_to_bot():
                 st.success("✅ Contexto multi-perfil sincronizado con el bot")
                 st.balloons()
+        
+        # Estado de la distribución a los procesos del bot
+        st.markdown("---")
+        st.subheader("📡 Procesos del Bot")
+        feed_status = get_context_feed().status()
+        if feed_status["workers"]:
+            for line in format_status(feed_status):
+                st.caption(line)
+        elif feed_status["latest"]:
+            st.caption(f"Versión publicada: v{feed_status['latest']['version']}. "
+                       "Ningún bot suscrito (define CONTEXT_FEED_PATH en el bot)")
+        else:
+            st.caption("Todavía no se ha publicado ningún contexto")
+        if st.button("🔄 Actualizar estado"):
+            st.rerun()
+        
+        # Perfiles por chat o por tipo de chat
+        st.markdown("---")
+        st.subheader("💬 Perfiles por Chat")
+        st.caption("Los chats sin asignación usan los perfiles activos globales. "
+                   "Tipos de chat: private, group, supergroup, channel")
+        
+        routes = pm.get_chat_routes()
+        for bucket, label in (("chat_types", "Tipo"), ("chats", "Chat")):
+            for chat_key, chat_profiles in routes[bucket].items():
+                col1, col2 = st.columns([4, 1])
+                with col1:
+                    names = ", ".join(f"{p['name']} (P{p['priority']})" for p in chat_profiles)
+                    st.write(f"**{label} {chat_key}:** {names}")
+                with col2:
+                    if st.button("🗑️", key=f"route_del_{bucket}_{chat_key}"):
+                        pm.set_chat_profiles(chat_key, [])
+                        st.rerun()
+        
+        with st.form("chat_route_form"):
+            chat_key = st.text_input("Id del chat o tipo de chat", placeholder="Ej: -1001234567890 o group")
+            selected = st.multiselect("Perfiles (en orden de prioridad)", list(pm.get_all_profiles().keys()))
+            if st.form_submit_button("💾 Guardar Asignación") and chat_key.strip():
+                chat_profiles = [{"name": name, "priority": idx} for idx, name in enumerate(selected, 1)]
+                if pm.set_chat_profiles(chat_key.strip(), chat_profiles):
+                    st.success("✅ Asignación guardada (el bot la aplica en el siguiente mensaje)")
+                    st.rerun()
+                else:
+                    st.error("Alguno de los perfiles no existe")
 
 # Footer
 st.markdown("---")
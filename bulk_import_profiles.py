@@ -0,0 +1,53 @@
+"""
+Importación masiva de perfiles y catálogos de vehículos desde un directorio
+Lee y valida en paralelo todos los CSV del directorio (perfiles en formato
+Campo,Valor y catálogos con columnas marca y modelo), los aplica en un solo
+guardado y muestra un reporte con los tiempos de cada archivo
+
+Uso:
+    python bulk_import_profiles.py importaciones/
+    python bulk_import_profiles.py importaciones/ --workers 4 --skip-invalid
+    python bulk_import_profiles.py importaciones/ --dry-run --json reporte.json
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from profile_import import format_import_report
+from profile_manager import ProfileManager
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="Directorio con los CSV a importar")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Procesos para leer los CSV (por defecto, uno por CPU)")
+    parser.add_argument("--skip-invalid", action="store_true",
+                        help="Importar los archivos válidos aunque haya inválidos")
+    parser.add_argument("--dry-run", action="store_true", help="Solo leer y validar, sin guardar")
+    parser.add_argument("--profiles-file", default=None,
+                        help="Archivo de perfiles (por defecto PROFILES_FILE o bot_profiles.json)")
+    parser.add_argument("--json", dest="json_path", default=None, help="Guardar también el reporte en JSON")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        print(f"❌ {args.directory} no es un directorio")
+        sys.exit(1)
+
+    pm = ProfileManager(args.profiles_file)
+    report = pm.import_csv_directory(args.directory, workers=args.workers, skip_invalid=args.skip_invalid,
+                                     dry_run=args.dry_run)
+    print("\n".join(format_import_report(report)))
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if report["error"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
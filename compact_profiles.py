@@ -0,0 +1,63 @@
+"""
+Compactación de versiones de perfiles
+Aplica la política de retención (últimas N versiones, la activa y las
+etiquetadas) a todos los perfiles, reescribe el almacenamiento de una vez y
+muestra el espacio recuperado y el efecto en la carga y el guardado
+
+Uso:
+    python compact_profiles.py --keep-last 5
+    python compact_profiles.py --keep-last 5 --dry-run
+    python compact_profiles.py --keep-last 10 --save-policy --auto
+"""
+
+import argparse
+import sys
+
+from profile_manager import ProfileManager
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keep-last", type=int, default=None,
+                        help="Versiones más recientes a conservar por perfil (por defecto, la política guardada)")
+    parser.add_argument("--no-keep-tagged", action="store_true", help="No conservar las versiones etiquetadas")
+    parser.add_argument("--dry-run", action="store_true", help="Solo mostrar qué versiones se eliminarían")
+    parser.add_argument("--save-policy", action="store_true", help="Guardar --keep-last como política de retención")
+    parser.add_argument("--auto", action="store_true",
+                        help="Con --save-policy, aplicar la política al crear cada versión nueva")
+    parser.add_argument("--profiles-file", default=None,
+                        help="Archivo de perfiles (por defecto PROFILES_FILE o bot_profiles.json)")
+    args = parser.parse_args()
+
+    pm = ProfileManager(args.profiles_file)
+    keep_tagged = False if args.no_keep_tagged else None
+    if args.save_policy:
+        if args.keep_last is None:
+            parser.error("--save-policy requiere --keep-last")
+        pm.set_version_retention(args.keep_last, not args.no_keep_tagged, args.auto)
+
+    policy = pm.get_version_retention()
+    keep_last = policy["keep_last"] if args.keep_last is None else args.keep_last
+    if keep_last <= 0:
+        print("Sin política de retención (keep_last = 0): no se elimina ninguna versión")
+        sys.exit(1)
+
+    report = pm.compact_versions(args.keep_last, keep_tagged, dry_run=args.dry_run)
+    for name, versions in report["pruned"].items():
+        print(f"{name}: {'se eliminarían' if args.dry_run else 'eliminadas'} las versiones "
+              f"{', '.join(str(v) for v in versions)}")
+    print(f"{report['versions_removed']} versión(es) {'a eliminar' if args.dry_run else 'eliminada(s)'} "
+          f"(se conservan las {keep_last} más recientes, la activa"
+          f"{'' if args.no_keep_tagged or not policy['keep_tagged'] else ' y las etiquetadas'})")
+    if args.dry_run:
+        return
+
+    print(f"Tamaño: {report['bytes_before'] / 1e6:.1f} MB → {report['bytes_after'] / 1e6:.1f} MB "
+          f"({report['reclaimed_bytes'] / 1e6:.1f} MB recuperados)")
+    print(f"Carga: {report['load_seconds_before'] * 1e3:.0f} ms → {report['load_seconds_after'] * 1e3:.0f} ms; "
+          f"guardado: {report['save_seconds_before'] * 1e3:.0f} ms → {report['save_seconds_after'] * 1e3:.0f} ms; "
+          f"compactación: {report['compact_seconds'] * 1e3:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
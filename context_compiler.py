@@ -0,0 +1,468 @@
+"""
+Compilador de contexto por fragmentos con caché por hash de contenido
+Renderiza cada fragmento (perfil, versión, sección) una sola vez y arma el
+contexto combinado a partir de fragmentos cacheados; solo se recompilan las
+secciones cuyo contenido cambió
+"""
+
+import hashlib
+import json
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from context_dedup import dedup_fragments
+from token_usage import estimate_tokens
+from vehicle_catalog import VehicleCatalogIndex, kb_value_hash
+
+SEPARATOR = "=" * 80
+
+# Orden de las secciones de cada perfil dentro del contexto combinado
+PROFILE_SECTIONS = ["system_prompt", "context", "instructions", "knowledge_base",
+                    "examples", "restrictions", "documents"]
+REFERENCE_SECTIONS = {"knowledge_base", "documents"}
+
+
+def content_hash(*parts) -> str:
+    """Hash estable de contenido (sha1 sobre JSON canónico)"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def render_section(section: str, version: Dict, profile_name: str, is_main: bool) -> List[str]:
+    """Renderizar una sección de una versión como lista de líneas (vacía si no aplica)"""
+    parts = []
+    if section == "system_prompt" and version.get("system_prompt"):
+        if is_main:  # Solo el perfil principal tiene system prompt
+            parts.append(f"SYSTEM PROMPT:\n{version['system_prompt']}\n")
+        else:
+            parts.append(f"CONTEXTO ADICIONAL ({profile_name}):\n{version['system_prompt']}\n")
+    elif section == "context" and version.get("context"):
+        parts.append(f"CONTEXTO:\n{version['context']}\n")
+    elif section == "instructions" and version.get("instructions"):
+        parts.append(f"INSTRUCCIONES ({profile_name}):")
+        for idx_inst, instruction in enumerate(version["instructions"], 1):
+            parts.append(f"{idx_inst}. {instruction}")
+        parts.append("")
+    elif section == "knowledge_base" and version.get("knowledge_base"):
+        parts.append(f"BASE DE CONOCIMIENTOS ({profile_name}):")
+        for key, data in version["knowledge_base"].items():
+            parts.append(f"• {key}: {data['value']}")
+        parts.append("")
+    elif section == "examples" and version.get("examples"):
+        parts.append(f"EJEMPLOS ({profile_name}):")
+        for example in version["examples"]:
+            parts.append(f"• {example}")
+        parts.append("")
+    elif section == "restrictions" and version.get("restrictions"):
+        parts.append(f"RESTRICCIONES ({profile_name}):")
+        for restriction in version["restrictions"]:
+            parts.append(f"• {restriction}")
+        parts.append("")
+    elif section == "documents" and version.get("documents"):
+        parts.append(f"DOCUMENTOS DE REFERENCIA ({profile_name}):")
+        for doc in version["documents"]:
+            parts.append(f"\n--- {doc['name']} ---")
+            parts.append(doc['content'])
+        parts.append("")
+    return parts
+
+
+# ===== RENDERIZADO COMPACTO =====
+
+_DECORATION_RE = re.compile(r"^[\s━═─=\-_*~·.]*$")
+_BULLET_RE = re.compile(r"^\s*(?:[•\-*]|\d+\.)\s+")
+_KEY_VALUE_RE = re.compile(r"^[^:]{1,60}:\s")
+
+
+def _strip_symbols(text: str) -> str:
+    """Eliminar emojis y símbolos decorativos"""
+    return "".join(c for c in text if unicodedata.category(c) not in ("So", "Sk", "Cs", "Mn")
+                   or c in "°").strip()
+
+
+def _is_missing(value: str) -> bool:
+    value = value.strip()
+    return not value or value.upper().startswith("N/A") or value in ("-", "None")
+
+
+def compact_text(text: str, flatten: bool = False) -> List[str]:
+    """Líneas densas de un texto decorado: sin reglas, emojis, líneas vacías ni campos N/A
+
+    Con flatten=True (valores de la base de conocimientos) además se quitan las
+    viñetas y un encabezado "TÍTULO:" se une a la línea suelta que lo sigue
+    ("título: valor") o se descarta si lo siguen ítems con viñeta.
+    """
+    lines = []
+    for raw in text.split("\n"):
+        if _DECORATION_RE.match(raw):
+            continue
+        bullet = _BULLET_RE.match(raw)
+        line = _strip_symbols(raw[bullet.end():] if bullet and flatten else raw)
+        if not line:
+            continue
+        if ":" in line:
+            key, value = line.split(":", 1)
+            if flatten and not value.strip() and not bullet:
+                lines.append((key.strip(), None))  # encabezado pendiente
+                continue
+            if value.strip() and _is_missing(value):
+                continue
+        lines.append((line, "line"))
+
+    result = []
+    for idx, (line, kind) in enumerate(lines):
+        if kind is None:
+            following = lines[idx + 1] if idx + 1 < len(lines) else None
+            # Encabezado sin contenido propio: unirlo a la siguiente línea suelta
+            if following and following[1] == "line" and not _KEY_VALUE_RE.match(following[0]):
+                label = line.lower() if line.isupper() else line
+                lines[idx + 1] = (f"{label}: {following[0]}", "line")
+            continue
+        result.append(line)
+    return result
+
+
+def _catalog_rows(version: Dict) -> Dict[str, Tuple[str, str]]:
+    """kb_key -> (línea compacta, huella de la ficha importada) de cada vehículo del catálogo
+
+    Los catálogos importados antes de guardar las huellas no tienen ninguna:
+    sus fichas se muestran desde la base de conocimientos.
+    """
+    catalog = version.get("vehicle_catalog")
+    if not catalog or not catalog.get("kb_hashes"):
+        return {}
+    index = VehicleCatalogIndex.from_dict(catalog)
+    keys = index.text["kb_key"]
+    return {key: (line[2:], digest)
+            for key, digest, line in zip(keys, catalog["kb_hashes"], index.render_rows(range(index.size)))
+            if key and digest}
+
+
+def render_section_compact(section: str, version: Dict, profile_name: str, is_main: bool) -> List[str]:
+    """Variante compacta de render_section: líneas clave:valor sin decoración"""
+    parts = []
+    if section == "system_prompt" and version.get("system_prompt"):
+        label = "SYSTEM PROMPT" if is_main else f"CONTEXTO ADICIONAL ({profile_name})"
+        parts = [f"{label}:"] + compact_text(version["system_prompt"])
+    elif section == "context" and version.get("context"):
+        parts = ["CONTEXTO:"] + compact_text(version["context"])
+    elif section == "instructions" and version.get("instructions"):
+        parts = [f"INSTRUCCIONES ({profile_name}):"]
+        parts += [f"{idx}. {inst}" for idx, inst in enumerate(version["instructions"], 1)]
+    elif section == "knowledge_base" and version.get("knowledge_base"):
+        catalog = _catalog_rows(version)
+        parts = [f"BASE DE CONOCIMIENTOS ({profile_name}):"]
+        for key, data in version["knowledge_base"].items():
+            row = catalog.get(key)
+            # La línea del catálogo solo vale mientras la ficha siga como se importó
+            if row is not None and row[1] == kb_value_hash(data["value"]):
+                parts.append(f"• {row[0]}")
+            else:
+                value = "; ".join(compact_text(str(data["value"]), flatten=True))
+                if value:
+                    parts.append(f"• {key}: {value}")
+    elif section == "examples" and version.get("examples"):
+        parts = [f"EJEMPLOS ({profile_name}):"] + [f"• {example}" for example in version["examples"]]
+    elif section == "restrictions" and version.get("restrictions"):
+        parts = [f"RESTRICCIONES ({profile_name}):"] + [f"• {r}" for r in version["restrictions"]]
+    elif section == "documents" and version.get("documents"):
+        parts = [f"DOCUMENTOS DE REFERENCIA ({profile_name}):"]
+        for doc in version["documents"]:
+            parts.append(f"[{doc['name']}]")
+            parts.extend(compact_text(doc["content"]))
+    return parts
+
+
+def _section_source(section: str, version: Dict):
+    """Datos de origen de una sección (lo que determina su hash)"""
+    if section == "knowledge_base":
+        return [(key, data.get("value")) for key, data in version.get("knowledge_base", {}).items()]
+    if section == "documents":
+        return [(doc.get("name"), doc.get("content")) for doc in version.get("documents", [])]
+    return version.get(section)
+
+
+class ContextSnapshot:
+    """Contexto compilado e inmutable con un id estable derivado de sus fragmentos"""
+
+    def __init__(self, fragments: List[Dict]):
+        self.fragments = fragments
+        self.id = hashlib.sha1("".join(f["hash"] for f in fragments).encode("utf-8")).hexdigest()[:16]
+        self.text = "\n".join(f["text"] for f in fragments)
+
+    def __len__(self):
+        return len(self.text)
+
+
+class SnapshotLRU:
+    """Caché LRU de contextos compilados, compartida entre chats con el mismo conjunto de perfiles"""
+
+    def __init__(self, maxsize: int = 32):
+        self.maxsize = maxsize
+        self._items: "OrderedDict[Tuple, object]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple):
+        value = self._items.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Tuple, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class ContextCompiler:
+    """Arma contextos combinados reutilizando fragmentos ya renderizados
+
+    Por cada (perfil, versión) se guarda el last_modified del perfil: si no
+    cambió, sus fragmentos se reutilizan sin volver a hashear. Si cambió, se
+    hashea cada sección y solo se re-renderizan las que tienen hash nuevo.
+    """
+
+    def __init__(self):
+        self._fragments: Dict[str, str] = {}
+        self._versions: Dict[Tuple, Tuple[str, List[Dict]]] = {}
+        self._dedup_cache = SnapshotLRU(maxsize=16)
+        self.last_dedup_report: Dict = {}
+        self.rendered = 0
+        self.reused = 0
+
+    def _fragment(self, key: str, profile: str, priority, section: str, render) -> Optional[Dict]:
+        text = self._fragments.get(key)
+        if text is None:
+            text = "\n".join(render())
+            self._fragments[key] = text
+            self.rendered += 1
+        else:
+            self.reused += 1
+        if not text and section in PROFILE_SECTIONS:
+            return None
+        return {"hash": key, "profile": profile, "priority": priority, "section": section, "text": text}
+
+    def _profile_fragments(self, profile: Dict, version: Dict, priority, is_main: bool, multi: bool,
+                           compact: bool = False) -> List[Dict]:
+        name = profile["name"]
+        cache_key = (name, version.get("version"), priority, is_main, multi, compact)
+        stamp = profile.get("last_modified", "")
+        cached = self._versions.get(cache_key)
+        if cached and cached[0] == stamp:
+            self.reused += len(cached[1])
+            return cached[1]
+
+        fragments = []
+        if multi:
+            if compact:
+                header = [f"## PERFIL: {name} (prioridad {priority})"]
+            else:
+                header = ["", SEPARATOR, f"PERFIL: {name} | PRIORIDAD: {priority}", SEPARATOR, ""]
+            fragments.append(self._fragment(content_hash("profile_header", header), name, priority,
+                                            "profile_header", lambda: header))
+        render = render_section_compact if compact else render_section
+        for section in PROFILE_SECTIONS:
+            source = _section_source(section, version)
+            if compact and section == "knowledge_base" and version.get("vehicle_catalog"):
+                source = [source, version["vehicle_catalog"].get("columns", {}).get("kb_key")]
+            key = content_hash(section, name, is_main, compact, source) if compact else \
+                content_hash(section, name, is_main, source)
+            fragment = self._fragment(key, name, priority, section,
+                                      lambda s=section: render(s, version, name, is_main))
+            if fragment:
+                fragments.append(fragment)
+
+        self._versions[cache_key] = (stamp, fragments)
+        return fragments
+
+    def compile(self, pm, active_profiles: List[Dict], include_reference: bool = True,
+                reference_lines: Optional[List[str]] = None, dedup: bool = False,
+                compact: bool = False) -> ContextSnapshot:
+        """Compilar el contexto combinado de los perfiles {name, priority} dados
+
+        Con dedup=True y varios perfiles, los párrafos casi duplicados de perfiles
+        de menor prioridad se eliminan (reporte en self.last_dedup_report).
+        Con compact=True se usa el renderizado compacto (sin separadores, emojis
+        ni campos N/A).
+        """
+        fragments = []
+        multi = len(active_profiles) > 1
+
+        # Header indicando perfiles activos
+        if multi and compact:
+            header = ["PERFILES ACTIVOS (1 = mayor prioridad): " +
+                      ", ".join(f"{ap['name']} ({ap['priority']})" for ap in active_profiles)]
+            fragments.append(self._fragment(content_hash("header", header), "", 0, "header", lambda: header))
+        elif multi:
+            header = [SEPARATOR, "CONFIGURACIÓN DE PERFILES MÚLTIPLES",
+                      "Los siguientes perfiles están activos con sus prioridades:"]
+            header += [f"  • {ap['name']} (Prioridad: {ap['priority']})" for ap in active_profiles]
+            header += [SEPARATOR, ""]
+            fragments.append(self._fragment(content_hash("header", header), "", 0, "header", lambda: header))
+
+        # Procesar cada perfil según prioridad
+        for idx, active_prof in enumerate(active_profiles):
+            profile = pm.get_profile(active_prof["name"])
+            if not profile:
+                continue
+            version = pm.get_version(profile["name"], profile["active_version"])
+            if not version:
+                continue
+            for fragment in self._profile_fragments(profile, version, active_prof["priority"], idx == 0, multi,
+                                                    compact):
+                if include_reference or fragment["section"] not in REFERENCE_SECTIONS:
+                    fragments.append(fragment)
+
+        if reference_lines:
+            text = "\n".join(reference_lines)
+            fragments.append({"hash": content_hash("reference", text), "profile": "", "priority": 0,
+                              "section": "reference", "text": text})
+
+        # Tono y lenguaje del perfil principal
+        if active_profiles:
+            main_profile = pm.get_profile(active_profiles[0]["name"])
+            if main_profile:
+                main_version = pm.get_version(main_profile["name"], main_profile["active_version"])
+                if main_version and compact:
+                    footer = [f"TONO: {main_version.get('tone', 'profesional')} | "
+                              f"IDIOMA: {main_version.get('language', 'español')}"]
+                    fragments.append(self._fragment(content_hash("footer", footer), main_profile["name"],
+                                                    active_profiles[0]["priority"], "footer", lambda: footer))
+                elif main_version:
+                    footer = ["", SEPARATOR,
+                              f"TONO PRINCIPAL: {main_version.get('tone', 'profesional')}",
+                              f"IDIOMA PRINCIPAL: {main_version.get('language', 'español')}",
+                              SEPARATOR]
+                    fragments.append(self._fragment(content_hash("footer", footer), main_profile["name"],
+                                                    active_profiles[0]["priority"], "footer", lambda: footer))
+
+        if dedup and multi:
+            fragments = self._dedup(fragments)
+        else:
+            self.last_dedup_report = {}
+
+        self._prune()
+        return ContextSnapshot(fragments)
+
+    def _dedup(self, fragments: List[Dict]) -> List[Dict]:
+        """Deduplicar entre perfiles, cacheado por la combinación de fragmentos"""
+        key = tuple(f["hash"] for f in fragments)
+        cached = self._dedup_cache.get(key)
+        if cached is None:
+            cached = dedup_fragments(fragments, estimate_tokens)
+            self._dedup_cache.put(key, cached)
+        self.last_dedup_report = cached[1]
+        return cached[0]
+
+    def _prune(self, max_versions: int = 256):
+        """Descartar fragmentos que ya no referencia ninguna versión cacheada"""
+        if len(self._versions) > max_versions:
+            for key in list(self._versions)[:len(self._versions) - max_versions]:
+                del self._versions[key]
+        if len(self._fragments) > 4 * max(1, sum(len(f) for _, f in self._versions.values())) + 64:
+            live = {f["hash"] for _, frags in self._versions.values() for f in frags}
+            self._fragments = {k: v for k, v in self._fragments.items() if k in live}
+
+
+# ===== EMPAQUETADO CON PRESUPUESTO DE TOKENS =====
+
+# Orden de relleno dentro de cada perfil (menor = antes)
+PACK_SECTION_RANK = {"system_prompt": 0, "restrictions": 1, "instructions": 2, "context": 3,
+                     "examples": 4, "knowledge_base": 5, "documents": 6}
+# Secciones que se pueden recortar por líneas en lugar de descartarse enteras
+TRUNCATABLE_SECTIONS = {"instructions", "context", "examples", "knowledge_base", "documents"}
+TRUNCATION_MARKER = "[... contenido recortado por límite de tokens]"
+
+
+def _truncate_lines(text: str, max_tokens: int, estimator) -> str:
+    """Conservar las primeras líneas completas que caben en max_tokens (más el marcador)"""
+    budget = max_tokens - estimator(TRUNCATION_MARKER)
+    kept, used = [], 0
+    for line in text.split("\n"):
+        cost = estimator(line) + 1
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    if not kept or not "".join(kept).strip():
+        return ""
+    # Un encabezado de sección solo (p. ej. "BASE DE CONOCIMIENTOS (x):") no aporta nada
+    if len(kept) == 1 and kept[0].endswith(":"):
+        return ""
+    return "\n".join(kept + [TRUNCATION_MARKER])
+
+
+def pack_snapshot(snapshot: ContextSnapshot, budget_tokens: int, estimator) -> Tuple[ContextSnapshot, Dict]:
+    """Ajustar un snapshot a un presupuesto de tokens respetando prioridades
+
+    Siempre se conservan íntegros el system prompt y las restricciones del perfil
+    principal, el encabezado y el tono. Después se agregan, por prioridad de
+    perfil y en el orden de PACK_SECTION_RANK, las demás secciones hasta llenar
+    el presupuesto; la sección que no cabe se recorta por líneas y el resto se
+    descarta.
+
+    Returns:
+        (snapshot empaquetado, reporte con lo conservado, recortado y descartado)
+    """
+    fragments = snapshot.fragments
+    costs = [estimator(f["text"]) + 1 for f in fragments]
+    main_profile = next((f["profile"] for f in fragments if f["section"] in PACK_SECTION_RANK), "")
+
+    selected: Dict[int, Dict] = {}
+    used = 0
+    # Obligatorios
+    for i, f in enumerate(fragments):
+        mandatory = f["section"] in ("header", "footer", "legacy", "reference") or (
+            f["profile"] == main_profile and f["section"] in ("system_prompt", "restrictions", "profile_header"))
+        if mandatory:
+            selected[i] = f
+            used += costs[i]
+
+    report = {"budget": budget_tokens, "kept": [], "truncated": [], "dropped": []}
+    optional = sorted(
+        (i for i, f in enumerate(fragments) if i not in selected and f["section"] != "profile_header"),
+        key=lambda i: (fragments[i]["priority"], PACK_SECTION_RANK.get(fragments[i]["section"], 9), i)
+    )
+    headers = {f["profile"]: i for i, f in enumerate(fragments) if f["section"] == "profile_header"}
+
+    for i in optional:
+        f = fragments[i]
+        header_cost = 0
+        header_idx = headers.get(f["profile"])
+        if header_idx is not None and header_idx not in selected:
+            header_cost = costs[header_idx]
+
+        remaining = budget_tokens - used - header_cost
+        if costs[i] <= remaining:
+            selected[i] = f
+            used += costs[i]
+        else:
+            text = _truncate_lines(f["text"], remaining, estimator) if f["section"] in TRUNCATABLE_SECTIONS and remaining > 0 else ""
+            if not text:
+                report["dropped"].append({"profile": f["profile"], "section": f["section"], "tokens": costs[i]})
+                continue
+            selected[i] = dict(f, text=text, hash=content_hash("truncated", f["hash"], len(text)))
+            new_cost = estimator(text) + 1
+            used += new_cost
+            report["truncated"].append({"profile": f["profile"], "section": f["section"],
+                                        "tokens": costs[i], "kept_tokens": new_cost})
+        if header_cost:
+            selected[header_idx] = fragments[header_idx]
+            used += header_cost
+
+    packed = ContextSnapshot([selected[i] for i in sorted(selected)])
+    report["kept"] = [{"profile": f["profile"], "section": f["section"]} for f in packed.fragments]
+    report["tokens"] = used
+    report["original_tokens"] = sum(costs)
+    report["over_budget"] = used > budget_tokens
+    return packed, report
@@ -0,0 +1,208 @@
+"""
+Deduplicación de contenido casi duplicado entre perfiles
+Detecta párrafos repetidos (SimHash sobre shingles de palabras, confirmado con
+Jaccard) al compilar el contexto combinado: se conserva la copia del perfil
+de mayor prioridad y las demás se reemplazan por una referencia o se eliminan
+"""
+
+import hashlib
+import re
+from typing import Dict, List, Set, Tuple
+
+from context_retrieval import fold_accents
+
+SHINGLE_SIZE = 3
+# Párrafos más cortos no se comparan (demasiado ruido en frases breves)
+MIN_PARAGRAPH_CHARS = 80
+MAX_HAMMING_DISTANCE = 6
+MIN_JACCARD = 0.7
+# Bandas del SimHash de 64 bits para encontrar candidatos sin comparar todos contra todos
+BANDS = 4
+BAND_BITS = 64 // BANDS
+
+DEDUP_SECTIONS = {"context", "instructions", "knowledge_base", "examples", "documents", "system_prompt"}
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_ITEM_RE = re.compile(r"^(•|\d+\.)\s")
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[str]:
+    """Conjunto de shingles de `size` palabras (sin acentos, minúsculas)"""
+    words = _WORD_RE.findall(fold_accents(text))
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def simhash(features: Set[str]) -> int:
+    """SimHash de 64 bits de un conjunto de shingles"""
+    weights = [0] * 64
+    for feature in features:
+        h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    value = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            value |= 1 << bit
+    return value
+
+
+def split_units(text: str) -> List[str]:
+    """Dividir un fragmento en unidades comparables
+
+    La primera línea (encabezado de la sección) es una unidad propia; el resto
+    se divide en párrafos separados por líneas en blanco. Un párrafo formado
+    solo por ítems largos de una línea ("• clave: valor", "1. ...") se divide
+    en un ítem por unidad. Unir las unidades con "\n" reproduce el texto.
+    """
+    lines = text.split("\n")
+    units = [lines[0]]
+    block: List[str] = []
+
+    def flush():
+        if not block:
+            return
+        if all(_ITEM_RE.match(line) for line in block) and \
+                sum(len(line) for line in block) / len(block) >= MIN_PARAGRAPH_CHARS:
+            units.extend(block)
+        else:
+            units.append("\n".join(block))
+        block.clear()
+
+    for line in lines[1:]:
+        if line.strip():
+            block.append(line)
+        else:
+            flush()
+            units.append(line)
+    flush()
+    return units
+
+
+def _reference(unit: str, profile: str) -> str:
+    """Texto que sustituye a un duplicado: conserva la clave de los ítems 'clave: valor'"""
+    if unit.startswith("• ") and ": " in unit[:100]:
+        return f"{unit.split(': ', 1)[0]}: (ver {profile})"
+    return ""
+
+
+class NearDuplicateIndex:
+    """Índice LSH de párrafos ya vistos para detectar casi duplicados"""
+
+    def __init__(self):
+        self._bands: Dict[Tuple[int, int], List[int]] = {}
+        self._entries: List[Tuple[int, Set[str], str]] = []
+
+    def find(self, features: Set[str], fingerprint: int) -> str:
+        """Perfil de un párrafo ya visto casi igual ('' si no hay)"""
+        seen = set()
+        for band in range(BANDS):
+            key = (band, fingerprint >> (band * BAND_BITS) & ((1 << BAND_BITS) - 1))
+            for entry_id in self._bands.get(key, ()):
+                if entry_id in seen:
+                    continue
+                seen.add(entry_id)
+                other_fp, other_features, profile = self._entries[entry_id]
+                if bin(fingerprint ^ other_fp).count("1") > MAX_HAMMING_DISTANCE:
+                    continue
+                union = len(features | other_features)
+                if union and len(features & other_features) / union >= MIN_JACCARD:
+                    return profile
+        return ""
+
+    def add(self, features: Set[str], fingerprint: int, profile: str):
+        entry_id = len(self._entries)
+        self._entries.append((fingerprint, features, profile))
+        for band in range(BANDS):
+            key = (band, fingerprint >> (band * BAND_BITS) & ((1 << BAND_BITS) - 1))
+            self._bands.setdefault(key, []).append(entry_id)
+
+
+def dedup_fragments(fragments: List[Dict], estimator) -> Tuple[List[Dict], Dict]:
+    """Eliminar de los perfiles de menor prioridad los párrafos ya presentes en otro perfil
+
+    Los fragmentos deben venir en orden de prioridad (como los arma el
+    compilador). Solo se comparan párrafos de perfiles distintos.
+
+    Returns:
+        (fragmentos deduplicados, reporte con duplicados y bytes/tokens ahorrados)
+    """
+    index = NearDuplicateIndex()
+    # Párrafos cortos vistos (texto normalizado -> perfil): solo se eliminan si
+    # continúan una racha de duplicados (p. ej. el resto de una ficha repetida)
+    short_seen: Dict[str, str] = {}
+    result = []
+    duplicates = []
+    bytes_saved = 0
+    tokens_saved = 0
+
+    for fragment in fragments:
+        if fragment["section"] not in DEDUP_SECTIONS:
+            result.append(fragment)
+            continue
+
+        profile = fragment["profile"]
+        units = split_units(fragment["text"])
+        kept_units = []
+        new_entries = []
+        changed = False
+        # La primera unidad es el encabezado de la sección ("BASE DE CONOCIMIENTOS (x):")
+        new_short = []
+        skip_blank = False
+        in_run = False
+        for position, unit in enumerate(units):
+            # Al eliminar un párrafo se elimina también la línea en blanco que lo separaba
+            if skip_blank and not unit.strip():
+                skip_blank = False
+                continue
+            skip_blank = False
+            if position == 0 or not unit.strip():
+                kept_units.append(unit)
+                continue
+            if len(unit) < MIN_PARAGRAPH_CHARS:
+                normalized = " ".join(_WORD_RE.findall(fold_accents(unit)))
+                owner = short_seen.get(normalized, "")
+                if not (in_run and owner and owner != profile):
+                    kept_units.append(unit)
+                    new_short.append(normalized)
+                    in_run = False
+                    continue
+            else:
+                features = shingles(unit)
+                fingerprint = simhash(features)
+                owner = index.find(features, fingerprint)
+            if owner and owner != profile:
+                replacement = _reference(unit, owner)
+                if replacement:
+                    kept_units.append(replacement)
+                else:
+                    skip_blank = True
+                bytes_saved += len(unit.encode("utf-8")) - len(replacement.encode("utf-8"))
+                tokens_saved += estimator(unit) - (estimator(replacement) if replacement else 0)
+                duplicates.append({"profile": profile, "section": fragment["section"],
+                                   "kept_in": owner, "chars": len(unit), "preview": unit[:60]})
+                changed = True
+                in_run = True
+            else:
+                kept_units.append(unit)
+                new_entries.append((features, fingerprint))
+                in_run = False
+
+        # Registrar después de procesar el fragmento para no comparar un perfil consigo mismo
+        for features, fingerprint in new_entries:
+            index.add(features, fingerprint, profile)
+        for normalized in new_short:
+            short_seen.setdefault(normalized, profile)
+
+        if not changed:
+            result.append(fragment)
+            continue
+        if not any(u.strip() for u in kept_units[1:]):
+            continue  # solo quedó el encabezado de la sección
+        text = "\n".join(kept_units)
+        result.append(dict(fragment, text=text, hash=hashlib.sha1(
+            f"dedup:{fragment['hash']}:{text}".encode("utf-8")).hexdigest()))
+
+    report = {"duplicates": duplicates, "bytes_saved": bytes_saved, "tokens_saved": tokens_saved}
+    return result, report
@@ -0,0 +1,223 @@
+"""
+Distribución push del contexto a varios procesos del bot
+La app de entrenamiento publica cada contexto nuevo con un número de versión en
+un feed SQLite; cada worker del bot detecta el cambio con PRAGMA data_version
+(sin leer el contexto mientras no cambie), lo reemplaza atómicamente en memoria
+y registra un acuse con la versión aplicada y la latencia de propagación
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contexts (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    snapshot_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    metadata TEXT,
+    published_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS acks (
+    worker_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    snapshot_id TEXT,
+    latency_ms REAL,
+    acked_at REAL NOT NULL,
+    started_at REAL
+);
+"""
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class ContextFeed:
+    """Lado publicador del feed (app de entrenamiento) y consultas de estado"""
+
+    def __init__(self, path: str = "context_feed.db", keep_versions: int = 20):
+        self.path = path
+        self.keep_versions = keep_versions
+        self._lock = threading.Lock()
+        self._conn = _connect(path)
+        self._conn_pid = os.getpid()
+
+    def _db(self) -> sqlite3.Connection:
+        # Una conexión SQLite no debe cruzar un fork
+        if self._conn_pid != os.getpid():
+            self._conn = _connect(self.path)
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def publish(self, text: str, snapshot_id: str, metadata: Optional[Dict] = None) -> int:
+        """Publicar un contexto; si es igual al último publicado no crea versión nueva
+
+        Returns:
+            Número de versión vigente
+        """
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT version, snapshot_id FROM contexts ORDER BY version DESC LIMIT 1").fetchone()
+            if row and row[1] == snapshot_id:
+                return row[0]
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = db.execute(
+                    "INSERT INTO contexts (snapshot_id, text, metadata, published_at) VALUES (?, ?, ?, ?)",
+                    (snapshot_id, text, json.dumps(metadata or {}, ensure_ascii=False), time.time())
+                )
+                version = cursor.lastrowid
+                db.execute("DELETE FROM contexts WHERE version <= ?", (version - self.keep_versions,))
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+            return version
+
+    def latest(self) -> Optional[Dict]:
+        """Última versión publicada (sin el texto)"""
+        row = self._db().execute(
+            "SELECT version, snapshot_id, published_at, metadata FROM contexts ORDER BY version DESC LIMIT 1"
+        ).fetchone()
+        if not row:
+            return None
+        return {"version": row[0], "snapshot_id": row[1], "published_at": row[2], "metadata": json.loads(row[3] or "{}")}
+
+    def status(self, stale_after: float = 60.0) -> Dict:
+        """Estado de la distribución: versión vigente y acuse de cada worker
+
+        Args:
+            stale_after: Segundos sin acuse tras los que un worker atrasado se marca como inactivo
+        """
+        latest = self.latest()
+        workers = []
+        now = time.time()
+        for worker_id, version, snapshot_id, latency_ms, acked_at, started_at in self._db().execute(
+                "SELECT worker_id, version, snapshot_id, latency_ms, acked_at, started_at FROM acks ORDER BY worker_id"):
+            behind = (latest["version"] - version) if latest else 0
+            workers.append({
+                "worker_id": worker_id,
+                "version": version,
+                "snapshot_id": snapshot_id,
+                "behind": behind,
+                "latency_ms": latency_ms,
+                "acked_at": acked_at,
+                "started_at": started_at,
+                "stale": behind > 0 and now - acked_at > stale_after
+            })
+        return {"latest": latest, "workers": workers}
+
+    def forget_worker(self, worker_id: str):
+        """Quitar un worker del reporte (p. ej. uno que ya no existe)"""
+        self._db().execute("DELETE FROM acks WHERE worker_id = ?", (worker_id,))
+
+
+class ContextSubscriber:
+    """Lado suscriptor (cada proceso del bot)
+
+    Un hilo daemon consulta PRAGMA data_version cada poll_interval segundos;
+    solo cuando otro proceso confirmó una escritura lee la última versión. El
+    estado (versión, id, texto) se reemplaza como una sola tupla, así que
+    get() nunca hace E/S ni ve un contexto a medias.
+    """
+
+    def __init__(self, path: str = "context_feed.db", worker_id: Optional[str] = None,
+                 fallback: Optional[Callable[[], str]] = None, poll_interval: float = 0.2,
+                 on_update: Optional[Callable[[int, str], None]] = None):
+        self.path = path
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.fallback = fallback
+        self.poll_interval = poll_interval
+        self.on_update = on_update
+        self._state: Tuple[int, str, str] = (0, "", "")
+        self._stop = threading.Event()
+        self._started_at = time.time()
+        self._thread: Optional[threading.Thread] = None
+        self.last_latency_ms: Optional[float] = None
+
+    def start(self) -> "ContextSubscriber":
+        """Aplicar la versión vigente y empezar a escuchar cambios"""
+        conn = _connect(self.path)
+        self._apply_latest(conn)
+        self._thread = threading.Thread(target=self._run, args=(conn,), name="context-feed", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+
+    def _run(self, conn: sqlite3.Connection):
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        while not self._stop.wait(self.poll_interval):
+            try:
+                current = conn.execute("PRAGMA data_version").fetchone()[0]
+                if current != data_version:
+                    data_version = current
+                    self._apply_latest(conn)
+            except sqlite3.Error as e:
+                print(f"Error leyendo feed de contexto: {e}")
+        conn.close()
+
+    def _apply_latest(self, conn: sqlite3.Connection):
+        row = conn.execute(
+            "SELECT version, snapshot_id, text, published_at FROM contexts WHERE version > ? "
+            "ORDER BY version DESC LIMIT 1", (self._state[0],)
+        ).fetchone()
+        if not row:
+            return
+        version, snapshot_id, text, published_at = row
+        self._state = (version, snapshot_id, text)
+        now = time.time()
+        self.last_latency_ms = max(0.0, (now - published_at) * 1000)
+        conn.execute(
+            "INSERT OR REPLACE INTO acks (worker_id, version, snapshot_id, latency_ms, acked_at, started_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (self.worker_id, version, snapshot_id, self.last_latency_ms, now, self._started_at)
+        )
+        if self.on_update:
+            try:
+                self.on_update(version, snapshot_id)
+            except Exception as e:
+                print(f"Error en callback del feed de contexto: {e}")
+
+    @property
+    def version(self) -> int:
+        """Versión aplicada (0 = ninguna todavía)"""
+        return self._state[0]
+
+    @property
+    def snapshot_id(self) -> str:
+        return self._state[1]
+
+    def get(self) -> str:
+        """Contexto vigente sin E/S (fallback mientras no haya versión publicada)"""
+        text = self._state[2]
+        if text:
+            return text
+        return self.fallback() if self.fallback else ""
+
+
+def format_status(status: Dict) -> List[str]:
+    """Líneas legibles del estado de distribución"""
+    latest = status["latest"]
+    if not latest:
+        return ["Sin contextos publicados"]
+    lines = [f"Versión vigente: v{latest['version']} ({latest['snapshot_id']})"]
+    for worker in status["workers"]:
+        state = "✅ al día" if worker["behind"] == 0 else f"⏳ {worker['behind']} versión(es) atrás"
+        if worker["stale"]:
+            state = "⚠️ sin respuesta"
+        latency = f"{worker['latency_ms']:.0f} ms" if worker["latency_ms"] is not None else "-"
+        lines.append(f"{worker['worker_id']}: v{worker['version']} {state} (latencia {latency})")
+    return lines
@@ -0,0 +1,153 @@
+"""
+Proveedor en memoria del contexto sincronizado para el bot
+Mantiene el contenido de active_profile_context.txt en memoria y solo lo
+revalida con un stat (mtime/tamaño/inodo) como máximo cada N ms, o con
+inotify cuando está disponible
+"""
+
+import hashlib
+import os
+import threading
+import time
+from typing import Callable, Optional, Tuple
+
+# inotify es opcional (solo Linux); sin él se revalida con stat periódico
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+    INOTIFY_AVAILABLE = True
+except ImportError:
+    INOTIFY_AVAILABLE = False
+
+
+def _text_id(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16] if text else ""
+
+
+class FileContextProvider:
+    """Contexto de perfil cacheado con revalidación barata por stat
+
+    El estado (firma, texto, id) se reemplaza como una sola tupla, de modo que
+    los lectores siempre ven una versión completa sin necesidad de locks.
+    """
+
+    def __init__(self, path: str = "active_profile_context.txt",
+                 fallback: Optional[Callable[[], str]] = None,
+                 check_interval_ms: int = 500, use_inotify: bool = True):
+        self.path = path
+        self.fallback = fallback
+        self.check_interval = check_interval_ms / 1000.0
+        self._state: Tuple[Optional[Tuple], str, str] = (None, "", "")
+        self._fallback: Optional[Tuple[str, str]] = None
+        self._next_check = 0.0
+        self._reload_lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._watching = False
+        self.reloads = 0
+
+        if use_inotify and INOTIFY_AVAILABLE:
+            self._start_watcher()
+
+    def _start_watcher(self):
+        """Vigilar el directorio del archivo con inotify en un hilo daemon"""
+        try:
+            inotify = INotify()
+            directory = os.path.dirname(os.path.abspath(self.path))
+            mask = (inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO |
+                    inotify_flags.CREATE | inotify_flags.DELETE)
+            inotify.add_watch(directory, mask)
+        except Exception as e:
+            print(f"inotify no disponible, usando stat periódico: {e}")
+            return
+
+        name = os.path.basename(self.path)
+
+        def _watch():
+            try:
+                while True:
+                    for event in inotify.read():
+                        if event.name == name:
+                            self._dirty.set()
+            except Exception as e:
+                # Sin vigilante se vuelve al stat periódico, revalidando de inmediato
+                print(f"Error vigilando el contexto con inotify, usando stat periódico: {e}")
+                self._next_check = 0.0
+                self._watching = False
+                try:
+                    inotify.close()
+                except Exception:
+                    pass
+
+        threading.Thread(target=_watch, name="context-watcher", daemon=True).start()
+        self._watching = True
+        self._dirty.set()
+
+    def _signature(self) -> Optional[Tuple]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _needs_check(self) -> bool:
+        if self._watching:
+            return self._dirty.is_set()
+        return time.monotonic() >= self._next_check
+
+    def get(self) -> str:
+        """Obtener el contexto vigente (sin E/S salvo al revalidar)"""
+        if self._needs_check():
+            self._revalidate()
+
+        text = self._state[1]
+        if text:
+            return text
+        return self._get_fallback()[0]
+
+    @property
+    def snapshot_id(self) -> str:
+        """Id estable del contexto vigente (hash de contenido), útil como clave de caché"""
+        if self._needs_check():
+            self._revalidate()
+        if self._state[1]:
+            return self._state[2]
+        return self._get_fallback()[1]
+
+    def _revalidate(self):
+        # Si otro hilo ya está recargando, usar el estado actual
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            self._dirty.clear()
+            self._next_check = time.monotonic() + self.check_interval
+            signature = self._signature()
+            if signature == self._state[0]:
+                return
+
+            text = ""
+            if signature is not None:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        text = f.read().strip()
+                except Exception as e:
+                    print(f"Error leyendo contexto sincronizado: {e}")
+                    return
+
+            self._state = (signature, text, _text_id(text))
+            self.reloads += 1
+        finally:
+            self._reload_lock.release()
+
+    def _get_fallback(self) -> Tuple[str, str]:
+        """(texto, id) calculados por el fallback, cacheados hasta invalidate()"""
+        if self.fallback is None:
+            return "", ""
+        if self._fallback is None:
+            text = self.fallback() or ""
+            self._fallback = (text, _text_id(text))
+        return self._fallback
+
+    def invalidate(self):
+        """Forzar revalidación en la próxima lectura y recalcular el fallback"""
+        self._fallback = None
+        self._next_check = 0.0
+        self._dirty.set()
@@ -0,0 +1,283 @@
+"""
+Recuperación BM25 sobre la base de conocimientos y documentos de los perfiles
+Permite inyectar en el prompt solo los pasajes relevantes al mensaje actual
+en lugar de volcar el perfil completo
+"""
+
+import hashlib
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# Palabras vacías del español (ya sin acentos) que no aportan a la búsqueda
+SPANISH_STOPWORDS = set("""
+a al algo algun alguna algunas alguno algunos ante antes aqui asi aun bien cada como con contra cual cuales
+cuando de del desde donde dos el ella ellas ello ellos en entre era eran es esa esas ese eso esos esta estan
+estas este esto estos fue fueron ha hay hasta la las le les lo los mas me mi mis mucho muy no nos nosotros
+o otra otras otro otros para pero poco por porque que quien se sea ser si sin sobre son su sus tambien tan
+te tiene tienen todo todos tu tus un una uno unos usted ustedes y ya yo hola buenas buenos dias tardes
+noches quiero necesito busco favor puedes podrias gracias
+""".split())
+
+# Sufijos derivativos, del más largo al más corto
+_SUFFIXES = (
+    "amientos", "imientos", "amiento", "imiento", "aciones", "uciones", "ancias", "encias", "idades",
+    "mente", "acion", "ucion", "ancia", "encia", "idad", "ismo", "ista", "able", "ible",
+    "oso", "osa", "ivo", "iva", "ado", "ada", "ido", "ida"
+)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fold_accents(text: str) -> str:
+    """Pasar a minúsculas y eliminar acentos (á->a, ñ->n, ü->u)"""
+    normalized = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in normalized if not unicodedata.combining(c))
+
+
+def stem_spanish(word: str) -> str:
+    """Stemmer ligero para español: plural, un sufijo derivativo y vocal final"""
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith("es") and len(word) > 5:
+        word = word[:-1]
+    elif word.endswith("s") and len(word) > 4:
+        word = word[:-1]
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            break
+    if word[-1] in "aeo" and len(word) > 4:
+        word = word[:-1]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokenizar con plegado de acentos, sin palabras vacías y con stemming"""
+    return [
+        stem_spanish(token)
+        for token in _TOKEN_RE.findall(fold_accents(text))
+        if token not in SPANISH_STOPWORDS and (len(token) > 1 or token.isdigit())
+    ]
+
+
+# Encabezados: markdown (#), líneas en mayúsculas y separadores "--- nombre ---"
+_HEADING_RE = re.compile(r"^\s*(?:#{1,6}\s+\S.*|--- .+ ---|[^a-záéíóúñ\n]*[A-ZÁÉÍÓÚÑ]{3}[^a-záéíóúñ\n]*)\s*$")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?;])\s+")
+
+
+def text_id(text: str) -> str:
+    """Id estable derivado del contenido"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+
+
+def _spans(content: str, start: int, end: int, pattern: "re.Pattern") -> List[Tuple[int, int]]:
+    """Tramos no vacíos de content[start:end] separados por pattern (sin espacios en los bordes)"""
+    spans = []
+    position = start
+    for match in list(pattern.finditer(content, start, end)) + [None]:
+        piece_end = match.start() if match else end
+        piece = content[position:piece_end]
+        if piece.strip():
+            left = position + len(piece) - len(piece.lstrip())
+            right = position + len(piece.rstrip())
+            spans.append((left, right))
+        if match:
+            position = match.end()
+    return spans
+
+
+def _split_long(content: str, start: int, end: int, target_chars: int) -> List[Tuple[int, int]]:
+    """Dividir un párrafo largo por oraciones y, si hace falta, por espacios"""
+    pieces = []
+    for s_start, s_end in _spans(content, start, end, _SENTENCE_END_RE):
+        while s_end - s_start > target_chars:
+            cut = content.rfind(" ", s_start, s_start + target_chars)
+            cut = cut if cut > s_start else s_start + target_chars
+            pieces.append((s_start, cut))
+            s_start = cut + 1 if content[cut:cut + 1] == " " else cut
+        if s_end > s_start:
+            pieces.append((s_start, s_end))
+    return pieces
+
+
+def chunk_document(content: str, target_chars: int = 800, overlap_chars: int = 120) -> List[Dict]:
+    """Dividir un documento en pasajes por encabezados y párrafos, con solapamiento
+
+    Cada pasaje se guarda como desplazamientos sobre el contenido original
+    (el texto es content[start:end]), con el encabezado de su sección y un
+    id derivado de su texto.
+
+    Returns:
+        Lista de {id, start, end, heading}
+    """
+    # Secciones delimitadas por encabezados
+    sections = []
+    heading, section_start, offset = "", 0, 0
+    for line in content.splitlines(keepends=True):
+        stripped = line.strip()
+        if stripped and len(stripped) <= 100 and _HEADING_RE.match(stripped):
+            if content[section_start:offset].strip():
+                sections.append((heading, section_start, offset))
+            heading = stripped.strip("#- ").rstrip(":")
+            section_start = offset + len(line)
+        offset += len(line)
+    if content[section_start:].strip() or not sections:
+        sections.append((heading, section_start, len(content)))
+
+    passages = []
+    paragraph_re = re.compile(r"\n\s*\n")
+    for heading, start, end in sections:
+        pieces = []
+        for p_start, p_end in _spans(content, start, end, paragraph_re):
+            if p_end - p_start > target_chars:
+                pieces.extend(_split_long(content, p_start, p_end, target_chars))
+            else:
+                pieces.append((p_start, p_end))
+
+        chunk_start = chunk_end = None
+        for p_start, p_end in pieces:
+            if chunk_start is not None and p_end - chunk_start > target_chars:
+                passages.append((heading, chunk_start, chunk_end))
+                # El siguiente pasaje repite el final del anterior, desde un límite de palabra
+                overlap_start = max(chunk_start, chunk_end - overlap_chars)
+                space = content.find(" ", overlap_start, chunk_end)
+                chunk_start = space + 1 if overlap_chars and space != -1 and space + 1 < p_start else p_start
+            elif chunk_start is None:
+                chunk_start = p_start
+            chunk_end = p_end
+        if chunk_start is not None:
+            passages.append((heading, chunk_start, chunk_end))
+
+    return [{"id": text_id(content[start:end]), "start": start, "end": end, "heading": heading}
+            for heading, start, end in passages]
+
+
+def document_passages(document: Dict) -> List[Dict]:
+    """Pasajes guardados de un documento (o calculados si faltan o están desactualizados)"""
+    content = document.get("content", "")
+    passages = document.get("passages")
+    if passages is None or document.get("id") != text_id(content):
+        passages = chunk_document(content)
+    return passages
+
+
+class BM25Index:
+    """Índice invertido con puntuación BM25"""
+
+    def __init__(self, passages: List[Dict], k1: float = 1.5, b: float = 0.75,
+                 term_cache: Optional[Dict[Tuple[str, str], Counter]] = None):
+        self.passages = passages
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.doc_lengths: List[int] = []
+
+        for doc_id, passage in enumerate(passages):
+            # Los pasajes con id reutilizan sus términos ya tokenizados; el id depende solo
+            # del texto, y los términos incluyen el título (documento o clave de la entrada)
+            title = passage.get("title", "")
+            key = (passage["id"], title) if passage.get("id") else None
+            counts = term_cache.get(key) if term_cache is not None and key else None
+            if counts is None:
+                counts = Counter(tokenize(f"{title} {passage['text']}"))
+                if term_cache is not None and key:
+                    term_cache[key] = counts
+            self.doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings.setdefault(term, []).append((doc_id, tf))
+
+        n = len(passages)
+        self.avg_length = (sum(self.doc_lengths) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def search(self, query: str, top_k: int = 8) -> List[Tuple[float, Dict]]:
+        """Devolver los top_k pasajes con su puntuación (solo puntuaciones > 0)"""
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[term]:
+                length_norm = 1 - self.b + self.b * self.doc_lengths[doc_id] / (self.avg_length or 1)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [(score, self.passages[doc_id]) for doc_id, score in ranked]
+
+
+def build_version_passages(profile_name: str, version_data: Dict) -> List[Dict]:
+    """Convertir la base de conocimientos y los pasajes de documentos de una versión en pasajes"""
+    passages = []
+    for key, data in version_data.get("knowledge_base", {}).items():
+        passages.append({
+            "id": text_id(f"{key}\n{data['value']}"),
+            "profile": profile_name,
+            "source": "kb",
+            "title": key,
+            "text": data["value"]
+        })
+    for doc in version_data.get("documents", []):
+        content = doc["content"]
+        for idx, passage in enumerate(document_passages(doc)):
+            title = f"{doc['name']} #{idx + 1}"
+            if passage.get("heading"):
+                title = f"{doc['name']} › {passage['heading']} #{idx + 1}"
+            passages.append({
+                "id": passage["id"],
+                "profile": profile_name,
+                "source": "document",
+                "title": title,
+                "text": content[passage["start"]:passage["end"]]
+            })
+    return passages
+
+
+class ProfileRetriever:
+    """Índices BM25 por (perfil, versión), reconstruidos solo cuando la versión cambia"""
+
+    def __init__(self):
+        self._indexes: Dict[Tuple[str, int], Tuple[str, BM25Index]] = {}
+        # Términos por (id, título) de pasaje: al cambiar una versión solo se tokenizan los pasajes nuevos
+        self._terms: Dict[Tuple[str, str], Counter] = {}
+
+    def get_index(self, profile_name: str, version: int, version_data: Dict, stamp: str) -> BM25Index:
+        """Obtener el índice de una versión; stamp identifica su estado (p. ej. last_modified)"""
+        key = (profile_name, version)
+        cached = self._indexes.get(key)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        index = BM25Index(build_version_passages(profile_name, version_data), term_cache=self._terms)
+        self._indexes[key] = (stamp, index)
+        self._prune_terms()
+        return index
+
+    def _prune_terms(self):
+        """Olvidar los términos de pasajes que ya no usa ningún índice"""
+        live = sum(len(index.passages) for _, index in self._indexes.values())
+        if len(self._terms) > 2 * live + 256:
+            ids = {(p.get("id"), p.get("title", "")) for _, index in self._indexes.values() for p in index.passages}
+            self._terms = {k: v for k, v in self._terms.items() if k in ids}
+
+    def search(self, indexes: List[BM25Index], query: str, top_k: int = 8) -> List[Tuple[float, Dict]]:
+        """Buscar en varios índices y combinar los mejores resultados"""
+        results = []
+        for index in indexes:
+            results.extend(index.search(query, top_k))
+        results.sort(key=lambda item: item[0], reverse=True)
+        return results[:top_k]
+
+
+def format_passages(results: List[Tuple[float, Dict]], multi_profile: bool = False) -> List[str]:
+    """Renderizar los pasajes recuperados como líneas de contexto"""
+    lines = []
+    for _, passage in results:
+        label = f"{passage['title']} ({passage['profile']})" if multi_profile else passage["title"]
+        lines.append(f"\n--- {label} ---")
+        lines.append(passage["text"])
+    return lines
@@ -0,0 +1,75 @@
+"""
+Lectura y escritura de CSV en streaming
+Lee las filas de a una informando el avance según los bytes leídos, y escribe
+celdas grandes (bases de conocimientos, documentos) por partes, sin armar la
+cadena completa en memoria
+"""
+
+import csv
+import os
+from typing import Callable, Dict, Iterable, Iterator, Optional, Union
+
+# (filas procesadas, fracción del archivo leída)
+ProgressCallback = Callable[[int, float], None]
+
+
+def iter_csv_rows(path: str, progress: Optional[ProgressCallback] = None,
+                  every: int = 1000) -> Iterator[Dict[str, str]]:
+    """Recorrer un CSV como diccionarios (csv.DictReader) sin cargarlo completo
+
+    Args:
+        path: Ruta del CSV (UTF-8, con o sin BOM)
+        progress: Callback opcional, llamado cada `every` filas y al terminar
+        every: Filas entre llamadas a progress
+    """
+    total = os.path.getsize(path) or 1
+    consumed = 0
+
+    def lines():
+        nonlocal consumed
+        with open(path, 'rb') as f:
+            encoding = 'utf-8-sig'  # BOM de "CSV UTF-8" de Excel, solo en la primera línea
+            for raw in f:
+                consumed += len(raw)
+                yield raw.decode(encoding)
+                encoding = 'utf-8'
+
+    count = 0
+    for row in csv.DictReader(lines()):
+        yield row
+        count += 1
+        if progress and count % every == 0:
+            progress(count, min(1.0, consumed / total))
+    if progress:
+        progress(count, 1.0)
+
+
+class Joined:
+    """Celda formada por partes unidas con un separador, escrita parte por parte"""
+
+    def __init__(self, parts: Iterable[str], separator: str):
+        self.parts = parts
+        self.separator = separator
+
+
+def _quote(text: str) -> str:
+    return text.replace('"', '""')
+
+
+def write_row(f, cells: Iterable[Union[str, Joined, None]]):
+    """Escribir una fila CSV en `f` (abierto con newline='')
+
+    Todas las celdas van entre comillas; csv.reader las lee igual que las que
+    escribe csv.writer. Las celdas Joined no se arman en memoria.
+    """
+    for position, cell in enumerate(cells):
+        f.write(',"' if position else '"')
+        if isinstance(cell, Joined):
+            for index, part in enumerate(cell.parts):
+                if index:
+                    f.write(_quote(cell.separator))
+                f.write(_quote(part))
+        elif cell is not None:
+            f.write(_quote(str(cell)))
+        f.write('"')
+    f.write("\r\n")
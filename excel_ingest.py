@@ -0,0 +1,849 @@
+"""
+Lectura y perfilado de archivos Excel fuera del event loop del bot
+read_excel_file y get_comprehensive_data_analysis corren en un pool acotado de
+procesos (ExcelIngestPool): mientras se procesa un libro grande el bot sigue
+atendiendo al resto de los chats. Cada trabajo tiene timeout y se puede
+cancelar; las hojas vuelven al proceso del bot como buffers columnares
+(arrays numpy y columnas de texto codificadas por diccionario) en lugar de
+DataFrames serializados celda por celda. Las hojas xlsx se leen fila a fila
+(openpyxl en modo solo lectura) directo a columnas tipadas, con un límite
+opcional de filas.
+"""
+
+import asyncio
+import csv
+import io
+import itertools
+import math
+import multiprocessing
+import os
+import time
+import zipfile
+from array import array
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from queue import Empty
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+# Dependencias opcionales: sin pandas no hay procesamiento de Excel
+try:
+    import numpy as np
+    import pandas as pd
+    PANDAS_AVAILABLE = True
+except ImportError:
+    PANDAS_AVAILABLE = False
+
+try:
+    import openpyxl
+    OPENPYXL_AVAILABLE = True
+except ImportError:
+    OPENPYXL_AVAILABLE = False
+
+ZIP_MAGIC = b"PK\x03\x04"  # xlsx, xlsb, ods
+OLE2_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"  # xls (BIFF) y libros cifrados
+ENCRYPTED_PACKAGE = "EncryptedPackage".encode("utf-16-le")
+# Formato detectado -> motor de pandas
+EXCEL_ENGINES = {"xlsx": "openpyxl", "xls": "xlrd", "xlsb": "pyxlsb", "ods": "odf"}
+# Textos que pandas lee como vacíos por defecto (la lectura en streaming aplica los mismos)
+NA_VALUES = frozenset(["", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+                       "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"])
+# (nombre de la hoja, DataFrame con las primeras filas) apenas se leyeron
+SampleCallback = Callable[[str, "pd.DataFrame"], None]
+# (nombre de la hoja, sample_summary()) en el proceso del bot; puede ser una corrutina
+SampleHandler = Callable[[str, Dict], Any]
+# Fechas en microsegundos desde 1970 (NaT = mínimo int64, como en numpy)
+EPOCH = datetime(1970, 1, 1)
+ONE_MICROSECOND = timedelta(microseconds=1)
+NAT = -2 ** 63
+# Rango de datetime64[ns] en microsegundos (fuera de él pandas deja las fechas como objetos)
+NS_BOUNDS_US = (-(2 ** 63 - 1) // 1000, (2 ** 63 - 1) // 1000)
+
+
+def sniff_workbook(data: bytes) -> str:
+    """Formato real de un archivo por su contenido, sin importar la extensión
+
+    Returns:
+        "xlsx", "xlsb", "ods", "xls", "encrypted" (libro protegido con
+        contraseña), "csv", "html" o "" si no se reconoce
+    """
+    if data.startswith(ZIP_MAGIC):
+        try:
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                names = set(archive.namelist())
+        except zipfile.BadZipFile:
+            return ""
+        if "xl/workbook.xml" in names:
+            return "xlsx"
+        if "xl/workbook.bin" in names:
+            return "xlsb"
+        if "content.xml" in names:
+            return "ods"
+        return ""
+    if data.startswith(OLE2_MAGIC):
+        # Un .xlsx con contraseña también es un contenedor OLE2, con el libro cifrado dentro
+        return "encrypted" if ENCRYPTED_PACKAGE in data[:1 << 20] else "xls"
+    head = data[:4096]
+    if not head.strip() or b"\x00" in head:
+        return ""
+    text = head.decode("utf-8", errors="ignore").lstrip("\ufeff \t\r\n").lower()
+    if text.startswith(("<html", "<!doctype html", "<table")):
+        return "html"
+    return "" if text.startswith("<") else "csv"
+
+
+def _read_bytes(file_source) -> bytes:
+    """Contenido de una ruta, de bytes o de un archivo en memoria"""
+    if isinstance(file_source, (bytes, bytearray)):
+        return bytes(file_source)
+    if isinstance(file_source, (str, os.PathLike)):
+        with open(file_source, "rb") as f:
+            return f.read()
+    position = file_source.tell()
+    data = file_source.read()
+    file_source.seek(position)
+    return data
+
+
+def _read_delimited(data: bytes) -> "pd.DataFrame":
+    """CSV/TSV con extensión de Excel (exportaciones de otros sistemas)"""
+    for encoding in ("utf-8-sig", "cp1252", "latin-1"):
+        try:
+            text = data.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    try:
+        delimiter = csv.Sniffer().sniff(text[:65536], delimiters=",;\t|").delimiter
+    except csv.Error:
+        delimiter = ","
+    # Con ";" como separador (configuración regional en español) la coma es el separador decimal
+    return pd.read_csv(io.StringIO(text), sep=delimiter, decimal="," if delimiter == ";" else ".")
+
+
+def _clean_sheet(df: "pd.DataFrame") -> "pd.DataFrame":
+    """Limpieza posterior a la lectura: celdas vacías, filas vacías, columnas sin nombre y tipos"""
+    # Limpiar columnas sin nombre solo si existen
+    unnamed_cols = [col for col in df.columns if isinstance(col, str) and col.startswith('Unnamed')]
+    if unnamed_cols:
+        df = df.drop(columns=unnamed_cols)
+    
+    # Solo las columnas de texto u objetos: las numéricas y de fecha ya vienen tipadas
+    for position in range(df.shape[1]):
+        column = df.iloc[:, position]
+        if isinstance(column.dtype, np.dtype) and column.dtype.kind in "biufcmM":
+            continue
+        # Celdas con solo espacios cuentan como vacías (los textos N/A, NULL... ya los marca pandas)
+        try:
+            blank = column.str.isspace().fillna(False).astype(bool)
+            if blank.any():
+                column = column.mask(blank)
+        except AttributeError:
+            pass  # sin textos
+        try:
+            column = pd.to_numeric(column)
+        except (ValueError, TypeError):
+            pass  # si falla, mantener la columna como está
+        df.isetitem(position, column)
+    
+    # remover filas completamente vacías (sin copiar el DataFrame si no hay ninguna)
+    empty = df.isna().all(axis=1)
+    return df[~empty] if empty.any() else df
+
+
+class _ColumnBuilder:
+    """Columna que se llena celda a celda en un array tipado
+
+    El tipo lo fijan los primeros valores: números (float64, int64 si todos
+    son enteros y no hay vacíos), fechas (datetime64[us]), booleanos o textos
+    (códigos int32 más los valores distintos, así un texto repetido se guarda
+    una sola vez). Si aparece un valor de otro tipo la columna pasa a objetos.
+    """
+
+    __slots__ = ("kind", "values", "size", "missing", "integral", "uniques")
+
+    def __init__(self, size: int = 0):
+        self.kind = None
+        self.values = None
+        self.size = size  # celdas agregadas, incluidas las vacías
+        self.missing = size
+        self.integral = True
+        self.uniques = None
+
+    def _start(self, kind: str):
+        """Fijar el tipo con el primer valor, rellenando los vacíos anteriores"""
+        self.kind = kind
+        filler = {"number": ("d", math.nan), "datetime": ("q", NAT), "bool": ("b", -1), "text": ("i", -1)}
+        if kind == "object":
+            self.values = [math.nan] * self.size
+            return
+        typecode, missing = filler[kind]
+        self.values = array(typecode, [missing]) * self.size
+        if kind == "text":
+            self.uniques = {}
+
+    def _to_objects(self):
+        """Pasar a columna de objetos (tipos mezclados)"""
+        values = self.finish().tolist() if self.kind else [math.nan] * self.size
+        self.kind, self.values, self.uniques = "object", values, None
+
+    def append(self, value):
+        if value is None or (value.__class__ is str and (value in NA_VALUES or value.isspace())):
+            self.size += 1
+            self.missing += 1
+            kind = self.kind
+            if kind == "number":
+                self.values.append(math.nan)
+            elif kind == "text" or kind == "bool":
+                self.values.append(-1)
+            elif kind == "datetime":
+                self.values.append(NAT)
+            elif kind == "object":
+                self.values.append(math.nan)
+            return
+
+        cls = value.__class__
+        kind = ("number" if cls is int or cls is float else "text" if cls is str else "bool" if cls is bool
+                else "datetime" if cls is datetime and value.tzinfo is None else "object")
+        if self.kind != kind:
+            if self.kind is None:
+                self._start(kind)
+            elif self.kind != "object":
+                self._to_objects()
+        self.size += 1
+        if self.kind == "number":
+            self.values.append(value)
+            if self.integral and cls is float and not value.is_integer():
+                self.integral = False
+        elif self.kind == "text":
+            code = self.uniques.get(value)
+            if code is None:
+                code = self.uniques[value] = len(self.uniques)
+            self.values.append(code)
+        elif self.kind == "datetime":
+            self.values.append((value - EPOCH) // ONE_MICROSECOND)
+        elif self.kind == "bool":
+            self.values.append(1 if value else 0)
+        else:
+            self.values.append(value)
+
+    def finish(self, gaps: bool = False) -> "np.ndarray":
+        """Array numpy final (comparte la memoria del array tipado cuando se puede)
+
+        Con gaps=True la hoja tenía filas vacías entre los datos: pandas las lee
+        como vacíos, así que enteros y booleanos quedan como float y objetos.
+        """
+        kind = self.kind
+        missing = self.missing or gaps
+        if kind is None:
+            return np.full(self.size, np.nan)
+        if kind == "number":
+            values = np.frombuffer(self.values, dtype=np.float64)
+            return values.astype(np.int64) if self.integral and not missing else values
+        if kind == "datetime":
+            return _pandas_datetimes(np.frombuffer(self.values, dtype=np.int64))
+        if kind == "bool":
+            values = np.frombuffer(self.values, dtype=np.int8)
+            if not missing:
+                return values.astype(bool)
+            result = np.full(self.size, np.nan, dtype=object)
+            result[values == 1] = True
+            result[values == 0] = False
+            return result
+        if kind == "text":
+            codes = np.frombuffer(self.values, dtype=np.int32)
+            uniques = np.empty(len(self.uniques), dtype=object)
+            uniques[:] = list(self.uniques)
+            values = uniques.take(codes) if len(uniques) else np.full(self.size, np.nan, dtype=object)
+            if self.missing:
+                values[codes < 0] = np.nan
+            return values
+        values = np.empty(self.size, dtype=object)
+        values[:] = self.values
+        return values
+
+
+def _pandas_datetimes(micros: "np.ndarray") -> "np.ndarray":
+    """Fechas con la resolución que les da pandas al leer Excel (us desde pandas 3, ns antes)"""
+    values = micros.view("datetime64[us]")
+    if pd.Series([EPOCH]).dtype == values.dtype:
+        return values
+    valid = micros[micros != NAT]
+    if len(valid) and (valid.min() < NS_BOUNDS_US[0] or valid.max() > NS_BOUNDS_US[1]):
+        return values.astype(object)
+    return values.astype("datetime64[ns]")
+
+
+def sample_summary(frame: "pd.DataFrame") -> Dict:
+    """Resumen liviano de las primeras filas de una hoja (lo que llega al bot antes de terminar)"""
+    columns = [str(column) for column in frame.columns
+               if not (isinstance(column, str) and column.startswith("Unnamed"))]
+    return {"rows": len(frame), "columns": columns}
+
+
+def _header_names(row: Tuple) -> list:
+    """Nombres de columna como los arma pandas: Unnamed: i para vacíos, .1, .2... para repetidos"""
+    names, seen = [], {}
+    for position, value in enumerate(row):
+        name = f"Unnamed: {position}" if value is None else value
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def read_xlsx_streaming(data: bytes, max_rows: Optional[int] = None, sample_rows: int = 1000,
+                        on_sample: Optional[SampleCallback] = None) -> Dict[str, Tuple["pd.DataFrame", bool]]:
+    """Leer las hojas de un xlsx fila a fila (openpyxl en modo solo lectura)
+
+    No se materializa la hoja completa ni un objeto por celda: cada columna se
+    va llenando en un array tipado (ver _ColumnBuilder), así el pico de
+    memoria queda cerca del tamaño del DataFrame final.
+
+    Args:
+        data: Contenido del archivo
+        max_rows: Máximo de filas de datos por hoja (None = todas)
+        sample_rows: Filas a leer antes de llamar a on_sample
+        on_sample: Recibe (hoja, DataFrame de las primeras filas) apenas se leyeron
+
+    Returns:
+        {hoja: (DataFrame, True si se cortó por max_rows)}
+    """
+    if not OPENPYXL_AVAILABLE:
+        raise Exception("openpyxl is not installed")
+    workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        frames = {}
+        for sheet in workbook.worksheets:
+            # Las dimensiones guardadas en el archivo pueden estar mal
+            sheet.reset_dimensions()
+            header, builders, sample = None, [], []
+            rows = 0
+            truncated = False
+            # Posición de cada fila contando las vacías, como el índice de pd.read_excel;
+            # solo se guarda desde la primera fila vacía (sin huecos basta un RangeIndex)
+            offset = -1
+            index = None
+            for row in sheet.iter_rows(values_only=True):
+                if all(value is None for value in row):
+                    if header is not None:
+                        offset += 1
+                        if index is None:
+                            index = array("q", range(rows))
+                    continue
+                if header is None:
+                    header = _header_names(row)
+                    builders = [_ColumnBuilder() for _ in header]
+                    continue
+                if max_rows is not None and rows >= max_rows:
+                    truncated = True
+                    break
+                offset += 1
+                if index is not None:
+                    index.append(offset)
+                if len(row) > len(builders):
+                    header += [f"Unnamed: {position}" for position in range(len(builders), len(row))]
+                    builders += [_ColumnBuilder(rows) for _ in range(len(builders), len(row))]
+                for builder, value in zip(builders, row):
+                    builder.append(value)
+                for builder in builders[len(row):]:
+                    builder.append(None)
+                rows += 1
+                if on_sample is not None and rows <= sample_rows:
+                    sample.append(row)
+                    if rows == sample_rows:
+                        on_sample(sheet.title, pd.DataFrame(sample, columns=header[:max(map(len, sample))]))
+                        sample = []
+            if header is None:
+                continue
+            if on_sample is not None and sample:
+                on_sample(sheet.title, pd.DataFrame(sample, columns=header[:max(map(len, sample))]))
+            gaps = index is not None and rows > 0 and index[-1] != rows - 1
+            columns = {position: builder.finish(gaps) for position, builder in enumerate(builders)}
+            if gaps:
+                frame = pd.DataFrame(columns, index=np.frombuffer(index, dtype=np.int64), copy=False)
+            else:
+                frame = pd.DataFrame(columns, copy=False)
+            frame.columns = header
+            frames[sheet.title] = (frame, truncated)
+        return frames
+    finally:
+        workbook.close()
+
+
+def read_excel_file(file_source, max_rows: Optional[int] = None, on_sample: Optional[SampleCallback] = None):
+    """
+    Read Excel file and return dataframes and sheet info
+    The format is detected once from the content (xlsx, legacy xls, or CSV/HTML
+    saved with an Excel extension) and the workbook is parsed a single time.
+    xlsx sheets are streamed row by row into typed columns (read_xlsx_streaming).
+    Args:
+        file_source: Can be a file path (str), bytes or BytesIO object
+        max_rows: Maximum data rows per sheet (None = all); see 'truncated'
+        on_sample: Called with the first rows of each xlsx sheet while the rest is read
+    """
+    if not PANDAS_AVAILABLE:
+        raise Exception("Excel processing not available")
+    
+    try:
+        data = _read_bytes(file_source)
+        fmt = sniff_workbook(data)
+        frames = {}
+        truncated = {}
+        if fmt == "xlsx" and OPENPYXL_AVAILABLE:
+            engine = "openpyxl (streaming)"
+            for sheet_name, (df, cut) in read_xlsx_streaming(data, max_rows, on_sample=on_sample).items():
+                frames[sheet_name] = df
+                truncated[sheet_name] = cut
+        elif fmt in EXCEL_ENGINES:
+            engine = EXCEL_ENGINES[fmt]
+            with pd.ExcelFile(io.BytesIO(data), engine=engine) as excel_file:
+                for sheet_name in excel_file.sheet_names:
+                    try:
+                        # Una fila de más indica que la hoja se cortó
+                        df = excel_file.parse(sheet_name, nrows=None if max_rows is None else max_rows + 1)
+                        if max_rows is not None and len(df) > max_rows:
+                            df = df.iloc[:max_rows]
+                            truncated[sheet_name] = True
+                        frames[sheet_name] = df
+                    except Exception as e:
+                        print(f"Error reading sheet {sheet_name} with {engine}: {e}")
+        elif fmt == "csv":
+            engine = "csv"
+            frames = {"Hoja1": _read_delimited(data)}
+        elif fmt == "html":
+            engine = "html"
+            tables = pd.read_html(io.BytesIO(data))
+            frames = {f"Tabla{idx}": table for idx, table in enumerate(tables, 1)}
+        elif fmt == "encrypted":
+            raise Exception("The workbook is encrypted (password protected)")
+        else:
+            raise Exception("Unrecognized file format (not xlsx, xls or CSV)")
+        
+        sheets_info = {}
+        for sheet_name, df in frames.items():
+            df = _clean_sheet(df)
+            if not df.empty:
+                # Información de columnas numéricas
+                numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
+                print(f"Sheet '{sheet_name}': {len(numeric_cols)} numeric columns found: {numeric_cols[:5]}")
+                
+                sheets_info[sheet_name] = {
+                    'dataframe': df,
+                    'columns': list(df.columns),
+                    'shape': df.shape,
+                    'dtypes': df.dtypes.to_dict(),
+                    'truncated': truncated.get(sheet_name, False)
+                }
+        
+        if not sheets_info:
+            raise Exception(f"No data found in any sheet ({fmt})")
+        print(f"Successfully read {fmt} file using {engine} engine")
+        return sheets_info
+        
+    except Exception as e:
+        print(f"Error reading Excel file: {e}")
+        return None
+
+
+def get_comprehensive_data_analysis(df: "pd.DataFrame") -> dict:
+    """
+    Realiza un análisis completo de un DataFrame y retorna información útil
+    """
+    if not PANDAS_AVAILABLE:
+        return {}
+    
+    try:
+        analysis = {
+            'total_rows': len(df),
+            'total_columns': len(df.columns),
+            'column_names': list(df.columns),
+            'numeric_columns': [],
+            'text_columns': [],
+            'date_columns': [],
+            'statistics': {},
+            'sample_data': {},
+            'data_quality': {}
+        }
+        
+        # Analizar cada columna
+        for col in df.columns:
+            col_data = df[col]
+            
+            # Detectar tipo de columna
+            if pd.api.types.is_numeric_dtype(col_data):
+                analysis['numeric_columns'].append(col)
+                # Estadísticas para columnas numéricas
+                analysis['statistics'][col] = {
+                    'count': int(col_data.count()),
+                    'mean': float(col_data.mean()) if col_data.count() > 0 else 0,
+                    'median': float(col_data.median()) if col_data.count() > 0 else 0,
+                    'std': float(col_data.std()) if col_data.count() > 1 else 0,
+                    'min': float(col_data.min()) if col_data.count() > 0 else 0,
+                    'max': float(col_data.max()) if col_data.count() > 0 else 0,
+                    'sum': float(col_data.sum()) if col_data.count() > 0 else 0
+                }
+            elif pd.api.types.is_datetime64_any_dtype(col_data):
+                analysis['date_columns'].append(col)
+            else:
+                analysis['text_columns'].append(col)
+                # Info para columnas de texto
+                unique_count = col_data.nunique()
+                analysis['statistics'][col] = {
+                    'unique_values': int(unique_count),
+                    'most_common': str(col_data.mode()[0]) if len(col_data.mode()) > 0 else 'N/A'
+                }
+            
+            # Muestra de datos (primeros 3 valores no nulos)
+            sample = col_data.dropna().head(3).tolist()
+            analysis['sample_data'][col] = [str(x) for x in sample]
+            
+            # Calidad de datos
+            null_count = col_data.isnull().sum()
+            analysis['data_quality'][col] = {
+                'null_count': int(null_count),
+                'null_percentage': float(null_count / len(col_data) * 100) if len(col_data) > 0 else 0
+            }
+        
+        return analysis
+    
+    except Exception as e:
+        print(f"Error in comprehensive analysis: {e}")
+        return {}
+
+
+# ===== BUFFERS COLUMNARES =====
+
+def pack_frame(df: "pd.DataFrame") -> Dict:
+    """DataFrame -> buffers columnares compactos para enviar entre procesos
+
+    Las columnas numéricas, booleanas y de fecha viajan como un array numpy
+    contiguo; las de texto u objetos, como códigos enteros más la lista de
+    valores distintos (una hoja suele repetir mucho los mismos textos).
+    """
+    columns = []
+    for name in df.columns:
+        series = df[name]
+        if isinstance(series.dtype, np.dtype) and series.dtype.kind in "biufcmM":
+            columns.append((name, "array", str(series.dtype), series.to_numpy()))
+            continue
+        codes, uniques = pd.factorize(series, use_na_sentinel=True)
+        if len(uniques) < 2 ** 15:
+            codes = codes.astype(np.int16)
+        elif len(uniques) < 2 ** 31:
+            codes = codes.astype(np.int32)
+        columns.append((name, "codes", str(series.dtype), (codes, np.asarray(uniques, dtype=object))))
+    index = df.index
+    return {
+        "columns": columns,
+        # read_excel numera las filas 0..n; dropna deja huecos que se conservan
+        "index": None if isinstance(index, pd.RangeIndex) else index.to_numpy()
+    }
+
+
+def unpack_frame(packed: Dict) -> "pd.DataFrame":
+    """Reconstruir el DataFrame de pack_frame"""
+    data = {}
+    for position, (name, kind, dtype, payload) in enumerate(packed["columns"]):
+        if kind == "array":
+            data[position] = payload
+            continue
+        codes, uniques = payload
+        values = uniques.take(codes) if len(uniques) else np.full(len(codes), np.nan, dtype=object)
+        values[codes < 0] = np.nan
+        try:
+            data[position] = pd.array(values, dtype=dtype)
+        except (TypeError, ValueError):
+            data[position] = values
+    # Claves por posición: los nombres de columna pueden repetirse
+    frame = pd.DataFrame(data, index=packed["index"])
+    frame.columns = [name for name, _, _, _ in packed["columns"]]
+    return frame
+
+
+def ingest_workbook(data: bytes, max_rows: Optional[int] = None, samples=None) -> Optional[Dict]:
+    """Leer y perfilar un libro completo (se ejecuta en un proceso del pool)
+
+    Si se pasa `samples` (cola de un multiprocessing.Manager), por cada hoja
+    xlsx se envía (hoja, sample_summary()) apenas se leen sus primeras filas.
+
+    Returns:
+        {"sheets": {hoja: {"frame": pack_frame(), "analysis": {...}, "truncated"}}, "started_at", "seconds"}
+        o None si el archivo no se pudo leer
+    """
+    started_at = time.time()
+    start = time.perf_counter()
+    on_sample = None
+    if samples is not None:
+        def on_sample(sheet_name, frame):
+            samples.put((sheet_name, sample_summary(frame)))
+    sheets_info = read_excel_file(io.BytesIO(data), max_rows, on_sample)
+    if not sheets_info:
+        return None
+    sheets = {
+        name: {"frame": pack_frame(info["dataframe"]), "analysis": get_comprehensive_data_analysis(info["dataframe"]),
+               "truncated": info["truncated"]}
+        for name, info in sheets_info.items()
+    }
+    return {"sheets": sheets, "started_at": started_at, "seconds": time.perf_counter() - start}
+
+
+# ===== POOL DE PROCESOS =====
+
+class IngestError(Exception):
+    """El trabajo de lectura no terminó"""
+
+
+class IngestQueueFull(IngestError):
+    """Hay demasiados archivos en proceso: se rechaza el trabajo sin encolarlo"""
+
+
+class IngestTimeout(IngestError):
+    """El trabajo superó su tiempo máximo y se detuvo"""
+
+
+class IngestCancelled(IngestError):
+    """El trabajo se canceló (por ejemplo, el chat envió otro archivo)"""
+
+
+def _next_sample(samples, wait: float = 0.25):
+    """Siguiente muestra de la cola (en un hilo: get bloquea); None si no llegó ninguna"""
+    try:
+        return samples.get(timeout=wait)
+    except (Empty, EOFError, OSError):
+        # EOFError/OSError: el Manager se cerró con shutdown()
+        return None
+
+
+class _Job:
+    __slots__ = ("id", "key", "submitted_at", "future", "waiter", "generation", "cancelled", "samples")
+
+    def __init__(self, job_id: int, key: Optional[Hashable], samples=None):
+        self.id = job_id
+        self.key = key
+        self.samples = samples
+        self.submitted_at = time.time()
+        self.future = None
+        self.waiter = None
+        self.generation = 0
+        self.cancelled = False
+
+
+class ExcelIngestPool:
+    """Pool acotado de procesos para leer y perfilar libros de Excel
+
+    A lo sumo `workers` libros se procesan a la vez y `max_queue` esperan o
+    corren en total; por encima se rechazan con IngestQueueFull. Un trabajo
+    que supera su timeout o se cancela ya en curso no se puede interrumpir
+    dentro del proceso, así que se terminan los procesos del pool y se
+    reinicia; los demás trabajos que corrían en él se reenvían una vez.
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_queue: int = 8, timeout: float = 120.0,
+                 max_rows: Optional[int] = None):
+        self.workers = workers or max(1, min(2, os.cpu_count() or 1))
+        self.max_rows = max_rows
+        self.max_queue = max(1, max_queue)
+        self.timeout = timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Proceso Manager con las colas de muestras (se crea con el primer run() que las pide)
+        self._manager = None
+        self._generation = 0
+        self._ids = itertools.count(1)
+        self._jobs: Dict[int, _Job] = {}
+        self._metrics = {
+            "submitted": 0, "completed": 0, "failed": 0, "timed_out": 0, "cancelled": 0, "rejected": 0,
+            "restarts": 0, "resubmitted": 0, "max_in_flight": 0,
+            "wait_seconds": 0.0, "max_wait_seconds": 0.0, "parse_seconds": 0.0, "max_parse_seconds": 0.0
+        }
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _restart(self):
+        """Terminar los procesos del pool (con el trabajo colgado) y crear uno nuevo al próximo envío"""
+        if self._executor is not None:
+            self._metrics["restarts"] += 1
+            self._terminate()
+
+    def _terminate(self):
+        executor, self._executor = self._executor, None
+        if executor is None:
+            return
+        # Los trabajos enviados al pool anterior ven que ya no es el actual y se reenvían
+        self._generation += 1
+        # ProcessPoolExecutor no permite interrumpir una tarea en curso (kill_workers llegó en Python 3.14)
+        processes = list((getattr(executor, "_processes", None) or {}).values())
+        # Sin cancel_futures: lo pendiente falla con BrokenProcessPool y se reenvía al pool nuevo
+        executor.shutdown(wait=False)
+        for process in processes:
+            if process.is_alive():
+                process.kill()
+
+    async def run(self, data: bytes, key: Optional[Hashable] = None, timeout: Optional[float] = None,
+                  on_sample: Optional[SampleHandler] = None) -> Dict:
+        """Leer y perfilar un libro en el pool sin bloquear el event loop
+
+        Args:
+            data: Contenido del archivo
+            key: Identificador para cancel() (p. ej. el chat_id)
+            timeout: Segundos máximos desde el envío, incluida la espera en cola
+                (por defecto self.timeout)
+            on_sample: Recibe (hoja, {"rows", "columns"}) de cada hoja xlsx apenas
+                se leen sus primeras filas, antes de que termine el trabajo
+
+        Returns:
+            {"sheets": {hoja: {dataframe, columns, shape, dtypes}}, "analysis": {hoja: análisis},
+            "wait_seconds", "parse_seconds"}; {} si el archivo no se pudo leer
+
+        Raises:
+            IngestQueueFull, IngestTimeout, IngestCancelled o IngestError
+        """
+        if len(self._jobs) >= self.max_queue:
+            self._metrics["rejected"] += 1
+            raise IngestQueueFull(f"Hay {len(self._jobs)} archivos en proceso (máximo {self.max_queue})")
+        timeout = self.timeout if timeout is None else timeout
+        job = _Job(next(self._ids), key, self._sample_queue() if on_sample else None)
+        self._jobs[job.id] = job
+        self._metrics["submitted"] += 1
+        self._metrics["max_in_flight"] = max(self._metrics["max_in_flight"], len(self._jobs))
+        deadline = time.monotonic() + timeout
+        relay = asyncio.ensure_future(self._relay_samples(job.samples, on_sample)) if job.samples else None
+        try:
+            result = await self._wait(job, data, deadline)
+        except IngestTimeout:
+            self._metrics["timed_out"] += 1
+            raise
+        except (IngestCancelled, asyncio.CancelledError):
+            self._metrics["cancelled"] += 1
+            raise
+        except Exception:
+            self._metrics["failed"] += 1
+            raise
+        finally:
+            self._jobs.pop(job.id, None)
+            if relay is not None:
+                relay.cancel()
+        self._metrics["completed"] += 1
+        if not result:
+            return {}
+
+        wait = max(0.0, result["started_at"] - job.submitted_at)
+        self._metrics["wait_seconds"] += wait
+        self._metrics["max_wait_seconds"] = max(self._metrics["max_wait_seconds"], wait)
+        self._metrics["parse_seconds"] += result["seconds"]
+        self._metrics["max_parse_seconds"] = max(self._metrics["max_parse_seconds"], result["seconds"])
+        print(f"Excel #{job.id}: {wait:.2f} s en cola, {result['seconds']:.2f} s de lectura y análisis "
+              f"({len(self._jobs)} en proceso)")
+
+        sheets, analysis = {}, {}
+        for name, sheet in result["sheets"].items():
+            df = unpack_frame(sheet["frame"])
+            sheets[name] = {'dataframe': df, 'columns': list(df.columns), 'shape': df.shape,
+                            'dtypes': df.dtypes.to_dict(), 'truncated': sheet["truncated"]}
+            analysis[name] = sheet["analysis"]
+        return {"sheets": sheets, "analysis": analysis, "wait_seconds": wait, "parse_seconds": result["seconds"]}
+
+    async def _wait(self, job: _Job, data: bytes, deadline: float) -> Optional[Dict]:
+        for attempt in range(2):
+            if job.cancelled:
+                raise IngestCancelled(f"Trabajo {job.id} cancelado")
+            try:
+                executor = self._pool()
+                job.generation = self._generation
+                job.future = executor.submit(ingest_workbook, data, self.max_rows, job.samples)
+                job.waiter = asyncio.wrap_future(job.future)
+                return await asyncio.wait_for(job.waiter, max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                if job.future.running() and job.generation == self._generation:
+                    self._restart()
+                raise IngestTimeout(f"Trabajo {job.id}: sin terminar después del tiempo máximo")
+            except asyncio.CancelledError:
+                if not job.cancelled and job.generation != self._generation and attempt == 0:
+                    # El reinicio por otro trabajo canceló este envío antes de empezar
+                    self._metrics["resubmitted"] += 1
+                    continue
+                if not job.cancelled:
+                    # Cancelaron la tarea que esperaba (p. ej. al detener el bot): liberar el proceso
+                    self._cancel_job(job)
+                    raise
+                raise IngestCancelled(f"Trabajo {job.id} cancelado")
+            except BrokenProcessPool:
+                if job.generation == self._generation:
+                    # Un proceso murió (memoria, segfault): el pool no sirve más
+                    self._restart()
+                    raise IngestError(f"Trabajo {job.id}: el proceso de lectura terminó inesperadamente")
+                if attempt:
+                    raise IngestError(f"Trabajo {job.id}: el pool se reinició dos veces")
+                # Lo interrumpió el reinicio por otro trabajo: se reenvía
+                self._metrics["resubmitted"] += 1
+        return None
+
+    def _sample_queue(self):
+        if self._manager is None:
+            self._manager = multiprocessing.Manager()
+        return self._manager.Queue()
+
+    @staticmethod
+    async def _relay_samples(samples, on_sample: SampleHandler):
+        """Entregar en el event loop las muestras que envía el proceso del pool"""
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await loop.run_in_executor(None, _next_sample, samples)
+            if item is None:
+                continue
+            try:
+                result = on_sample(*item)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                print(f"Error mostrando la muestra de {item[0]}: {e}")
+
+    def _cancel_job(self, job: _Job):
+        job.cancelled = True
+        if job.future is not None and not job.future.cancel() and not job.future.done() \
+                and job.generation == self._generation:
+            self._restart()
+        if job.waiter is not None:
+            job.waiter.cancel()
+
+    def cancel(self, key: Hashable) -> int:
+        """Cancelar los trabajos en curso o en cola de `key`
+
+        Returns:
+            Número de trabajos cancelados
+        """
+        jobs = [job for job in self._jobs.values() if job.key == key and not job.cancelled]
+        for job in jobs:
+            self._cancel_job(job)
+        return len(jobs)
+
+    def stats(self) -> Dict:
+        """Métricas del pool: trabajos en proceso, resultados y tiempos de espera y de lectura"""
+        metrics = dict(self._metrics)
+        running = sum(1 for job in self._jobs.values() if job.future is not None and job.future.running())
+        measured = max(1, metrics["completed"])
+        metrics.update({
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": len(self._jobs),
+            "running": running,
+            "queued": len(self._jobs) - running,
+            "avg_wait_seconds": metrics["wait_seconds"] / measured,
+            "avg_parse_seconds": metrics["parse_seconds"] / measured
+        })
+        return metrics
+
+    def shutdown(self):
+        """Cancelar lo pendiente y terminar los procesos"""
+        for job in list(self._jobs.values()):
+            self._cancel_job(job)
+        self._terminate()
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
@@ -0,0 +1,166 @@
+"""
+Cliente HTTP de Gemini compartido por el bot y el evaluador de perfiles
+Sin estado de módulo: importarlo no abre perfiles, hilos ni pools.
+"""
+
+import os
+from typing import Dict, Optional
+
+import httpx  # pyright: ignore[reportMissingImports]
+from google.oauth2 import service_account  # pyright: ignore[reportMissingImports]
+from google.auth.transport.requests import Request as GoogleRequest  # pyright: ignore[reportMissingImports]
+
+
+async def query_gemini(prompt: str, api_url: str, api_key: str, timeout: Optional[float] = 15.0, usage: Optional[Dict] = None) -> str:
+    """Send prompt to Gemini API and return the text response.
+
+    This expects the Gemini endpoint to accept a JSON payload like {"input": "..."}
+    and return a JSON with a `text` field. Adjust the payload parsing if your API
+    differs.
+
+    If `usage` is a dict, it is filled with the response `usageMetadata` when present.
+    """
+    # preparar headers y url dependiendo de si la API key debe pasarse como parámetro de consulta (común para API keys) o como token Bearer.
+    # passed as a query parameter (common for API keys) o como token Bearer.
+    headers = {"Content-Type": "application/json"}
+    url = api_url
+
+    # si un archivo JSON de cuenta de servicio está disponible en el entorno, preferir token OAuth Bearer
+    sa_path = os.getenv("GEMINI_SA_PATH") or os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+    if sa_path and os.path.exists(sa_path):
+        # obtener un token de acceso con scope cloud-platform
+        creds = service_account.Credentials.from_service_account_file(sa_path, scopes=["https://www.googleapis.com/auth/cloud-platform"])
+        creds.refresh(GoogleRequest())
+        token = creds.token
+        headers["Authorization"] = f"Bearer {token}"
+        # no agregar API key cuando se usa OAuth
+        url = api_url
+    else:
+        # si la api_url no incluye ya un parámetro de API key, adjuntarlo para
+        # servicios que esperan ?key=API_KEY (por ejemplo, algunos puntos finales de Google cuando se usan API keys).
+        if api_key:
+            if "key=" not in api_url:
+                sep = "&" if "?" in api_url else "?"
+                url = f"{api_url}{sep}key={api_key}"
+            else:
+                url = api_url
+        else:
+            url = api_url
+
+        # si la url no contiene un parámetro de API key y la api_key parece
+        # un token (cadena larga), aún intentamos establecerlo como Bearer en el encabezado de Authorization
+        # encabezado en caso de que el servicio espere OAuth Bearer.
+        if api_key and "key=" not in url:
+            headers["Authorization"] = f"Bearer {api_key}"
+
+    # si la api_url no incluye ya un parámetro de API key, adjuntarlo para
+    # servicios que esperan ?key=API_KEY (por ejemplo, algunos puntos finales de Google cuando se usan API keys).
+    if api_key:
+        if "key=" not in api_url:
+            sep = "&" if "?" in api_url else "?"
+            url = f"{api_url}{sep}key={api_key}"
+        else:
+            url = api_url
+    else:
+        # no se proporcionó api_key: nada que agregar
+        url = api_url
+
+    # si la url no contiene un parámetro de API key y la api_key parece
+    # un token (cadena larga), aún intentamos establecerlo como Bearer en el encabezado de Authorization
+    # encabezado en caso de que el servicio espere OAuth Bearer.
+    if api_key and "key=" not in url:
+        headers["Authorization"] = f"Bearer {api_key}"
+
+    # elegir payloads dependiendo de la familia del punto final.
+    is_generate_content = (":generateContent" in url) or ("generativelanguage.googleapis.com" in url)
+    is_vertex_predict = (":predict" in url) or ("aiplatform.googleapis.com" in url)
+
+    if is_generate_content:
+        # Gemini APIs de lenguaje generativo esperan `contents`
+        payload_candidates = [
+            {"contents": [{"role": "user", "parts": [{"text": prompt}]}]},
+        ]
+    elif is_vertex_predict:
+        # Vertex AI Predict-style espera `instances` con un array `content`
+        payload_candidates = [
+            {"instances": [{"content": [{"role": "user", "parts": [{"text": prompt}]}]}]},
+        ]
+    else:
+        # intentar un conjunto más amplio (excluyendo las variantes problemáticas `input`)
+        payload_candidates = [
+            {"contents": [{"role": "user", "parts": [{"text": prompt}]}]},
+            {"prompt": {"text": prompt}},
+            {"instances": [{"content": prompt}]},
+            {"instances": [{"content": [{"type": "text", "text": prompt}]}]},
+        ]
+
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        last_exc = None
+        for payload in payload_candidates:
+            try:
+                r = await client.post(url, json=payload, headers=headers)
+                # si es exitoso (2xx), parsear y devolver
+                if 200 <= r.status_code < 300:
+                    try:
+                        data = r.json()
+                    except Exception:
+                        return r.text
+
+                    # conservar conteo de tokens reportado por la API
+                    if usage is not None and isinstance(data, dict) and isinstance(data.get("usageMetadata"), dict):
+                        usage.update(data["usageMetadata"])
+
+                    # parsear varias formas comunes de respuesta
+                    if isinstance(data, dict):
+                        # texto directo
+                        if "text" in data:
+                            return data["text"]
+                        # salida anidada.text
+                        if "output" in data and isinstance(data["output"], dict) and "text" in data["output"]:
+                            return data["output"]["text"]
+                        # Gemini candidates[].content.parts[].text (candidatos de Gemini)
+                        if "candidates" in data and isinstance(data["candidates"], list) and data["candidates"]:
+                            cand0 = data["candidates"][0]
+                            if isinstance(cand0, dict):
+                                # algunos endpoints devuelven texto de nivel superior
+                                if "text" in cand0:
+                                    return cand0["text"]
+                                # lenguaje generativo: content.parts
+                                content = cand0.get("content")
+                                if isinstance(content, dict):
+                                    parts = content.get("parts")
+                                    if isinstance(parts, list) and parts:
+                                        part0 = parts[0]
+                                        if isinstance(part0, dict) and "text" in part0:
+                                            return part0["text"]
+                        # fallback stringify si la estructura es desconocida
+                        return str(data)
+                    return r.text
+                else:
+                    # registrar cuerpo de error para depuración, pero intentar siguiente payload
+                    last_exc = (r.status_code, r.text)
+            except Exception as e:
+                last_exc = e
+
+        # si llegamos aquí, todos los payloads fallaron; proporcionar error útil
+        if isinstance(last_exc, tuple):
+            status, body = last_exc
+            raise RuntimeError(f"Request failed with status {status}: {body}")
+        raise RuntimeError(f"Request failed: {last_exc}")
+
+    # intentar varias formas comunes de respuesta
+    if isinstance(data, dict):
+        # común: {"text": "..."}
+        if "text" in data:
+            return data["text"]
+        # otra forma común: {"output": {"text": "..."}}
+        if "output" in data and isinstance(data["output"], dict) and "text" in data["output"]:
+            return data["output"]["text"]
+        # si la API devuelve una lista de fragmentos
+        if "candidates" in data and isinstance(data["candidates"], list) and data["candidates"]:
+            first = data["candidates"][0]
+            if isinstance(first, dict) and "text" in first:
+                return first["text"]
+
+    # fallback: stringify toda la respuesta
+    return str(data)
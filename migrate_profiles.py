@@ -0,0 +1,70 @@
+"""
+Migración de perfiles entre backends de almacenamiento
+Copia todo el universo de perfiles de un archivo JSON a una base SQLite (o al
+revés) y verifica que el destino se lea exactamente igual que el origen
+
+Uso:
+    python migrate_profiles.py bot_profiles.json bot_profiles.db
+    python migrate_profiles.py bot_profiles.db bot_profiles_export.json
+"""
+
+import argparse
+import os
+import sys
+
+from profile_store import open_store
+
+
+def migrate(source_path: str, target_path: str, force: bool = False) -> dict:
+    """Copiar perfiles de source_path a target_path
+
+    Returns:
+        Resumen con número de perfiles, versiones, entradas y documentos copiados
+    """
+    if os.path.exists(target_path) and not force:
+        raise FileExistsError(f"{target_path} ya existe (usa --force para sobrescribir)")
+    if force and os.path.exists(target_path):
+        os.remove(target_path)
+
+    profiles = open_store(source_path).load()
+    if profiles is None:
+        raise FileNotFoundError(f"No hay perfiles en {source_path}")
+    # Cargar todas las versiones (el origen SQLite las lee bajo demanda)
+    for profile in profiles["profiles"].values():
+        profile["versions"] = dict(profile.get("versions", {}))
+
+    target = open_store(target_path)
+    target.save(profiles)
+
+    if open_store(target_path).load() != profiles:
+        raise RuntimeError("La verificación falló: el destino no coincide con el origen")
+
+    versions = [v for p in profiles["profiles"].values() for v in p.get("versions", {}).values()]
+    return {
+        "profiles": len(profiles["profiles"]),
+        "versions": len(versions),
+        "kb_entries": sum(len(v.get("knowledge_base", {})) for v in versions),
+        "documents": sum(len(v.get("documents", [])) for v in versions)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="Archivo de origen (.json o .db)")
+    parser.add_argument("target", help="Archivo de destino (.json o .db)")
+    parser.add_argument("--force", action="store_true", help="Sobrescribir el destino si existe")
+    args = parser.parse_args()
+
+    try:
+        summary = migrate(args.source, args.target, args.force)
+    except Exception as e:
+        print(f"❌ Error en la migración: {e}")
+        sys.exit(1)
+
+    print(f"✅ Migrados {summary['profiles']} perfiles, {summary['versions']} versiones, "
+          f"{summary['kb_entries']} entradas de conocimiento y {summary['documents']} documentos")
+    print(f"Para usarlo define PROFILES_FILE={args.target}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Evaluación de versiones de perfil antes de activarlas
+Reproduce un conjunto de preguntas contra una o más versiones de perfil,
+en paralelo y con concurrencia acotada, y reporta latencia, tokens de
+prompt y longitud de respuesta por versión
+
+Uso:
+    python profile_eval.py preguntas.txt "Catálogo de Vehículos:2" "Catálogo de Vehículos:3" --stub
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from profile_manager import ProfileManager
+from token_usage import estimate_tokens
+
+# (prompt, usage) -> texto de respuesta; usage se rellena con usageMetadata si existe
+Responder = Callable[[str, Dict], Awaitable[str]]
+
+
+def load_questions(path: str) -> List[str]:
+    """Cargar el corpus de preguntas (.txt una por línea, .csv o .json)"""
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, 'r', encoding='utf-8') as f:
+        if ext == ".json":
+            data = json.load(f)
+            questions = [q["question"] if isinstance(q, dict) else q for q in data]
+        elif ext == ".csv":
+            reader = csv.DictReader(f)
+            column = next((c for c in (reader.fieldnames or []) if c.lower() in ("pregunta", "question")), None)
+            if column is None and reader.fieldnames:
+                column = reader.fieldnames[0]
+            questions = [row[column] for row in reader if column]
+        else:
+            questions = f.read().splitlines()
+    return [q.strip() for q in questions if q and q.strip()]
+
+
+def parse_target(spec: str, pm: ProfileManager) -> Tuple[str, int]:
+    """Convertir 'Perfil:3' (o 'Perfil' para la versión activa) en (perfil, versión)"""
+    name, _, version = spec.rpartition(":")
+    if name and version.isdigit():
+        return name, int(version)
+    profile = pm.get_profile(spec)
+    if not profile:
+        raise ValueError(f"Perfil '{spec}' no encontrado")
+    return spec, int(profile["active_version"])
+
+
+def build_prompt(profile_context: str, question: str) -> str:
+    """Armar el prompt con el mismo formato que usa el bot"""
+    parts = []
+    if profile_context:
+        parts.append(f"profile_context: {profile_context}")
+    parts.append(f"user: {question}")
+    return "\n".join(parts)
+
+
+async def local_stub_responder(prompt: str, usage: Dict) -> str:
+    """Respuesta simulada: latencia proporcional al tamaño del prompt, sin llamar a la API"""
+    await asyncio.sleep(0.02 + len(prompt) / 2_000_000)
+    question = prompt.rsplit("user: ", 1)[-1]
+    return f"Respuesta simulada para: {question[:80]}"
+
+
+def gemini_responder(api_url: str, api_key: str, timeout: float = 30.0) -> Responder:
+    """Responder que usa el mismo cliente de Gemini que el bot"""
+    # Import diferido: httpx y google-auth solo hacen falta sin --stub
+    from gemini_client import query_gemini
+
+    async def _respond(prompt: str, usage: Dict) -> str:
+        return await query_gemini(prompt, api_url, api_key, timeout, usage=usage)
+
+    return _respond
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Percentil por interpolación lineal (values no necesita estar ordenado)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+async def evaluate_versions(pm: ProfileManager, targets: List[Tuple[str, int]], questions: List[str],
+                            responder: Responder, concurrency: int = 4) -> Dict[str, Dict]:
+    """Ejecutar todas las preguntas contra cada versión y devolver métricas por versión"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _ask(prompt: str) -> Dict:
+        async with semaphore:
+            usage = {}
+            start = time.perf_counter()
+            try:
+                answer = await responder(prompt, usage)
+                error = None
+            except Exception as e:
+                answer, error = "", str(e)
+            latency = time.perf_counter() - start
+        prompt_tokens = int(usage.get("promptTokenCount") or estimate_tokens(prompt))
+        return {"latency": latency, "prompt_tokens": prompt_tokens,
+                "response_chars": len(answer), "error": error}
+
+    report = {}
+    for profile_name, version in targets:
+        context = pm.get_version_context(profile_name, version)
+        if not context:
+            print(f"⚠️ Versión vacía o inexistente: {profile_name} v{version}")
+        results = await asyncio.gather(*[_ask(build_prompt(context, q)) for q in questions])
+        ok = [r for r in results if not r["error"]]
+        latencies = [r["latency"] for r in ok]
+        report[f"{profile_name}@v{version}"] = {
+            "questions": len(results),
+            "errors": len(results) - len(ok),
+            "context_chars": len(context),
+            "context_tokens": estimate_tokens(context),
+            "latency_p50": percentile(latencies, 50),
+            "latency_p90": percentile(latencies, 90),
+            "latency_p99": percentile(latencies, 99),
+            "prompt_tokens_avg": sum(r["prompt_tokens"] for r in results) / len(results) if results else 0,
+            "response_chars_avg": sum(r["response_chars"] for r in ok) / len(ok) if ok else 0,
+            "sample_errors": [r["error"] for r in results if r["error"]][:3]
+        }
+    return report
+
+
+def format_report(report: Dict[str, Dict]) -> str:
+    """Tabla de texto con una fila por versión"""
+    header = f"{'versión':<40} {'ctx tok':>8} {'prompt tok':>10} {'p50 s':>7} {'p90 s':>7} {'p99 s':>7} {'resp car':>9} {'errores':>8}"
+    lines = [header, "-" * len(header)]
+    for key, r in report.items():
+        lines.append(
+            f"{key[:40]:<40} {r['context_tokens']:>8} {r['prompt_tokens_avg']:>10.0f} "
+            f"{r['latency_p50']:>7.2f} {r['latency_p90']:>7.2f} {r['latency_p99']:>7.2f} "
+            f"{r['response_chars_avg']:>9.0f} {r['errors']:>8}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Evaluar versiones de perfil con un corpus de preguntas")
+    parser.add_argument("questions", help="Archivo de preguntas (.txt, .csv o .json)")
+    parser.add_argument("targets", nargs="+", help="Versiones a evaluar: 'Perfil:versión' o 'Perfil' (activa)")
+    parser.add_argument("--profiles-file", default="bot_profiles.json")
+    parser.add_argument("--concurrency", type=int, default=4, help="Máximo de llamadas simultáneas")
+    parser.add_argument("--stub", action="store_true", help="Usar el responder local en lugar de Gemini")
+    parser.add_argument("--json", dest="json_path", help="Guardar el reporte también en JSON")
+    args = parser.parse_args(argv)
+
+    pm = ProfileManager(args.profiles_file)
+    targets = [parse_target(t, pm) for t in args.targets]
+    questions = load_questions(args.questions)
+
+    if args.stub:
+        responder = local_stub_responder
+    else:
+        try:
+            from dotenv import load_dotenv
+            load_dotenv()
+        except ImportError:
+            pass
+        api_url = os.getenv("GEMINI_API_URL")
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_url or not api_key:
+            raise SystemExit("GEMINI_API_URL y GEMINI_API_KEY son necesarios (o usa --stub)")
+        responder = gemini_responder(api_url, api_key)
+
+    report = asyncio.run(evaluate_versions(pm, targets, questions, responder, args.concurrency))
+    print(format_report(report))
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
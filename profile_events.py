@@ -0,0 +1,203 @@
+"""
+Eventos de cambio de ProfileManager
+Cada modificación genera un ChangeEvent con su granularidad (perfil, versión o
+sección de una versión). Los eventos se entregan a los suscriptores del proceso
+después de guardar y, si se configura un registro, se agregan a un log SQLite
+durable con número de secuencia: otro proceso, o un suscriptor que se reinicia,
+retoma desde su última secuencia y solo procesa lo que cambió.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Tipos de evento
+PROFILE_CREATED = "profile.created"
+PROFILE_UPDATED = "profile.updated"        # section = campo del perfil (description, type, version_tags...)
+PROFILE_DELETED = "profile.deleted"
+VERSION_CREATED = "version.created"
+VERSION_ACTIVATED = "version.activated"
+VERSION_DELETED = "version.deleted"
+SECTION_UPDATED = "section.updated"        # section = campo de la versión; key = entrada o documento
+SETTINGS_UPDATED = "settings.updated"      # section = ajuste global (active_profiles, chat_routes...)
+# Otro proceso cambió el almacenamiento y no hay registro que detalle qué: reconstruir todo
+STORE_RELOADED = "store.reloaded"
+
+EVENT_KINDS = (PROFILE_CREATED, PROFILE_UPDATED, PROFILE_DELETED, VERSION_CREATED, VERSION_ACTIVATED,
+               VERSION_DELETED, SECTION_UPDATED, SETTINGS_UPDATED, STORE_RELOADED)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    profile TEXT,
+    version INTEGER,
+    section TEXT,
+    key TEXT,
+    timestamp REAL NOT NULL,
+    origin TEXT
+);
+CREATE TABLE IF NOT EXISTS cursors (
+    subscriber TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class ChangeEvent:
+    """Un cambio confirmado: qué pasó (kind) y dónde (perfil, versión, sección, clave)
+
+    seq es 0 hasta que el evento se publica; con registro durable es la
+    secuencia del log, sin él un contador del proceso.
+    """
+
+    __slots__ = ("kind", "profile", "version", "section", "key", "timestamp", "seq")
+
+    def __init__(self, kind: str, profile: Optional[str] = None, version: Optional[int] = None,
+                 section: Optional[str] = None, key: Optional[str] = None,
+                 timestamp: Optional[float] = None, seq: int = 0):
+        self.kind = kind
+        self.profile = profile
+        self.version = None if version is None else int(version)
+        self.section = section
+        self.key = None if key is None else str(key)
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.seq = seq
+
+    def to_dict(self) -> Dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def __repr__(self):
+        where = "/".join(str(part) for part in (self.profile, self.version, self.section, self.key)
+                         if part is not None)
+        return f"ChangeEvent(#{self.seq} {self.kind} {where})"
+
+
+ChangeCallback = Callable[[ChangeEvent], None]
+
+
+class EventLogGap(Exception):
+    """Los eventos pedidos ya se podaron del registro: el suscriptor debe reconstruir todo"""
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class EventLog:
+    """Registro durable de eventos con número de secuencia (SQLite, compartible entre procesos)"""
+
+    def __init__(self, path: str = "profile_events.db", keep_events: int = 100000):
+        self.path = path
+        self.keep_events = keep_events
+        self.origin = f"{os.getpid()}"
+        self._lock = threading.Lock()
+        self._conn = _connect(path)
+        self._conn_pid = os.getpid()
+
+    def _db(self) -> sqlite3.Connection:
+        # Una conexión SQLite no debe cruzar un fork
+        if self._conn_pid != os.getpid():
+            self._conn = _connect(self.path)
+            self._conn_pid = os.getpid()
+            self.origin = f"{os.getpid()}"
+        return self._conn
+
+    def append(self, events: List[ChangeEvent]) -> Tuple[int, int]:
+        """Agregar eventos en una sola transacción y asignarles su secuencia
+
+        Returns:
+            (primera, última) secuencia asignada; (0, 0) si no había eventos
+        """
+        if not events:
+            return 0, 0
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                first = db.execute(
+                    "INSERT INTO events (kind, profile, version, section, key, timestamp, origin) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (events[0].kind, events[0].profile, events[0].version, events[0].section,
+                     events[0].key, events[0].timestamp, self.origin)
+                ).lastrowid
+                db.executemany(
+                    "INSERT INTO events (kind, profile, version, section, key, timestamp, origin) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    ((e.kind, e.profile, e.version, e.section, e.key, e.timestamp, self.origin)
+                     for e in events[1:])
+                )
+                last = first + len(events) - 1
+                if self.keep_events > 0:
+                    db.execute("DELETE FROM events WHERE seq <= ?", (last - self.keep_events,))
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        # Dentro de la transacción las secuencias son consecutivas
+        for seq, event in enumerate(events, first):
+            event.seq = seq
+        return first, last
+
+    def last_seq(self) -> int:
+        """Última secuencia asignada (0 si nunca hubo eventos)"""
+        with self._lock:
+            row = self._db().execute("SELECT seq FROM sqlite_sequence WHERE name = 'events'").fetchone()
+        return row[0] if row else 0
+
+    def read(self, after_seq: int = 0, limit: int = 1000) -> List[ChangeEvent]:
+        """Eventos con secuencia mayor que after_seq, en orden
+
+        Raises:
+            EventLogGap: si parte de esos eventos ya se podó
+        """
+        with self._lock:
+            db = self._db()
+            oldest = db.execute("SELECT MIN(seq) FROM events").fetchone()[0]
+            rows = db.execute(
+                "SELECT seq, kind, profile, version, section, key, timestamp FROM events "
+                "WHERE seq > ? ORDER BY seq LIMIT ?", (after_seq, limit)
+            ).fetchall()
+        if oldest is not None and oldest > after_seq + 1 and after_seq < self.last_seq():
+            raise EventLogGap(f"El registro empieza en {oldest}; se pidió desde {after_seq + 1}")
+        return [ChangeEvent(kind, profile, version, section, key, timestamp, seq)
+                for seq, kind, profile, version, section, key, timestamp in rows]
+
+    def catch_up(self, after_seq: int, handler: ChangeCallback, batch_size: int = 1000) -> int:
+        """Entregar a handler todos los eventos posteriores a after_seq
+
+        Returns:
+            Última secuencia entregada (after_seq si no había nada nuevo)
+
+        Raises:
+            EventLogGap: si el suscriptor quedó tan atrás que debe reconstruir todo
+        """
+        while True:
+            events = self.read(after_seq, batch_size)
+            for event in events:
+                handler(event)
+                after_seq = event.seq
+            if len(events) < batch_size:
+                return after_seq
+
+    def save_cursor(self, subscriber: str, seq: int):
+        """Guardar la última secuencia procesada por un suscriptor"""
+        with self._lock:
+            self._db().execute(
+                "INSERT INTO cursors (subscriber, seq, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(subscriber) DO UPDATE SET seq = excluded.seq, updated_at = excluded.updated_at",
+                (subscriber, seq, time.time())
+            )
+
+    def cursor(self, subscriber: str) -> int:
+        """Última secuencia guardada por un suscriptor (0 si es nuevo)"""
+        with self._lock:
+            row = self._db().execute("SELECT seq FROM cursors WHERE subscriber = ?", (subscriber,)).fetchone()
+        return row[0] if row else 0
@@ -0,0 +1,398 @@
+"""
+Lectura y validación de CSV de perfiles y catálogos de vehículos
+Funciones puras (sin ProfileManager) que leen un CSV y devuelven el contenido
+a aplicar; las usan las importaciones de ProfileManager y la importación
+masiva, que las ejecuta en paralelo en un pool de procesos
+"""
+
+import csv
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from csv_stream import ProgressCallback, iter_csv_rows
+from vehicle_catalog import CatalogColumnsBuilder
+
+# Campos del formato Campo,Valor (los que escribe export_profile_to_csv)
+PROFILE_FIELDS = (
+    "profile_name", "profile_description", "profile_type", "profile_id", "active_version",
+    "system_prompt", "context", "tone", "language", "instructions", "examples", "restrictions",
+    "knowledge_base", "documents"
+)
+# Columnas mínimas para reconocer un catálogo de vehículos
+CATALOG_REQUIRED_COLUMNS = ("marca", "modelo")
+
+
+def detect_csv_kind(csv_path: str) -> str:
+    """'profile' (formato Campo,Valor), 'catalog' (catálogo de vehículos) o '' si no se reconoce"""
+    with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+        header = [column.strip() for column in next(csv.reader(f), [])]
+    if header[:2] == ["Campo", "Valor"]:
+        return "profile"
+    if all(column in header for column in CATALOG_REQUIRED_COLUMNS):
+        return "catalog"
+    return ""
+
+
+def parse_profile_csv(csv_path: str) -> Dict:
+    """Leer un CSV de perfil en formato Campo,Valor
+    
+    Returns:
+        {name, description, type, version (campos de la versión 1),
+         knowledge_base [(clave, valor)], documents [(nombre, contenido)], warnings}
+    """
+    data = {}
+    with open(csv_path, 'r', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        if next(reader, None) is None:  # Skip header
+            raise ValueError("El CSV está vacío")
+        for row in reader:
+            if len(row) >= 2:
+                data[row[0]] = row[1]
+    
+    warnings = []
+    unknown = [field for field in data if field not in PROFILE_FIELDS]
+    if unknown:
+        warnings.append(f"Campos desconocidos ignorados: {', '.join(unknown)}")
+    if not data.get('profile_name'):
+        warnings.append("Sin profile_name: se usará 'Imported Profile'")
+    
+    version = {
+        'system_prompt': data.get('system_prompt', ''),
+        'context': data.get('context', ''),
+        'tone': data.get('tone', 'profesional'),
+        'language': data.get('language', 'español'),
+        'instructions': data.get('instructions', '').split('|') if data.get('instructions') else [],
+        'examples': data.get('examples', '').split('||') if data.get('examples') else [],
+        'restrictions': data.get('restrictions', '').split('|') if data.get('restrictions') else [],
+    }
+    
+    # Filtrar valores vacíos
+    version['instructions'] = [i for i in version['instructions'] if i.strip()]
+    version['examples'] = [e for e in version['examples'] if e.strip()]
+    version['restrictions'] = [r for r in version['restrictions'] if r.strip()]
+    
+    # Knowledge base (key1=value1|key2=value2)
+    knowledge_base = []
+    kb_str = data.get('knowledge_base', '')
+    if kb_str:
+        for kb_item in kb_str.split('|'):
+            if '=' in kb_item:
+                knowledge_base.append(tuple(kb_item.split('=', 1)))
+            elif kb_item.strip():
+                warnings.append(f"Entrada de conocimiento sin '=' ignorada: {kb_item[:40]}")
+    
+    # Documentos (name1::content1||name2::content2)
+    documents = []
+    docs_str = data.get('documents', '')
+    if docs_str:
+        for doc_item in docs_str.split('||'):
+            if '::' in doc_item:
+                documents.append(tuple(doc_item.split('::', 1)))
+            elif doc_item.strip():
+                warnings.append(f"Documento sin '::' ignorado: {doc_item[:40]}")
+    
+    return {
+        "name": data.get('profile_name', 'Imported Profile'),
+        "description": data.get('profile_description', ''),
+        "type": data.get('profile_type', 'general'),
+        "version": version,
+        "knowledge_base": knowledge_base,
+        "documents": documents,
+        "warnings": warnings
+    }
+
+
+def format_vehicle_info(vehicle: Dict) -> str:
+    """Ficha de un vehículo del catálogo para la base de conocimientos"""
+    marca = vehicle.get('marca', 'N/A')
+    modelo = vehicle.get('modelo', 'N/A')
+    version = vehicle.get('version', 'N/A')
+    año = vehicle.get('año', 'N/A')
+    
+    vehicle_info = f"""
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+🚗 {marca} {modelo} {version} ({año})
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+📋 INFORMACIÓN GENERAL:
+• ID: {vehicle.get('id', 'N/A')}
+• Marca: {marca}
+• Modelo: {modelo}
+• Versión: {version}
+• Año: {año}
+• Tipo de Carrocería: {vehicle.get('tipo_carroceria', 'N/A')}
+
+🔧 ESPECIFICACIONES TÉCNICAS:
+• Motor: {vehicle.get('modelo_motor', 'N/A')}
+• Potencia: {vehicle.get('potencia_hp', 'N/A')} HP
+• Cilindrada: {vehicle.get('cilindrada', 'N/A')}
+• Transmisión: {vehicle.get('transmision', 'N/A')}
+• Capacidad de Combustible: {vehicle.get('capacidad_combustible_lt', 'N/A')} litros
+
+🚙 CARACTERÍSTICAS:
+• Puertas: {vehicle.get('puertas', 'N/A')}
+• Asientos: {vehicle.get('asientos', 'N/A')}
+• Neumáticos: {vehicle.get('neumaticos', 'N/A')}
+
+🎨 COLORES DISPONIBLES:
+{vehicle.get('colores', 'N/A')}
+
+⭐ EQUIPAMIENTO DESTACADO:
+{vehicle.get('equipamiento_destacado', 'N/A')}
+
+🛡️ GARANTÍA:
+• Años: {vehicle.get('garantia_años', 'N/A')} año(s)
+• Kilómetros: {vehicle.get('garantia_km', 'N/A')} km
+
+📸 IMAGEN:
+{vehicle.get('link_foto', 'No disponible')}
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+"""
+    return vehicle_info.strip()
+
+
+class CatalogImportBuilder:
+    """Contenido de un perfil de catálogo de vehículos, armado fila a fila
+    
+    add() devuelve la ficha de cada vehículo para la base de conocimientos; de
+    cada fila solo se conservan sus columnas (CatalogColumnsBuilder) y
+    etiquetas cortas para el resumen y el índice de búsqueda. finish() arma el
+    resto del perfil (prompt, documentos, ejemplos, restricciones).
+    """
+    
+    def __init__(self):
+        self.count = 0
+        self.columns = CatalogColumnsBuilder()
+        self.warnings: List[str] = []
+        self._brands: Dict[str, None] = {}
+        self._by_brand: Dict[str, List[str]] = {}
+        self._by_body: Dict[str, List[str]] = {}
+        self._by_trans: Dict[str, List[str]] = {}
+        self._keys = set()
+        self._incomplete = 0
+    
+    def add(self, vehicle: Dict) -> Tuple[str, str]:
+        """Registrar un vehículo (fila de csv.DictReader)
+        
+        Returns:
+            (clave en la base de conocimientos, ficha del vehículo)
+        """
+        vehicle_id = vehicle.get('id', f'VEH_{self.count + 1}')
+        marca = vehicle.get('marca', 'N/A')
+        modelo = vehicle.get('modelo', 'N/A')
+        version = vehicle.get('version', 'N/A')
+        año = vehicle.get('año', 'N/A')
+        
+        # Crear clave única para el vehículo
+        kb_key = f"{marca}_{modelo}_{version}_{año}_{vehicle_id}".replace(' ', '_')
+        if kb_key in self._keys:
+            self.warnings.append(f"Fila {self.count + 2}: vehículo repetido ({kb_key}), reemplaza al anterior")
+        self._keys.add(kb_key)
+        if not vehicle.get('marca') or not vehicle.get('modelo'):
+            self._incomplete += 1
+        info = format_vehicle_info(vehicle)
+        self.columns.add(vehicle, kb_key, info)
+        
+        self._brands[vehicle.get('marca', '')] = None
+        self._by_brand.setdefault(vehicle.get('marca', 'Sin marca'), []).append(
+            f"  • {vehicle.get('modelo', 'N/A')} {vehicle.get('año', 'N/A')} {vehicle.get('version', '')}".strip()
+        )
+        label = f"{vehicle.get('marca')} {vehicle.get('modelo')} {vehicle.get('año')}"
+        self._by_body.setdefault(vehicle.get('tipo_carroceria', 'Otro'), []).append(label)
+        self._by_trans.setdefault(vehicle.get('transmision', 'N/A'), []).append(label)
+        
+        self.count += 1
+        return kb_key, info
+    
+    def finish(self) -> Dict:
+        """Resto del contenido del perfil, una vez registrados todos los vehículos
+        
+        Returns:
+            {description, settings (campos de la versión), vehicle_catalog,
+             documents [(nombre, contenido, tipo)], examples, restrictions, warnings}
+        """
+        count = self.count
+        brands = self._brands
+        if self._incomplete:
+            self.warnings.append(f"{self._incomplete} vehículo(s) sin marca o modelo")
+        
+        # System prompt especializado para vehículos
+        system_prompt = """Eres un experto asesor de ventas de vehículos. Tienes conocimiento completo del catálogo de vehículos disponibles y puedes ayudar a los clientes a encontrar el vehículo perfecto según sus necesidades, presupuesto y preferencias.
+
+Cuando un cliente pregunte sobre vehículos:
+1. Identifica sus necesidades (tamaño, uso, presupuesto, preferencias)
+2. Recomienda modelos específicos del catálogo
+3. Destaca características relevantes (motor, equipamiento, colores disponibles)
+4. Proporciona detalles técnicos cuando se soliciten
+5. Ayuda a comparar diferentes modelos
+6. Facilita el proceso de decisión con información clara y precisa"""
+        
+        # Contexto general
+        context = f"""Este perfil contiene información detallada sobre {count} vehículos en nuestro catálogo. 
+Cada vehículo incluye especificaciones técnicas completas, equipamiento, colores disponibles y más.
+
+El catálogo se actualiza regularmente y toda la información ha sido importada y verificada."""
+        
+        # Instrucciones específicas
+        instructions = [
+            "Saluda cordialmente y pregunta qué tipo de vehículo está buscando el cliente",
+            "Identifica necesidades clave: uso del vehículo, número de pasajeros, tipo de conducción",
+            "Recomienda vehículos específicos del catálogo basándote en las necesidades",
+            "Proporciona detalles técnicos precisos del catálogo cuando se soliciten",
+            "Destaca el equipamiento y características únicas de cada modelo",
+            "Menciona los colores disponibles cuando sea relevante",
+            "Ofrece comparaciones entre modelos cuando el cliente esté indeciso",
+            "Proporciona información sobre motores, potencia y consumo",
+            "Si tienes foto disponible, ofrece mostrarla al cliente",
+            "Mantén un tono profesional pero amigable y consultivo"
+        ]
+        
+        # Documento resumen del catálogo
+        summary_lines = [
+            "═" * 60,
+            f"📊 RESUMEN DEL CATÁLOGO - {count} VEHÍCULOS",
+            "═" * 60,
+            ""
+        ]
+        
+        for marca, brand_lines in sorted(self._by_brand.items()):
+            summary_lines.append(f"\n🏷️ {marca.upper()} ({len(brand_lines)} modelos):")
+            summary_lines.extend(brand_lines)
+        
+        summary_lines.append("\n" + "═" * 60)
+        
+        # Documento con índice de búsqueda rápida
+        index_lines = [
+            "═" * 60,
+            "🔍 ÍNDICE DE BÚSQUEDA RÁPIDA",
+            "═" * 60,
+            "",
+            "Busca vehículos por características:",
+            ""
+        ]
+        
+        # Índice por tipo de carrocería
+        index_lines.append("\n📦 POR TIPO DE CARROCERÍA:")
+        for body_type, models in sorted(self._by_body.items()):
+            index_lines.append(f"\n{body_type}:")
+            for model in models:
+                index_lines.append(f"  • {model}")
+        
+        # Índice por transmisión
+        index_lines.append("\n\n⚙️ POR TRANSMISIÓN:")
+        for trans, models in sorted(self._by_trans.items()):
+            index_lines.append(f"\n{trans}:")
+            for model in models:
+                index_lines.append(f"  • {model}")
+        
+        index_lines.append("\n" + "═" * 60)
+        
+        # Ejemplos de conversación
+        examples = [
+            f"Cliente: ¿Qué vehículos tienen disponibles?\nBot: ¡Excelente! Tenemos {count} modelos en nuestro catálogo de {', '.join(brands)}. ¿Qué tipo de vehículo estás buscando? ¿Sedan, SUV, pickup?",
+            f"Cliente: Busco un SUV familiar.\nBot: Perfecto, tenemos excelentes opciones de SUV. ¿Cuántos pasajeros necesitas transportar regularmente y cuál es tu presupuesto aproximado?",
+            "Cliente: ¿Este modelo viene en color rojo?\nBot: Déjame verificar los colores disponibles para ese modelo específicamente. [Consulta la información de colores del vehículo en la base de conocimientos]"
+        ]
+        
+        # Restricciones
+        restrictions = [
+            "No inventar especificaciones o características que no estén en el catálogo",
+            "Siempre verificar la información en la base de conocimientos antes de responder",
+            "No prometer disponibilidad sin confirmar primero",
+            "No proporcionar precios sin autorización",
+            "Dirigir al cliente a un vendedor para finalizar la compra"
+        ]
+        
+        return {
+            "description": f"Catálogo de vehículos con {count} modelos importados desde CSV",
+            "settings": {
+                "system_prompt": system_prompt,
+                "context": context,
+                "instructions": instructions,
+                "tone": "profesional",
+                "language": "español"
+            },
+            "vehicle_catalog": self.columns.to_dict(),
+            "documents": [
+                ("Resumen del Catálogo", "\n".join(summary_lines), "catálogo"),
+                ("Índice de Búsqueda", "\n".join(index_lines), "índice")
+            ],
+            "examples": examples,
+            "restrictions": restrictions,
+            "warnings": self.warnings
+        }
+
+
+def parse_catalog_csv(csv_path: str, progress: Optional[ProgressCallback] = None) -> Dict:
+    """Leer un catálogo de vehículos completo (para importarlo en otro proceso)
+    
+    Returns:
+        {rows, knowledge_base [(clave, ficha)], content (CatalogImportBuilder.finish()), warnings}
+    """
+    builder = CatalogImportBuilder()
+    knowledge_base = [builder.add(vehicle) for vehicle in iter_csv_rows(csv_path, progress)]
+    if not knowledge_base:
+        raise ValueError("No se encontraron vehículos en el CSV")
+    content = builder.finish()
+    return {
+        "rows": builder.count,
+        "knowledge_base": knowledge_base,
+        "content": content,
+        "warnings": content.pop("warnings")
+    }
+
+
+def parse_import_file(csv_path: str) -> Dict:
+    """Leer y validar un CSV de la importación masiva (se ejecuta en un proceso del pool)
+    
+    Returns:
+        {file, kind, rows, seconds, payload, errors, warnings}; payload es None si hubo errores
+    """
+    start = time.perf_counter()
+    result = {"file": csv_path, "kind": "", "rows": 0, "payload": None, "errors": [], "warnings": []}
+    try:
+        kind = detect_csv_kind(csv_path)
+        result["kind"] = kind
+        if kind == "profile":
+            payload = parse_profile_csv(csv_path)
+            result["rows"] = len(payload["knowledge_base"]) + len(payload["documents"])
+        elif kind == "catalog":
+            payload = parse_catalog_csv(csv_path)
+            result["rows"] = payload["rows"]
+        else:
+            payload = None
+            result["errors"].append("Formato no reconocido: se espera Campo,Valor o un catálogo con columnas "
+                                    + " y ".join(CATALOG_REQUIRED_COLUMNS))
+        if payload is not None:
+            result["warnings"] = payload.pop("warnings")
+            result["payload"] = payload
+    except Exception as e:
+        result["errors"].append(f"{type(e).__name__}: {e}")
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def format_import_report(report: Dict) -> List[str]:
+    """Líneas legibles del reporte de ProfileManager.import_csv_directory"""
+    lines = [f"{'archivo':<36}{'tipo':<9}{'filas':>8}{'lectura s':>11}{'aplicar s':>11}  estado"]
+    for item in report["files"]:
+        apply_seconds = f"{item['apply_seconds']:.2f}" if item.get("apply_seconds") is not None else "-"
+        lines.append(f"{os.path.basename(item['file'])[:35]:<36}{item['kind'] or '?':<9}{item['rows']:>8}"
+                     f"{item['seconds']:>11.2f}{apply_seconds:>11}  {item['status']}"
+                     + (f" → {item['profile']}" if item.get("profile") else ""))
+        for error in item["errors"]:
+            lines.append(f"    ❌ {error}")
+        for warning in item["warnings"][:5]:
+            lines.append(f"    ⚠️ {warning}")
+        if len(item["warnings"]) > 5:
+            lines.append(f"    ⚠️ ... y {len(item['warnings']) - 5} advertencia(s) más")
+    lines.append(
+        f"{report['imported']} importado(s), {report['invalid']} inválido(s) con {report['workers']} proceso(s): "
+        f"lectura {report['parse_seconds']:.2f} s, aplicar {report['apply_seconds']:.2f} s, "
+        f"guardado {report['commit_seconds']:.2f} s, total {report['total_seconds']:.2f} s"
+    )
+    if report.get("error"):
+        lines.append(f"❌ {report['error']}")
+    return lines
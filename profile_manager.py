@@ -10,25 +10,109 @@ import csv
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 import hashlib
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from itertools import chain
+
+from context_compiler import ContextCompiler, ContextSnapshot, SnapshotLRU, content_hash, pack_snapshot
+from context_retrieval import ProfileRetriever, chunk_document, document_passages, format_passages, text_id
+from csv_stream import Joined, ProgressCallback, iter_csv_rows, write_row
+from profile_events import (
+    PROFILE_CREATED, PROFILE_DELETED, PROFILE_UPDATED, SECTION_UPDATED, SETTINGS_UPDATED, STORE_RELOADED,
+    VERSION_ACTIVATED, VERSION_CREATED, VERSION_DELETED, ChangeCallback, ChangeEvent, EventLog, EventLogGap
+)
+from profile_import import CatalogImportBuilder, parse_import_file, parse_profile_csv
+from profile_snapshot import ProfileSnapshot, build_snapshot
+from profile_store import LazyVersions, StaleStoreError, open_store
+from token_usage import estimate_tokens
+from vehicle_catalog import VehicleCatalogIndex
+
+
+# Tipos de chat de Telegram que se pueden enrutar a un conjunto de perfiles
+CHAT_TYPES = ("private", "group", "supergroup", "channel")
 
 
 class ProfileManager:
-    """Gestor de perfiles del chatbot con versionamiento"""
+    """Gestor de perfiles del chatbot con versionamiento
     
-    def __init__(self, profiles_file: str = "bot_profiles.json"):
-        self.profiles_file = profiles_file
+    Los métodos que modifican perfiles guardan al terminar. Con el backend
+    SQLite, si otro proceso guardó después de la última lectura, lanzan
+    StaleStoreError: los cambios locales se descartan y se recarga el
+    almacenamiento. Llamar a reload_if_changed() antes de editar lo evita.
+    """
+    
+    def __init__(self, profiles_file: Optional[str] = None, store_format: Optional[str] = None,
+                 events_path: Optional[str] = None):
+        # .db/.sqlite usa el backend SQLite; cualquier otra ruta, el archivo JSON
+        # (serializado según store_format o STORE_FORMAT; ver serialization.py)
+        self.profiles_file = profiles_file or os.getenv("PROFILES_FILE", "bot_profiles.json")
+        self._store = open_store(self.profiles_file, store_format)
+        self._touched: Optional[set] = None
+        # Eventos de cambio: suscriptores del proceso y registro durable opcional (PROFILE_EVENTS_PATH)
+        events_path = events_path or os.getenv("PROFILE_EVENTS_PATH")
+        self._event_log = EventLog(events_path) if events_path else None
+        self._subscribers: List[ChangeCallback] = []
+        self._pending_events: List[ChangeEvent] = []
+        self._event_seq = self._event_log.last_seq() if self._event_log else 0
+        # Instantánea inmutable publicada tras cada guardado (se activa con get_profile_snapshot)
+        self._state_snapshot: Optional[ProfileSnapshot] = None
         self.profiles = self._load_profiles()
+        self._file_signature = self._stat_signature()
+        self._next_reload_check = 0.0
+        self._retriever = ProfileRetriever()
+        self._full_context_tokens = ((), 0)
+        self._catalog_indexes = {}
+        self._compiler = ContextCompiler()
+        self._chat_snapshots = SnapshotLRU(maxsize=32)
+        self._batch_depth = 0
+        self._batch_dirty = False
+        self.last_retrieval_report = {}
+        self.last_pack_report = {}
+    
+    def _stat_signature(self) -> Optional[Tuple]:
+        """Firma barata del almacenamiento (mtime/tamaño del JSON o data_version de SQLite)"""
+        return self._store.signature()
+    
+    def reload_if_changed(self, min_interval: float = 0.5) -> bool:
+        """Recargar perfiles si otro proceso modificó el archivo
+        
+        Args:
+            min_interval: Segundos mínimos entre comprobaciones (stat)
+        
+        Returns:
+            True si se recargaron los perfiles
+        """
+        now = time.monotonic()
+        if now < self._next_reload_check:
+            return False
+        self._next_reload_check = now + min_interval
+        
+        signature = self._stat_signature()
+        if signature == self._file_signature:
+            return False
+        try:
+            profiles = self._store.load()
+        except Exception as e:
+            # Lectura fallida (p. ej. archivo a medio escribir por otro proceso):
+            # se conservan los perfiles actuales y se reintenta en la próxima comprobación
+            print(f"Error recargando perfiles: {e}")
+            return False
+        self._touched = None
+        self.profiles = profiles if profiles is not None else self._create_default_structure()
+        self._file_signature = signature
+        self._deliver_external_events()
+        return True
     
     def _load_profiles(self) -> Dict:
-        """Cargar perfiles desde archivo JSON"""
-        if os.path.exists(self.profiles_file):
-            try:
-                with open(self.profiles_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"Error cargando perfiles: {e}")
-                return self._create_default_structure()
-        return self._create_default_structure()
+        """Cargar perfiles desde el almacenamiento"""
+        self._touched = None
+        try:
+            profiles = self._store.load()
+        except Exception as e:
+            print(f"Error cargando perfiles: {e}")
+            return self._create_default_structure()
+        return profiles if profiles is not None else self._create_default_structure()
     
     def _create_default_structure(self) -> Dict:
         """Crear estructura por defecto de perfiles"""
@@ -44,10 +128,201 @@ class ProfileManager:
         }
     
     def _save_profiles(self):
-        """Guardar perfiles a archivo JSON"""
+        """Guardar perfiles (diferido hasta el final si hay un batch abierto)"""
+        if self._batch_depth:
+            self._batch_dirty = True
+            return
         self.profiles["metadata"]["last_modified"] = datetime.now().isoformat()
-        with open(self.profiles_file, 'w', encoding='utf-8') as f:
-            json.dump(self.profiles, f, ensure_ascii=False, indent=2)
+        try:
+            self._store.save(self.profiles, self._touched)
+        except StaleStoreError:
+            # Otro proceso guardó después de nuestra lectura: escribir pisaría sus cambios.
+            # Se descartan los cambios locales, se recarga y quien llamó ve el error
+            self._pending_events = []
+            self.profiles = self._load_profiles()
+            self._file_signature = self._stat_signature()
+            self._deliver_external_events()
+            raise
+        self._touched = None
+        self._file_signature = self._stat_signature()
+        self._publish_events()
+    
+    def _touch(self, *profile_names: str):
+        """Indicar qué perfiles modificó la operación en curso
+        
+        Con el backend SQLite solo se comparan y escriben las filas de esos
+        perfiles; _touch() sin nombres indica que solo cambiaron los metadatos.
+        Un guardado sin indicaciones compara todos los perfiles.
+        """
+        if self._touched is None:
+            self._touched = set()
+        self._touched.update(profile_names)
+    
+    @contextmanager
+    def batch(self):
+        """Agrupar varias modificaciones en un solo guardado
+        
+        Dentro del bloque los mutadores no reescriben el archivo; al salir se
+        guarda una sola vez. Si el bloque o ese guardado lanzan una excepción se
+        descartan los cambios recargando desde el archivo. Los bloques se pueden anidar.
+        
+        Ejemplo:
+            with pm.batch():
+                for key, value in items:
+                    pm.add_to_knowledge_base(nombre, 1, key, value)
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                # Los eventos de cambios descartados no se publican
+                self._pending_events = []
+            if not self._batch_depth and self._batch_dirty:
+                self._batch_dirty = False
+                self.profiles = self._load_profiles()
+            raise
+        else:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._batch_dirty:
+                self._batch_dirty = False
+                try:
+                    self._save_profiles()
+                except StaleStoreError:
+                    raise  # _save_profiles ya descartó y recargó
+                except BaseException:
+                    # Guardado fallido: descartar lo acumulado para que otro
+                    # guardado posterior no lo escriba sin querer
+                    self._pending_events = []
+                    self.profiles = self._load_profiles()
+                    raise
+    
+    def _flush_batch(self):
+        """Confirmar lo acumulado dentro de un batch sin cerrarlo
+        
+        Para importaciones largas con el backend SQLite (commits por bloques).
+        Lo confirmado ya no se descarta si el batch falla después.
+        """
+        if not self._batch_dirty:
+            return
+        self._batch_dirty = False
+        depth, self._batch_depth = self._batch_depth, 0
+        try:
+            self._save_profiles()
+        finally:
+            self._batch_depth = depth
+    
+    # ===== EVENTOS DE CAMBIO =====
+    
+    def subscribe(self, callback: ChangeCallback) -> ChangeCallback:
+        """Recibir un ChangeEvent por cada cambio confirmado (después de guardar)
+        
+        Los cambios de un batch se entregan al cerrarlo, en orden. Con registro
+        durable también llegan, al recargar, los cambios de otros procesos; sin
+        él, una recarga se informa con un único evento store.reloaded.
+        
+        Returns:
+            El mismo callback (para usarlo en unsubscribe)
+        """
+        self._subscribers.append(callback)
+        return callback
+    
+    def unsubscribe(self, callback: ChangeCallback):
+        """Dejar de recibir eventos"""
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+    
+    @property
+    def event_log(self) -> Optional[EventLog]:
+        """Registro durable de eventos (None si no se configuró)"""
+        return self._event_log
+    
+    def _emit(self, kind: str, profile: Optional[str] = None, version: Optional[int] = None,
+              section: Optional[str] = None, key: Optional[str] = None):
+        """Encolar un evento; se publica con el siguiente guardado efectivo"""
+        if self._subscribers or self._event_log or self._state_snapshot is not None:
+            self._pending_events.append(ChangeEvent(kind, profile, version, section, key))
+    
+    def _publish_events(self):
+        """Registrar y entregar los eventos de lo recién guardado"""
+        if not self._pending_events:
+            return
+        events, self._pending_events = self._pending_events, []
+        if self._event_log:
+            try:
+                first, last = self._event_log.append(events)
+                # Lo que otros procesos registraron antes se entrega primero, en orden
+                events = self._read_event_log(until=first) + events
+                self._event_seq = last
+            except Exception as e:
+                print(f"Error registrando eventos de cambio: {e}")
+        else:
+            for event in events:
+                self._event_seq += 1
+                event.seq = self._event_seq
+        self._dispatch(events)
+    
+    def _read_event_log(self, until: Optional[int] = None) -> List[ChangeEvent]:
+        """Eventos del registro aún no entregados (hasta la secuencia `until`, sin incluirla)"""
+        events = []
+        try:
+            while True:
+                chunk = self._event_log.read(self._event_seq, 1000)
+                for event in chunk:
+                    if until is not None and event.seq >= until:
+                        return events
+                    events.append(event)
+                    self._event_seq = event.seq
+                if len(chunk) < 1000:
+                    return events
+        except EventLogGap:
+            # Demasiado atrás: los suscriptores deben reconstruir todo
+            self._event_seq = until - 1 if until is not None else self._event_log.last_seq()
+            return [ChangeEvent(STORE_RELOADED)]
+    
+    def _dispatch(self, events: List[ChangeEvent]):
+        if self._state_snapshot is not None:
+            self._publish_state_snapshot(events)
+        for callback in list(self._subscribers):
+            for event in events:
+                try:
+                    callback(event)
+                except Exception as e:
+                    print(f"Error en suscriptor de eventos: {e}")
+    
+    def _deliver_external_events(self):
+        """Tras recargar, entregar los cambios de otros procesos (o store.reloaded si no se conocen)"""
+        events = self._read_event_log() if self._event_log else []
+        # El almacenamiento cambió pero el registro no dice qué: quien escribió no registra eventos
+        self._dispatch(events or [ChangeEvent(STORE_RELOADED)])
+    
+    # ===== INSTANTÁNEAS DE SOLO LECTURA =====
+    
+    def get_profile_snapshot(self) -> ProfileSnapshot:
+        """Instantánea inmutable y consistente del estado activo (ver profile_snapshot.py)
+        
+        La primera llamada la arma; desde entonces cada guardado o recarga
+        publica una nueva reemplazando la referencia, así que se puede leer
+        desde otros hilos sin locks. Conviene tomarla una vez por solicitud y
+        hacer todas las lecturas sobre ella.
+        
+        Returns:
+            ProfileSnapshot con los ajustes, los conjuntos de perfiles y sus versiones activas
+        """
+        snapshot = self._state_snapshot
+        if snapshot is None:
+            snapshot = self._state_snapshot = build_snapshot(self.profiles, self._event_seq)
+        return snapshot
+    
+    def _publish_state_snapshot(self, events: List[ChangeEvent]):
+        """Armar la siguiente instantánea a partir de la actual y publicarla"""
+        try:
+            self._state_snapshot = build_snapshot(self.profiles, self._event_seq, self._state_snapshot, events)
+        except Exception as e:
+            # La siguiente lectura la vuelve a armar completa
+            print(f"Error actualizando la instantánea de perfiles: {e}")
+            self._state_snapshot = None
     
     def create_profile(self, name: str, description: str = "", profile_type: str = "general") -> Dict:
         """Crear un nuevo perfil"""
@@ -84,6 +359,8 @@ class ProfileManager:
         
         self.profiles["profiles"][name] = new_profile
         self.profiles["metadata"]["total_profiles"] += 1
+        self._emit(PROFILE_CREATED, name)
+        self._touch(name)
         self._save_profiles()
         
         return new_profile
@@ -106,6 +383,9 @@ class ProfileManager:
             if self.profiles["active_profile"] == name:
                 self.profiles["active_profile"] = None
             
+            self._emit(PROFILE_DELETED, name)
+            self._prune_chat_routes(name)
+            self._touch(name)
             self._save_profiles()
             return True
         return False
@@ -120,8 +400,10 @@ class ProfileManager:
         for key, value in kwargs.items():
             if key in ["description", "type", "tags"]:
                 profile[key] = value
+                self._emit(PROFILE_UPDATED, name, section=key)
         
         profile["last_modified"] = datetime.now().isoformat()
+        self._touch(name)
         self._save_profiles()
         return True
     
@@ -157,8 +439,19 @@ class ProfileManager:
             "language": base_data.get("language", "español")
         }
         
+        # El catálogo columnar es inmutable tras la importación: se comparte por referencia
+        if base_data.get("vehicle_catalog"):
+            new_version["vehicle_catalog"] = base_data["vehicle_catalog"]
+        
         profile["versions"][str(new_version_num)] = new_version
         profile["last_modified"] = datetime.now().isoformat()
+        self._emit(VERSION_CREATED, profile_name, new_version_num)
+        
+        # Retención automática: las versiones que quedan fuera de la política se eliminan en el mismo guardado
+        if self.get_version_retention()["auto"]:
+            self._prune_versions(profile_name, self.versions_to_prune(profile_name))
+        
+        self._touch(profile_name)
         self._save_profiles()
         
         return new_version_num
@@ -181,6 +474,8 @@ class ProfileManager:
         
         profile["active_version"] = version
         profile["last_modified"] = datetime.now().isoformat()
+        self._emit(VERSION_ACTIVATED, profile_name, version)
+        self._touch(profile_name)
         self._save_profiles()
         return True
     
@@ -201,12 +496,170 @@ class ProfileManager:
         
         if str(version) in profile["versions"]:
             del profile["versions"][str(version)]
+            profile.get("version_tags", {}).pop(str(version), None)
             profile["last_modified"] = datetime.now().isoformat()
+            self._emit(VERSION_DELETED, profile_name, version)
+            self._touch(profile_name)
             self._save_profiles()
             return True
         
         return False
     
+    # ===== RETENCIÓN DE VERSIONES =====
+    
+    def tag_version(self, profile_name: str, version: int, tag: str) -> bool:
+        """Etiquetar una versión (las versiones etiquetadas se conservan al compactar)"""
+        profile = self.get_profile(profile_name)
+        tag = tag.strip()
+        if not profile or not tag or str(version) not in profile["versions"]:
+            return False
+        
+        # Las etiquetas viven en el perfil para decidir la retención sin cargar cada versión
+        tags = profile.setdefault("version_tags", {}).setdefault(str(version), [])
+        if tag not in tags:
+            tags.append(tag)
+            profile["last_modified"] = datetime.now().isoformat()
+            self._emit(PROFILE_UPDATED, profile_name, version, "version_tags", tag)
+            self._touch(profile_name)
+            self._save_profiles()
+        return True
+    
+    def untag_version(self, profile_name: str, version: int, tag: str) -> bool:
+        """Quitar una etiqueta de una versión"""
+        profile = self.get_profile(profile_name)
+        tags = profile.get("version_tags", {}).get(str(version), []) if profile else []
+        if tag not in tags:
+            return False
+        
+        tags.remove(tag)
+        if not tags:
+            del profile["version_tags"][str(version)]
+        profile["last_modified"] = datetime.now().isoformat()
+        self._emit(PROFILE_UPDATED, profile_name, version, "version_tags", tag)
+        self._touch(profile_name)
+        self._save_profiles()
+        return True
+    
+    def get_version_tags(self, profile_name: str, version: int) -> List[str]:
+        """Etiquetas de una versión"""
+        profile = self.get_profile(profile_name)
+        return list(profile.get("version_tags", {}).get(str(version), [])) if profile else []
+    
+    def get_version_retention(self) -> Dict:
+        """Política de retención: {keep_last (0 = conservar todas), keep_tagged, auto}"""
+        policy = {"keep_last": 0, "keep_tagged": True, "auto": False}
+        policy.update(self.profiles["metadata"].get("version_retention", {}))
+        return policy
+    
+    def set_version_retention(self, keep_last: int = 0, keep_tagged: bool = True, auto: bool = False):
+        """Establecer la política de retención de versiones
+        
+        Args:
+            keep_last: Versiones más recientes a conservar por perfil (0 = todas)
+            keep_tagged: Conservar siempre las versiones etiquetadas
+            auto: Aplicar la política al crear cada versión nueva
+        """
+        self.profiles["metadata"]["version_retention"] = {
+            "keep_last": max(0, int(keep_last)),
+            "keep_tagged": bool(keep_tagged),
+            "auto": bool(auto)
+        }
+        self._emit(SETTINGS_UPDATED, section="version_retention")
+        self._touch()
+        self._save_profiles()
+    
+    def versions_to_prune(self, profile_name: str, keep_last: Optional[int] = None,
+                          keep_tagged: Optional[bool] = None) -> List[int]:
+        """Versiones de un perfil que la política de retención descarta
+        
+        Se conservan siempre la versión activa, las `keep_last` más recientes y,
+        con keep_tagged, las etiquetadas. Los parámetros reemplazan a la política
+        guardada.
+        """
+        policy = self.get_version_retention()
+        keep_last = policy["keep_last"] if keep_last is None else keep_last
+        keep_tagged = policy["keep_tagged"] if keep_tagged is None else keep_tagged
+        profile = self.get_profile(profile_name)
+        if not profile or keep_last <= 0:
+            return []
+        
+        numbers = sorted(int(v) for v in profile["versions"].keys())
+        keep = set(numbers[-keep_last:])
+        keep.add(int(profile["active_version"]))
+        if keep_tagged:
+            keep.update(int(v) for v, tags in profile.get("version_tags", {}).items() if tags)
+        return [n for n in numbers if n not in keep]
+    
+    def _prune_versions(self, profile_name: str, versions: List[int]):
+        """Eliminar versiones sin guardar (el guardado lo hace quien llama)"""
+        if not versions:
+            return
+        profile = self.profiles["profiles"][profile_name]
+        for version in versions:
+            del profile["versions"][str(version)]
+            profile.get("version_tags", {}).pop(str(version), None)
+            self._emit(VERSION_DELETED, profile_name, version)
+        profile["last_modified"] = datetime.now().isoformat()
+        self._touch(profile_name)
+    
+    def _measure_store(self) -> Tuple[int, float, float]:
+        """(bytes en disco, segundos de una carga completa, segundos de un guardado completo)"""
+        start = time.perf_counter()
+        loaded = open_store(self.profiles_file).load() or {}
+        # Con SQLite load() solo lee el índice: leer también cada versión para comparar con JSON
+        for profile in loaded.get("profiles", {}).values():
+            versions = profile.get("versions", {})
+            for key in versions:
+                versions[key]
+        load_seconds = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        self._touched = None
+        self._save_profiles()
+        save_seconds = time.perf_counter() - start
+        return self._store.size_bytes(), load_seconds, save_seconds
+    
+    def compact_versions(self, keep_last: Optional[int] = None, keep_tagged: Optional[bool] = None,
+                         dry_run: bool = False) -> Dict:
+        """Aplicar la retención a todos los perfiles y reescribir el almacenamiento de una vez
+        
+        Args:
+            keep_last: Versiones recientes a conservar (por defecto, la política guardada)
+            keep_tagged: Conservar las etiquetadas (por defecto, la política guardada)
+            dry_run: Solo calcular qué versiones se eliminarían
+        
+        Returns:
+            Reporte {pruned: {perfil: [versiones]}, versions_removed, bytes_before,
+            bytes_after, reclaimed_bytes, load_seconds_before/after,
+            save_seconds_before/after, compact_seconds}
+        """
+        pruned = {}
+        for name in self.profiles["profiles"]:
+            versions = self.versions_to_prune(name, keep_last, keep_tagged)
+            if versions:
+                pruned[name] = versions
+        report = {"pruned": pruned, "versions_removed": sum(len(v) for v in pruned.values())}
+        if dry_run:
+            return report
+        
+        bytes_before, load_before, save_before = self._measure_store()
+        start = time.perf_counter()
+        for name, versions in pruned.items():
+            self._prune_versions(name, versions)
+        self._save_profiles()
+        self._store.compact()
+        self._file_signature = self._stat_signature()
+        compact_seconds = time.perf_counter() - start
+        bytes_after, load_after, save_after = self._measure_store()
+        
+        report.update(
+            bytes_before=bytes_before, bytes_after=bytes_after, reclaimed_bytes=bytes_before - bytes_after,
+            load_seconds_before=load_before, load_seconds_after=load_after,
+            save_seconds_before=save_before, save_seconds_after=save_after,
+            compact_seconds=compact_seconds
+        )
+        return report
+    
     def update_version_content(self, profile_name: str, version: int, **kwargs) -> bool:
         """Actualizar el contenido de una versión"""
         version_data = self.get_version(profile_name, version)
@@ -216,8 +669,10 @@ class ProfileManager:
         for key, value in kwargs.items():
             if key in version_data:
                 version_data[key] = value
+                self._emit(SECTION_UPDATED, profile_name, version, key)
         
         self.profiles["profiles"][profile_name]["last_modified"] = datetime.now().isoformat()
+        self._touch(profile_name)
         self._save_profiles()
         return True
     
@@ -231,11 +686,16 @@ class ProfileManager:
             "name": doc_name,
             "content": doc_content,
             "type": doc_type,
-            "added_at": datetime.now().isoformat()
+            "added_at": datetime.now().isoformat(),
+            # Pasajes (desplazamientos sobre content) calculados una sola vez al agregar
+            "id": text_id(doc_content),
+            "passages": chunk_document(doc_content)
         }
         
         version_data["documents"].append(document)
         self.profiles["profiles"][profile_name]["last_modified"] = datetime.now().isoformat()
+        self._emit(SECTION_UPDATED, profile_name, version, "documents", len(version_data["documents"]) - 1)
+        self._touch(profile_name)
         self._save_profiles()
         return True
     
@@ -247,9 +707,26 @@ class ProfileManager:
         
         version_data["documents"].pop(doc_index)
         self.profiles["profiles"][profile_name]["last_modified"] = datetime.now().isoformat()
+        self._emit(SECTION_UPDATED, profile_name, version, "documents", doc_index)
+        self._touch(profile_name)
         self._save_profiles()
         return True
     
+    def get_document_passages(self, profile_name: str, version: int, doc_index: int) -> List[Dict]:
+        """Obtener los pasajes de un documento con su texto
+        
+        Returns:
+            Lista de {id, start, end, heading, text} (vacía si el documento no existe)
+        """
+        version_data = self.get_version(profile_name, version)
+        if not version_data or doc_index >= len(version_data["documents"]):
+            return []
+        
+        document = version_data["documents"][doc_index]
+        content = document["content"]
+        return [dict(passage, text=content[passage["start"]:passage["end"]])
+                for passage in document_passages(document)]
+    
     def add_to_knowledge_base(self, profile_name: str, version: int, key: str, value: str) -> bool:
         """Agregar información a la base de conocimientos"""
         version_data = self.get_version(profile_name, version)
@@ -262,6 +739,8 @@ class ProfileManager:
         }
         
         self.profiles["profiles"][profile_name]["last_modified"] = datetime.now().isoformat()
+        self._emit(SECTION_UPDATED, profile_name, version, "knowledge_base", key)
+        self._touch(profile_name)
         self._save_profiles()
         return True
     
@@ -271,6 +750,8 @@ class ProfileManager:
             return False
         
         self.profiles["active_profile"] = profile_name
+        self._emit(SETTINGS_UPDATED, section="active_profile")
+        self._touch()
         self._save_profiles()
         return True
     
@@ -286,10 +767,11 @@ class ProfileManager:
         if not active_profile:
             return ""
         
-        active_version = self.get_version(
-            active_profile["name"], 
-            active_profile["active_version"]
-        )
+        return self.get_version_context(active_profile["name"], active_profile["active_version"])
+    
+    def get_version_context(self, profile_name: str, version: int) -> str:
+        """Obtener el contexto completo de una versión específica (activa o no)"""
+        active_version = self.get_version(profile_name, version)
         
         if not active_version:
             return ""
@@ -353,8 +835,9 @@ class ProfileManager:
         if not profile:
             return False
         
+        # Con SQLite "versions" es un LazyVersions: default=dict lo serializa cargando todas
         with open(export_path, 'w', encoding='utf-8') as f:
-            json.dump(profile, f, ensure_ascii=False, indent=2)
+            json.dump(profile, f, ensure_ascii=False, indent=2, default=dict)
         
         return True
     
@@ -376,6 +859,8 @@ class ProfileManager:
             profile_data["name"] = profile_name
             self.profiles["profiles"][profile_name] = profile_data
             self.profiles["metadata"]["total_profiles"] += 1
+            self._emit(PROFILE_CREATED, profile_name)
+            self._touch(profile_name)
             self._save_profiles()
             
             return profile_name
@@ -407,6 +892,8 @@ class ProfileManager:
             if active["name"] == profile_name:
                 # Actualizar solo la prioridad si ya existe
                 active["priority"] = priority
+                self._emit(SETTINGS_UPDATED, section="active_profiles")
+                self._touch()
                 self._save_profiles()
                 return True
         
@@ -424,6 +911,8 @@ class ProfileManager:
         if self.profiles["active_profiles"]:
             self.profiles["active_profile"] = self.profiles["active_profiles"][0]["name"]
         
+        self._emit(SETTINGS_UPDATED, section="active_profiles")
+        self._touch()
         self._save_profiles()
         return True
     
@@ -452,6 +941,8 @@ class ProfileManager:
             self.profiles["active_profile"] = None
         
         if len(self.profiles["active_profiles"]) < initial_length:
+            self._emit(SETTINGS_UPDATED, section="active_profiles")
+            self._touch()
             self._save_profiles()
             return True
         
@@ -467,7 +958,27 @@ class ProfileManager:
             self.profiles["active_profiles"] = []
         
         return self.profiles["active_profiles"]
-    
+
+    def get_active_version_key(self, active_profiles: Optional[List[Dict]] = None) -> str:
+        """Obtener una clave que identifica las versiones activas en uso
+
+        Args:
+            active_profiles: Conjunto de perfiles {name, priority} (por defecto los activos globales)
+
+        Returns:
+            Cadena tipo "Perfil A@v2|Perfil B@v1" (vacía si no hay perfiles activos)
+        """
+        if active_profiles is None:
+            active_profiles = self._get_context_profiles()
+        names = [ap["name"] for ap in active_profiles]
+
+        parts = []
+        for name in names:
+            profile = self.get_profile(name)
+            if profile:
+                parts.append(f"{name}@v{profile['active_version']}")
+        return "|".join(parts)
+
     def set_profile_priority(self, profile_name: str, new_priority: int) -> bool:
         """Cambiar la prioridad de un perfil activo
         
@@ -496,6 +1007,8 @@ class ProfileManager:
             if self.profiles["active_profiles"]:
                 self.profiles["active_profile"] = self.profiles["active_profiles"][0]["name"]
             
+            self._emit(SETTINGS_UPDATED, section="active_profiles")
+            self._touch()
             self._save_profiles()
             return True
         
@@ -505,9 +1018,11 @@ class ProfileManager:
         """Desactivar todos los perfiles"""
         self.profiles["active_profiles"] = []
         self.profiles["active_profile"] = None
+        self._emit(SETTINGS_UPDATED, section="active_profiles")
+        self._touch()
         self._save_profiles()
     
-    def get_multi_profile_context(self) -> str:
+    def get_multi_profile_context(self, compact: bool = False) -> str:
         """Obtener el contexto combinado de todos los perfiles activos según prioridad
         
         Los perfiles se combinan jerárquicamente:
@@ -516,110 +1031,360 @@ class ProfileManager:
         
         Returns:
             Contexto combinado de todos los perfiles activos
+        
+        Args:
+            compact: Usar el renderizado compacto (por defecto la forma legible)
+        """
+        return self.get_context_snapshot(compact).text
+    
+    def _build_multi_profile_context(self, active_profiles: List[Dict], include_reference: bool = True,
+                                     reference_lines: Optional[List[str]] = None, compact: bool = False,
+                                     state: Optional[ProfileSnapshot] = None) -> str:
+        """Construir el contexto combinado para una lista de perfiles {name, priority}
+        
+        Args:
+            active_profiles: Perfiles ordenados por prioridad
+            include_reference: Incluir base de conocimientos y documentos completos
+            reference_lines: Líneas a insertar antes del tono (p. ej. pasajes recuperados)
+            compact: Usar el renderizado compacto
+            state: Instantánea de la que leer (por defecto el estado actual)
+        """
+        if not active_profiles:
+            return ""
+        source = state or self
+        return self._compiler.compile(source, active_profiles, include_reference, reference_lines,
+                                      dedup=source.is_context_dedup_enabled(), compact=compact).text
+    
+    def get_context_snapshot(self, compact: Optional[bool] = None) -> ContextSnapshot:
+        """Obtener el contexto combinado como snapshot compilado con id estable
+        
+        El id depende solo del contenido de los fragmentos, por lo que sirve
+        como clave de caché: no cambia mientras no cambie el contexto.
+        
+        Args:
+            compact: Renderizado compacto; si es None se usa el modo configurado para el bot
+        
+        Returns:
+            ContextSnapshot con id, text y fragments
+        """
+        if compact is None:
+            compact = self.is_compact_context()
+        active_profiles = self.get_active_profiles()
+        if active_profiles or (compact and self._get_context_profiles()):
+            return self._compiler.compile(self, self._get_context_profiles(),
+                                          dedup=self.is_context_dedup_enabled(), compact=compact)
+        
+        # Fallback a método original para retrocompatibilidad
+        text = self.get_active_profile_context()
+        fragments = [{"hash": content_hash("legacy", text), "profile": self.profiles.get("active_profile") or "",
+                      "priority": 1, "section": "legacy", "text": text}] if text else []
+        return ContextSnapshot(fragments)
+    
+    def is_compact_context(self) -> bool:
+        """True si el contexto que recibe el bot usa el renderizado compacto"""
+        return self.profiles["metadata"].get("context_render_mode", "pretty") == "compact"
+    
+    def set_context_render_mode(self, mode: str):
+        """Modo de renderizado del contexto del bot: "compact" o "pretty" (legible)"""
+        if mode not in ("compact", "pretty"):
+            raise ValueError(f"Modo de renderizado desconocido: {mode}")
+        self.profiles["metadata"]["context_render_mode"] = mode
+        self._emit(SETTINGS_UPDATED, section="context_render_mode")
+        self._touch()
+        self._save_profiles()
+    
+    def is_context_dedup_enabled(self) -> bool:
+        """True si se eliminan los párrafos duplicados entre perfiles al compilar"""
+        return bool(self.profiles["metadata"].get("context_dedup", True))
+    
+    def set_context_dedup(self, enabled: bool):
+        """Activar o desactivar la deduplicación entre perfiles"""
+        self.profiles["metadata"]["context_dedup"] = bool(enabled)
+        self._emit(SETTINGS_UPDATED, section="context_dedup")
+        self._touch()
+        self._save_profiles()
+    
+    def get_dedup_report(self) -> Dict:
+        """Reporte de la última deduplicación: duplicados, bytes y tokens ahorrados"""
+        return self._compiler.last_dedup_report
+    
+    def get_context_token_budget(self) -> int:
+        """Presupuesto de tokens del contexto combinado (0 = sin límite)"""
+        return int(self.profiles["metadata"].get("context_token_budget", 0) or 0)
+    
+    def set_context_token_budget(self, budget_tokens: int):
+        """Establecer el presupuesto de tokens del contexto combinado (0 = sin límite)"""
+        self.profiles["metadata"]["context_token_budget"] = max(0, int(budget_tokens))
+        self._emit(SETTINGS_UPDATED, section="context_token_budget")
+        self._touch()
+        self._save_profiles()
+    
+    def get_packed_context_snapshot(self, budget_tokens: Optional[int] = None) -> ContextSnapshot:
+        """Obtener el contexto combinado ajustado a un presupuesto de tokens
+        
+        Conserva íntegros el system prompt y las restricciones del perfil de
+        prioridad 1 y llena el resto del presupuesto por prioridad. Lo recortado
+        y descartado queda en self.last_pack_report.
+        
+        Args:
+            budget_tokens: Presupuesto; si es None se usa el configurado (0 = sin límite)
+        
+        Returns:
+            ContextSnapshot empaquetado
         """
-        if "active_profiles" not in self.profiles or not self.profiles["active_profiles"]:
-            # Fallback a método original para retrocompatibilidad
-            return self.get_active_profile_context()
+        if budget_tokens is None:
+            budget_tokens = self.get_context_token_budget()
+        snapshot = self.get_context_snapshot()
+        if not budget_tokens:
+            self.last_pack_report = {}
+            return snapshot
+        packed, self.last_pack_report = pack_snapshot(snapshot, budget_tokens, estimate_tokens)
+        return packed
+    
+    def get_packed_context(self, budget_tokens: Optional[int] = None) -> str:
+        """Texto del contexto combinado ajustado a un presupuesto de tokens"""
+        return self.get_packed_context_snapshot(budget_tokens).text
+    
+    # ===== ENRUTAMIENTO DE PERFILES POR CHAT =====
+    
+    def get_chat_routes(self) -> Dict:
+        """Obtener las asignaciones de perfiles por chat y por tipo de chat
+        
+        Returns:
+            {"chats": {chat_id: [{name, priority}]}, "chat_types": {tipo: [{name, priority}]}}
+        """
+        if "chat_routes" not in self.profiles:
+            self.profiles["chat_routes"] = {"chats": {}, "chat_types": {}}
+        return self.profiles["chat_routes"]
+    
+    def has_chat_routes(self) -> bool:
+        """True si hay algún chat o tipo de chat con perfiles propios"""
+        routes = self.profiles.get("chat_routes") or {}
+        return bool(routes.get("chats") or routes.get("chat_types"))
+    
+    def set_chat_profiles(self, chat_key, profiles: List[Dict]) -> bool:
+        """Asignar un conjunto de perfiles a un chat o a un tipo de chat
+        
+        Args:
+            chat_key: Id del chat o tipo de chat (private, group, supergroup, channel)
+            profiles: Lista de {name, priority}; vacía para quitar la asignación
+        
+        Returns:
+            True si se guardó, False si algún perfil no existe
+        """
+        if any(p["name"] not in self.profiles["profiles"] for p in profiles):
+            return False
+        
+        routes = self.get_chat_routes()
+        bucket = routes["chat_types"] if chat_key in CHAT_TYPES else routes["chats"]
+        key = str(chat_key)
+        if profiles:
+            bucket[key] = sorted(({"name": p["name"], "priority": p.get("priority", 1)} for p in profiles),
+                                 key=lambda x: x["priority"])
+        else:
+            bucket.pop(key, None)
+        self._emit(SETTINGS_UPDATED, section="chat_routes")
+        self._touch()
+        self._save_profiles()
+        return True
+    
+    def _prune_chat_routes(self, name: str):
+        """Quitar un perfil eliminado de las asignaciones por chat
+        
+        Las asignaciones que quedan vacías se eliminan, así esos chats vuelven
+        al conjunto global en lugar de quedarse sin contexto.
+        """
+        routes = self.profiles.get("chat_routes") or {}
+        changed = False
+        for bucket in (routes.get("chats") or {}, routes.get("chat_types") or {}):
+            for key in list(bucket):
+                remaining = [p for p in bucket[key] if p["name"] != name]
+                if len(remaining) == len(bucket[key]):
+                    continue
+                changed = True
+                if remaining:
+                    bucket[key] = remaining
+                else:
+                    del bucket[key]
+        if changed:
+            self._emit(SETTINGS_UPDATED, section="chat_routes")
+    
+    def get_chat_route(self, chat_id, chat_type: Optional[str] = None) -> Optional[List[Dict]]:
+        """Conjunto asignado explícitamente al chat o a su tipo; None si usa el global"""
+        routes = self.profiles.get("chat_routes") or {}
+        profiles = (routes.get("chats") or {}).get(str(chat_id))
+        if profiles is None and chat_type:
+            profiles = (routes.get("chat_types") or {}).get(chat_type)
+        return profiles
+    
+    def get_chat_profiles(self, chat_id, chat_type: Optional[str] = None) -> List[Dict]:
+        """Conjunto de perfiles de un chat: el del chat, el de su tipo o el global"""
+        profiles = self.get_chat_route(chat_id, chat_type)
+        if profiles is None:
+            profiles = self._get_context_profiles()
+        return profiles
+    
+    def get_chat_context_snapshot(self, chat_id, chat_type: Optional[str] = None,
+                                  budget_tokens: Optional[int] = None,
+                                  state: Optional[ProfileSnapshot] = None) -> ContextSnapshot:
+        """Contexto compilado del conjunto de perfiles de un chat
+        
+        Cada conjunto distinto (perfiles, prioridades, versiones activas) se
+        compila una sola vez y se comparte entre todos los chats que lo usan
+        a través de una caché LRU.
         
+        Args:
+            chat_id: Id del chat
+            chat_type: Tipo de chat de Telegram
+            budget_tokens: Presupuesto de tokens; si es None se usa el configurado
+            state: Instantánea de la que leer (por defecto el estado actual)
+        
+        Returns:
+            ContextSnapshot del conjunto de perfiles del chat
+        """
+        source = state or self
+        profiles = source.get_chat_profiles(chat_id, chat_type)
+        if budget_tokens is None:
+            budget_tokens = source.get_context_token_budget()
+        
+        key_parts = []
+        for ap in profiles:
+            profile = source.get_profile(ap["name"])
+            if profile:
+                key_parts.append((ap["name"], ap["priority"], profile["active_version"], profile.get("last_modified", "")))
+        dedup = source.is_context_dedup_enabled()
+        compact = source.is_compact_context()
+        cache_key = (tuple(key_parts), budget_tokens, dedup, compact)
+        
+        cached = self._chat_snapshots.get(cache_key)
+        if cached is None:
+            snapshot = self._compiler.compile(source, profiles, dedup=dedup, compact=compact) \
+                if profiles else ContextSnapshot([])
+            report = {}
+            if budget_tokens:
+                snapshot, report = pack_snapshot(snapshot, budget_tokens, estimate_tokens)
+            cached = (snapshot, report)
+            self._chat_snapshots.put(cache_key, cached)
+        self.last_pack_report = cached[1]
+        return cached[0]
+    
+    def _get_context_profiles(self) -> List[Dict]:
+        """Perfiles que aportan contexto: los activos o, si no hay, el perfil activo legado"""
         active_profiles = self.get_active_profiles()
+        if active_profiles:
+            return active_profiles
+        if self.profiles.get("active_profile"):
+            return [{"name": self.profiles["active_profile"], "priority": 1}]
+        return []
+    
+    # ===== RECUPERACIÓN DE PASAJES RELEVANTES (BM25) =====
+    
+    def get_catalog_index(self, profile_name: str, version: int,
+                          state: Optional[ProfileSnapshot] = None) -> Optional[VehicleCatalogIndex]:
+        """Obtener el índice columnar del catálogo de vehículos de una versión (cacheado)"""
+        source = state or self
+        profile = source.get_profile(profile_name)
+        version_data = source.get_version(profile_name, version)
+        if not profile or not version_data or not version_data.get("vehicle_catalog"):
+            return None
         
-        if not active_profiles:
+        key = (profile_name, version)
+        stamp = profile.get("last_modified", "")
+        cached = self._catalog_indexes.get(key)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        index = VehicleCatalogIndex.from_dict(version_data["vehicle_catalog"])
+        self._catalog_indexes[key] = (stamp, index)
+        return index
+    
+    def get_retrieval_context(self, query: str, top_k: int = 8, max_catalog_rows: int = 15,
+                              active_profiles: Optional[List[Dict]] = None,
+                              state: Optional[ProfileSnapshot] = None) -> str:
+        """Obtener el contexto con solo los pasajes relevantes para la consulta
+        
+        Siempre incluye system prompt, contexto, instrucciones, ejemplos y restricciones
+        de cada perfil activo; de la base de conocimientos y documentos solo se
+        inyectan los top_k pasajes mejor puntuados por BM25. Si un perfil tiene
+        catálogo de vehículos y el mensaje contiene filtros (marca, carrocería,
+        transmisión, potencia, asientos, año, garantía), se inyectan solo las
+        filas que los cumplen en lugar de las fichas de la base de conocimientos.
+        El reporte de reducción queda en self.last_retrieval_report.
+        
+        Args:
+            query: Mensaje actual del usuario
+            top_k: Número máximo de pasajes a inyectar
+            max_catalog_rows: Máximo de vehículos filtrados a inyectar por perfil
+            active_profiles: Conjunto de perfiles {name, priority} (por defecto los activos globales)
+            state: Instantánea de la que leer (por defecto el estado actual)
+        
+        Returns:
+            Contexto reducido
+        """
+        source = state or self
+        if active_profiles is not None:
+            context_profiles = active_profiles
+        else:
+            context_profiles = state.get_context_profiles() if state else self._get_context_profiles()
+        if not context_profiles:
             return ""
         
-        # Construir contexto combinado
-        combined_parts = []
-        
-        # Header indicando perfiles activos
-        if len(active_profiles) > 1:
-            combined_parts.append("=" * 80)
-            combined_parts.append("CONFIGURACIÓN DE PERFILES MÚLTIPLES")
-            combined_parts.append("Los siguientes perfiles están activos con sus prioridades:")
-            for ap in active_profiles:
-                combined_parts.append(f"  • {ap['name']} (Prioridad: {ap['priority']})")
-            combined_parts.append("=" * 80)
-            combined_parts.append("")
-        
-        # Procesar cada perfil según prioridad
-        for idx, active_prof in enumerate(active_profiles):
-            profile = self.get_profile(active_prof["name"])
+        indexes = []
+        stamps = []
+        reference_lines = []
+        catalog_keys = set()
+        catalog_matches = {}
+        for ap in context_profiles:
+            profile = source.get_profile(ap["name"])
             if not profile:
                 continue
-            
-            version = self.get_version(profile["name"], profile["active_version"])
+            version = source.get_version(profile["name"], profile["active_version"])
             if not version:
                 continue
+            stamp = profile.get("last_modified", "")
+            stamps.append((profile["name"], profile["active_version"], stamp))
+            indexes.append(self._retriever.get_index(profile["name"], profile["active_version"], version, stamp))
             
-            priority = active_prof["priority"]
-            profile_name = active_prof["name"]
-            
-            # Separador de perfil
-            if len(active_profiles) > 1:
-                combined_parts.append("")
-                combined_parts.append("=" * 80)
-                combined_parts.append(f"PERFIL: {profile_name} | PRIORIDAD: {priority}")
-                combined_parts.append("=" * 80)
-                combined_parts.append("")
-            
-            # System prompt
-            if version.get("system_prompt"):
-                if idx == 0:  # Solo el perfil principal tiene system prompt
-                    combined_parts.append(f"SYSTEM PROMPT:\n{version['system_prompt']}\n")
-                else:
-                    combined_parts.append(f"CONTEXTO ADICIONAL ({profile_name}):\n{version['system_prompt']}\n")
-            
-            # Contexto general
-            if version.get("context"):
-                combined_parts.append(f"CONTEXTO:\n{version['context']}\n")
-            
-            # Instrucciones
-            if version.get("instructions"):
-                combined_parts.append(f"INSTRUCCIONES ({profile_name}):")
-                for idx_inst, instruction in enumerate(version["instructions"], 1):
-                    combined_parts.append(f"{idx_inst}. {instruction}")
-                combined_parts.append("")
-            
-            # Base de conocimientos
-            if version.get("knowledge_base"):
-                combined_parts.append(f"BASE DE CONOCIMIENTOS ({profile_name}):")
-                for key, data in version["knowledge_base"].items():
-                    combined_parts.append(f"• {key}: {data['value']}")
-                combined_parts.append("")
-            
-            # Ejemplos
-            if version.get("examples"):
-                combined_parts.append(f"EJEMPLOS ({profile_name}):")
-                for example in version["examples"]:
-                    combined_parts.append(f"• {example}")
-                combined_parts.append("")
-            
-            # Restricciones
-            if version.get("restrictions"):
-                combined_parts.append(f"RESTRICCIONES ({profile_name}):")
-                for restriction in version["restrictions"]:
-                    combined_parts.append(f"• {restriction}")
-                combined_parts.append("")
-            
-            # Documentos
-            if version.get("documents"):
-                combined_parts.append(f"DOCUMENTOS DE REFERENCIA ({profile_name}):")
-                for doc in version["documents"]:
-                    combined_parts.append(f"\n--- {doc['name']} ---")
-                    combined_parts.append(doc['content'])
-                combined_parts.append("")
-        
-        # Tono y lenguaje del perfil principal
-        if active_profiles:
-            main_profile = self.get_profile(active_profiles[0]["name"])
-            if main_profile:
-                main_version = self.get_version(main_profile["name"], main_profile["active_version"])
-                if main_version:
-                    combined_parts.append("")
-                    combined_parts.append("=" * 80)
-                    combined_parts.append(f"TONO PRINCIPAL: {main_version.get('tone', 'profesional')}")
-                    combined_parts.append(f"IDIOMA PRINCIPAL: {main_version.get('language', 'español')}")
-                    combined_parts.append("=" * 80)
-        
-        return "\n".join(combined_parts)
+            # Filtrado por facetas del catálogo de vehículos
+            catalog = self.get_catalog_index(profile["name"], profile["active_version"], state)
+            if catalog:
+                criteria, rows = catalog.search(query)
+                if criteria:
+                    catalog_keys.update(catalog.text["kb_key"])
+                    catalog_matches[profile["name"]] = len(rows)
+                    reference_lines.append(f"VEHÍCULOS QUE CUMPLEN LA CONSULTA ({len(rows)} de {catalog.size}, {profile['name']}):")
+                    reference_lines.extend(catalog.render_rows(rows[:max_catalog_rows]) or ["• Ningún vehículo del catálogo cumple todos los criterios"])
+                    reference_lines.append("")
+        
+        results = self._retriever.search(indexes, query, top_k + len(catalog_keys))
+        if catalog_keys:
+            # Las fichas de vehículos ya están cubiertas por el filtrado del catálogo
+            results = [r for r in results if not (r[1]["source"] == "kb" and r[1]["title"] in catalog_keys)]
+        results = results[:top_k]
+        if results:
+            reference_lines.append("INFORMACIÓN RELEVANTE PARA LA CONSULTA:")
+            reference_lines.extend(format_passages(results, multi_profile=len(context_profiles) > 1))
+            reference_lines.append("")
+        
+        compact = source.is_compact_context()
+        context = self._build_multi_profile_context(context_profiles, include_reference=False,
+                                                    reference_lines=reference_lines, compact=compact, state=state)
+        
+        # Tamaño del volcado completo, recalculado solo cuando cambian las versiones
+        stamps = (tuple(stamps), compact)
+        if self._full_context_tokens[0] != stamps:
+            self._full_context_tokens = (stamps, estimate_tokens(
+                self._build_multi_profile_context(context_profiles, compact=compact, state=state)))
+        full_tokens = self._full_context_tokens[1]
+        retrieved_tokens = estimate_tokens(context)
+        self.last_retrieval_report = {
+            "query": query,
+            "passages": [(p["profile"], p["title"], round(score, 2)) for score, p in results],
+            "catalog_matches": catalog_matches,
+            "full_tokens": full_tokens,
+            "retrieved_tokens": retrieved_tokens,
+            "reduction_pct": (1 - retrieved_tokens / full_tokens) * 100 if full_tokens else 0.0
+        }
+        return context
     
     # ===== IMPORTACIÓN Y EXPORTACIÓN CSV =====
     
@@ -675,21 +1440,42 @@ class ProfileManager:
                 restrictions = version.get('restrictions', [])
                 writer.writerow(['restrictions', '|'.join(restrictions)])
                 
-                # Base de conocimientos (formato: key1=value1|key2=value2)
+                # Base de conocimientos (formato: key1=value1|key2=value2), escrita por partes
                 kb = version.get('knowledge_base', {})
-                kb_str = '|'.join([f"{k}={v['value']}" for k, v in kb.items()])
-                writer.writerow(['knowledge_base', kb_str])
+                write_row(f, ['knowledge_base', Joined((f"{k}={v['value']}" for k, v in kb.items()), '|')])
                 
                 # Documentos (formato: name1::content1||name2::content2)
                 docs = version.get('documents', [])
-                docs_str = '||'.join([f"{doc['name']}::{doc['content']}" for doc in docs])
-                writer.writerow(['documents', docs_str])
+                write_row(f, ['documents', Joined((f"{doc['name']}::{doc['content']}" for doc in docs), '||')])
             
             return True
         except Exception as e:
             print(f"Error exportando a CSV: {e}")
             return False
     
+    def _unique_profile_name(self, name: str, separator: str = "_") -> str:
+        """Nombre libre a partir de `name`, agregando un sufijo numérico si ya existe"""
+        original_name = name
+        counter = 1
+        while name in self.profiles["profiles"]:
+            name = f"{original_name}{separator}{counter}"
+            counter += 1
+        return name
+    
+    def _apply_profile_import(self, parsed: Dict) -> str:
+        """Crear un perfil con el contenido de parse_profile_csv (dentro de un batch)"""
+        profile_name = self._unique_profile_name(parsed["name"], "_")
+        self.create_profile(profile_name, parsed["description"], parsed["type"])
+        
+        for key, value in parsed["knowledge_base"]:
+            self.add_to_knowledge_base(profile_name, 1, key, value)
+        for doc_name, doc_content in parsed["documents"]:
+            self.add_document(profile_name, 1, doc_name, doc_content, 'text')
+        
+        # Actualizar versión 1 con los datos del CSV
+        self.update_version_content(profile_name, 1, **parsed["version"])
+        return profile_name
+    
     def import_profile_from_csv(self, csv_path: str) -> Optional[str]:
         """Importar un perfil desde archivo CSV
         
@@ -700,77 +1486,25 @@ class ProfileManager:
             Nombre del perfil importado o None si hubo error
         """
         try:
-            data = {}
-            
-            with open(csv_path, 'r', encoding='utf-8') as f:
-                reader = csv.reader(f)
-                next(reader)  # Skip header
-                
-                for row in reader:
-                    if len(row) >= 2:
-                        data[row[0]] = row[1]
-            
-            # Crear perfil
-            profile_name = data.get('profile_name', 'Imported Profile')
-            description = data.get('profile_description', '')
-            profile_type = data.get('profile_type', 'general')
-            
-            # Verificar si ya existe y agregar sufijo
-            original_name = profile_name
-            counter = 1
-            while profile_name in self.profiles["profiles"]:
-                profile_name = f"{original_name}_{counter}"
-                counter += 1
-            
-            # Crear el perfil
-            profile = self.create_profile(profile_name, description, profile_type)
-            
-            # Actualizar versión 1 con los datos del CSV
-            version_data = {
-                'system_prompt': data.get('system_prompt', ''),
-                'context': data.get('context', ''),
-                'tone': data.get('tone', 'profesional'),
-                'language': data.get('language', 'español'),
-                'instructions': data.get('instructions', '').split('|') if data.get('instructions') else [],
-                'examples': data.get('examples', '').split('||') if data.get('examples') else [],
-                'restrictions': data.get('restrictions', '').split('|') if data.get('restrictions') else [],
-            }
-            
-            # Filtrar valores vacíos
-            version_data['instructions'] = [i for i in version_data['instructions'] if i.strip()]
-            version_data['examples'] = [e for e in version_data['examples'] if e.strip()]
-            version_data['restrictions'] = [r for r in version_data['restrictions'] if r.strip()]
-            
-            # Knowledge base
-            kb_str = data.get('knowledge_base', '')
-            if kb_str:
-                for kb_item in kb_str.split('|'):
-                    if '=' in kb_item:
-                        key, value = kb_item.split('=', 1)
-                        self.add_to_knowledge_base(profile_name, 1, key, value)
-            
-            # Documentos
-            docs_str = data.get('documents', '')
-            if docs_str:
-                for doc_item in docs_str.split('||'):
-                    if '::' in doc_item:
-                        doc_name, doc_content = doc_item.split('::', 1)
-                        self.add_document(profile_name, 1, doc_name, doc_content, 'text')
-            
-            # Actualizar versión con los datos
-            self.update_version_content(profile_name, 1, **version_data)
-            
-            return profile_name
+            parsed = parse_profile_csv(csv_path)
+            # Un solo guardado al final en lugar de uno por cada fila/elemento
+            with self.batch():
+                return self._apply_profile_import(parsed)
             
         except Exception as e:
             print(f"Error importando desde CSV: {e}")
             return None
     
-    def export_all_profiles_to_csv(self, csv_path: str) -> bool:
+    def export_all_profiles_to_csv(self, csv_path: str, progress: Optional[ProgressCallback] = None) -> bool:
         """Exportar todos los perfiles a un archivo CSV consolidado
         
+        Cada perfil se escribe apenas se lee su versión activa, y las celdas de
+        base de conocimientos y documentos se escriben por partes. Con el
+        backend SQLite las versiones leídas solo para exportar se liberan.
+        
         Args:
             csv_path: Ruta del archivo CSV de destino
+            progress: Callback opcional (perfiles exportados, fracción del total)
         
         Returns:
             True si se exportó exitosamente
@@ -788,35 +1522,33 @@ class ProfileManager:
                 ])
                 
                 # Exportar cada perfil
-                for profile_name, profile in self.profiles["profiles"].items():
+                profiles = self.profiles["profiles"]
+                for done, (profile_name, profile) in enumerate(list(profiles.items()), 1):
+                    versions = profile["versions"]
+                    version_key = str(profile["active_version"])
+                    lazy = isinstance(versions, LazyVersions) and not versions.is_loaded(version_key)
                     version = self.get_version(profile_name, profile["active_version"])
-                    if not version:
-                        continue
-                    
-                    instructions = '|'.join(version.get('instructions', []))
-                    examples = '||'.join(version.get('examples', []))
-                    restrictions = '|'.join(version.get('restrictions', []))
-                    
-                    kb = version.get('knowledge_base', {})
-                    kb_str = '|'.join([f"{k}={v['value']}" for k, v in kb.items()])
-                    
-                    docs = version.get('documents', [])
-                    docs_str = '||'.join([f"{doc['name']}::{doc['content']}" for doc in docs])
-                    
-                    writer.writerow([
-                        profile['name'],
-                        profile.get('description', ''),
-                        profile.get('type', 'general'),
-                        version.get('system_prompt', ''),
-                        version.get('context', ''),
-                        version.get('tone', 'profesional'),
-                        version.get('language', 'español'),
-                        instructions,
-                        examples,
-                        restrictions,
-                        kb_str,
-                        docs_str
-                    ])
+                    if version:
+                        kb = version.get('knowledge_base', {})
+                        docs = version.get('documents', [])
+                        write_row(f, [
+                            profile['name'],
+                            profile.get('description', ''),
+                            profile.get('type', 'general'),
+                            version.get('system_prompt', ''),
+                            version.get('context', ''),
+                            version.get('tone', 'profesional'),
+                            version.get('language', 'español'),
+                            Joined(version.get('instructions', []), '|'),
+                            Joined(version.get('examples', []), '||'),
+                            Joined(version.get('restrictions', []), '|'),
+                            Joined((f"{k}={v['value']}" for k, v in kb.items()), '|'),
+                            Joined((f"{doc['name']}::{doc['content']}" for doc in docs), '||')
+                        ])
+                    if lazy:
+                        versions.unload(version_key)
+                    if progress:
+                        progress(done, done / len(profiles))
             
             return True
         except Exception as e:
@@ -825,7 +1557,30 @@ class ProfileManager:
     
     # ===== IMPORTACIÓN DE CATÁLOGO DE VEHÍCULOS =====
     
-    def import_vehicle_catalog_from_csv(self, csv_path: str, profile_name: str = None) -> Optional[str]:
+    def _apply_catalog_content(self, profile_name: str, content: Dict):
+        """Completar un perfil de catálogo con CatalogImportBuilder.finish() (dentro de un batch)"""
+        self.update_profile(profile_name, description=content["description"])
+        
+        # Actualizar perfil con configuración base
+        self.update_version_content(profile_name, 1, **content["settings"])
+        
+        # Guardar también el catálogo como tabla columnar tipada para filtrado por facetas
+        self.get_version(profile_name, 1)["vehicle_catalog"] = content["vehicle_catalog"]
+        self._emit(SECTION_UPDATED, profile_name, 1, "vehicle_catalog")
+        self._touch(profile_name)
+        self._save_profiles()
+        
+        # Documentos resumen e índice de búsqueda rápida
+        for doc_name, doc_content, doc_type in content["documents"]:
+            self.add_document(profile_name, 1, doc_name, doc_content, doc_type)
+        
+        # Ejemplos de conversación y restricciones
+        self.update_version_content(profile_name, 1, examples=content["examples"])
+        self.update_version_content(profile_name, 1, restrictions=content["restrictions"])
+    
+    def import_vehicle_catalog_from_csv(self, csv_path: str, profile_name: str = None,
+                                        progress: Optional[ProgressCallback] = None,
+                                        chunk_size: int = 5000) -> Optional[str]:
         """Importar catálogo de vehículos desde CSV con formato de tabla
         
         El CSV debe tener las siguientes columnas:
@@ -835,256 +1590,150 @@ class ProfileManager:
         
         Cada fila representa un vehículo que se agregará a la base de conocimientos
         
+        El CSV se procesa fila a fila, sin cargarlo completo: cada ficha va directo
+        a la base de conocimientos y las columnas del catálogo y los índices por
+        marca, carrocería y transmisión se construyen a medida que se leen las
+        filas. Con el backend SQLite se confirma cada `chunk_size` filas; con JSON
+        se guarda una sola vez al final.
+        
         Args:
             csv_path: Ruta del archivo CSV con el catálogo
             profile_name: Nombre opcional para el perfil (si no se especifica, se usa "Catálogo de Vehículos")
+            progress: Callback opcional (filas procesadas, fracción del archivo leída)
+            chunk_size: Filas por commit intermedio (solo backends con escrituras por fila)
         
         Returns:
             Nombre del perfil creado o None si hubo error
         """
+        created = None
         try:
-            # Leer CSV
-            vehicles = []
-            with open(csv_path, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    vehicles.append(row)
-            
-            if not vehicles:
-                print("No se encontraron vehículos en el CSV")
-                return None
+            # Un solo guardado al final (o uno por bloque con SQLite) en lugar de uno por fila
+            with self.batch():
+                rows = iter_csv_rows(csv_path, progress)
+                first = next(rows, None)
+                if first is None:
+                    print("No se encontraron vehículos en el CSV")
+                    return None
             
-            # Nombre del perfil
-            if not profile_name:
-                profile_name = "Catálogo de Vehículos"
+                profile_name = self._unique_profile_name(profile_name or "Catálogo de Vehículos", " ")
             
-            # Verificar si ya existe y agregar sufijo
-            original_name = profile_name
-            counter = 1
-            while profile_name in self.profiles["profiles"]:
-                profile_name = f"{original_name} {counter}"
-                counter += 1
-            
-            # Crear perfil base
-            description = f"Catálogo de vehículos con {len(vehicles)} modelos importados desde CSV"
-            profile = self.create_profile(profile_name, description, "ventas")
-            
-            # System prompt especializado para vehículos
-            system_prompt = """Eres un experto asesor de ventas de vehículos. Tienes conocimiento completo del catálogo de vehículos disponibles y puedes ayudar a los clientes a encontrar el vehículo perfecto según sus necesidades, presupuesto y preferencias.
-
-Cuando un cliente pregunte sobre vehículos:
-1. Identifica sus necesidades (tamaño, uso, presupuesto, preferencias)
-2. Recomienda modelos específicos del catálogo
-3. Destaca características relevantes (motor, equipamiento, colores disponibles)
-4. Proporciona detalles técnicos cuando se soliciten
-5. Ayuda a comparar diferentes modelos
-6. Facilita el proceso de decisión con información clara y precisa"""
+                # Crear perfil base (la descripción se completa al conocer el total)
+                self.create_profile(profile_name, "", "ventas")
+                created = profile_name
+                commit_chunks = chunk_size > 0 and self._store.row_level
             
-            # Contexto general
-            context = f"""Este perfil contiene información detallada sobre {len(vehicles)} vehículos en nuestro catálogo. 
-Cada vehículo incluye especificaciones técnicas completas, equipamiento, colores disponibles y más.
-
-El catálogo se actualiza regularmente y toda la información ha sido importada y verificada."""
+                # Agregar cada vehículo a la base de conocimientos a medida que se lee
+                builder = CatalogImportBuilder()
+                for vehicle in chain([first], rows):
+                    kb_key, vehicle_info = builder.add(vehicle)
+                    self.add_to_knowledge_base(profile_name, 1, kb_key, vehicle_info)
+                    if commit_chunks and builder.count % chunk_size == 0:
+                        self._flush_batch()
             
-            # Instrucciones específicas
-            instructions = [
-                "Saluda cordialmente y pregunta qué tipo de vehículo está buscando el cliente",
-                "Identifica necesidades clave: uso del vehículo, número de pasajeros, tipo de conducción",
-                "Recomienda vehículos específicos del catálogo basándote en las necesidades",
-                "Proporciona detalles técnicos precisos del catálogo cuando se soliciten",
-                "Destaca el equipamiento y características únicas de cada modelo",
-                "Menciona los colores disponibles cuando sea relevante",
-                "Ofrece comparaciones entre modelos cuando el cliente esté indeciso",
-                "Proporciona información sobre motores, potencia y consumo",
-                "Si tienes foto disponible, ofrece mostrarla al cliente",
-                "Mantén un tono profesional pero amigable y consultivo"
-            ]
+                self._apply_catalog_content(profile_name, builder.finish())
             
-            # Actualizar perfil con configuración base
-            self.update_version_content(
-                profile_name, 
-                1,
-                system_prompt=system_prompt,
-                context=context,
-                instructions=instructions,
-                tone="profesional",
-                language="español"
-            )
-            
-            # Agregar cada vehículo a la base de conocimientos
-            for idx, vehicle in enumerate(vehicles):
-                vehicle_id = vehicle.get('id', f'VEH_{idx+1}')
-                marca = vehicle.get('marca', 'N/A')
-                modelo = vehicle.get('modelo', 'N/A')
-                version = vehicle.get('version', 'N/A')
-                año = vehicle.get('año', 'N/A')
-                
-                # Crear clave única para el vehículo
-                kb_key = f"{marca}_{modelo}_{version}_{año}_{vehicle_id}".replace(' ', '_')
-                
-                # Construir descripción completa del vehículo
-                vehicle_info = f"""
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-🚗 {marca} {modelo} {version} ({año})
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-📋 INFORMACIÓN GENERAL:
-• ID: {vehicle.get('id', 'N/A')}
-• Marca: {marca}
-• Modelo: {modelo}
-• Versión: {version}
-• Año: {año}
-• Tipo de Carrocería: {vehicle.get('tipo_carroceria', 'N/A')}
-
-🔧 ESPECIFICACIONES TÉCNICAS:
-• Motor: {vehicle.get('modelo_motor', 'N/A')}
-• Potencia: {vehicle.get('potencia_hp', 'N/A')} HP
-• Cilindrada: {vehicle.get('cilindrada', 'N/A')}
-• Transmisión: {vehicle.get('transmision', 'N/A')}
-• Capacidad de Combustible: {vehicle.get('capacidad_combustible_lt', 'N/A')} litros
-
-🚙 CARACTERÍSTICAS:
-• Puertas: {vehicle.get('puertas', 'N/A')}
-• Asientos: {vehicle.get('asientos', 'N/A')}
-• Neumáticos: {vehicle.get('neumaticos', 'N/A')}
-
-🎨 COLORES DISPONIBLES:
-{vehicle.get('colores', 'N/A')}
-
-⭐ EQUIPAMIENTO DESTACADO:
-{vehicle.get('equipamiento_destacado', 'N/A')}
-
-🛡️ GARANTÍA:
-• Años: {vehicle.get('garantia_años', 'N/A')} año(s)
-• Kilómetros: {vehicle.get('garantia_km', 'N/A')} km
-
-📸 IMAGEN:
-{vehicle.get('link_foto', 'No disponible')}
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-"""
-                
-                # Agregar a la base de conocimientos
-                self.add_to_knowledge_base(profile_name, 1, kb_key, vehicle_info.strip())
-            
-            # Crear documento resumen del catálogo
-            summary_lines = [
-                "═" * 60,
-                f"📊 RESUMEN DEL CATÁLOGO - {len(vehicles)} VEHÍCULOS",
-                "═" * 60,
-                ""
-            ]
-            
-            # Agrupar por marca
-            vehicles_by_brand = {}
-            for vehicle in vehicles:
-                marca = vehicle.get('marca', 'Sin marca')
-                if marca not in vehicles_by_brand:
-                    vehicles_by_brand[marca] = []
-                vehicles_by_brand[marca].append(vehicle)
-            
-            for marca, brand_vehicles in sorted(vehicles_by_brand.items()):
-                summary_lines.append(f"\n🏷️ {marca.upper()} ({len(brand_vehicles)} modelos):")
-                for v in brand_vehicles:
-                    modelo = v.get('modelo', 'N/A')
-                    año = v.get('año', 'N/A')
-                    version = v.get('version', '')
-                    summary_lines.append(f"  • {modelo} {año} {version}".strip())
-            
-            summary_lines.append("\n" + "═" * 60)
-            summary_content = "\n".join(summary_lines)
-            
-            self.add_document(
-                profile_name, 
-                1, 
-                "Resumen del Catálogo",
-                summary_content,
-                "catálogo"
-            )
-            
-            # Crear documento con índice de búsqueda rápida
-            index_lines = [
-                "═" * 60,
-                "🔍 ÍNDICE DE BÚSQUEDA RÁPIDA",
-                "═" * 60,
-                "",
-                "Busca vehículos por características:",
-                ""
-            ]
-            
-            # Índice por tipo de carrocería
-            by_body = {}
-            for v in vehicles:
-                body_type = v.get('tipo_carroceria', 'Otro')
-                if body_type not in by_body:
-                    by_body[body_type] = []
-                by_body[body_type].append(f"{v.get('marca')} {v.get('modelo')} {v.get('año')}")
-            
-            index_lines.append("\n📦 POR TIPO DE CARROCERÍA:")
-            for body_type, models in sorted(by_body.items()):
-                index_lines.append(f"\n{body_type}:")
-                for model in models:
-                    index_lines.append(f"  • {model}")
-            
-            # Índice por transmisión
-            by_trans = {}
-            for v in vehicles:
-                trans = v.get('transmision', 'N/A')
-                if trans not in by_trans:
-                    by_trans[trans] = []
-                by_trans[trans].append(f"{v.get('marca')} {v.get('modelo')} {v.get('año')}")
-            
-            index_lines.append("\n\n⚙️ POR TRANSMISIÓN:")
-            for trans, models in sorted(by_trans.items()):
-                index_lines.append(f"\n{trans}:")
-                for model in models:
-                    index_lines.append(f"  • {model}")
-            
-            index_lines.append("\n" + "═" * 60)
-            index_content = "\n".join(index_lines)
-            
-            self.add_document(
-                profile_name,
-                1,
-                "Índice de Búsqueda",
-                index_content,
-                "índice"
-            )
-            
-            # Agregar ejemplos de conversación
-            examples = [
-                f"Cliente: ¿Qué vehículos tienen disponibles?\nBot: ¡Excelente! Tenemos {len(vehicles)} modelos en nuestro catálogo de {', '.join(set(v.get('marca', '') for v in vehicles))}. ¿Qué tipo de vehículo estás buscando? ¿Sedan, SUV, pickup?",
-                f"Cliente: Busco un SUV familiar.\nBot: Perfecto, tenemos excelentes opciones de SUV. ¿Cuántos pasajeros necesitas transportar regularmente y cuál es tu presupuesto aproximado?",
-                "Cliente: ¿Este modelo viene en color rojo?\nBot: Déjame verificar los colores disponibles para ese modelo específicamente. [Consulta la información de colores del vehículo en la base de conocimientos]"
-            ]
-            
-            self.update_version_content(
-                profile_name,
-                1,
-                examples=examples
-            )
-            
-            # Agregar restricciones
-            restrictions = [
-                "No inventar especificaciones o características que no estén en el catálogo",
-                "Siempre verificar la información en la base de conocimientos antes de responder",
-                "No prometer disponibilidad sin confirmar primero",
-                "No proporcionar precios sin autorización",
-                "Dirigir al cliente a un vendedor para finalizar la compra"
-            ]
-            
-            self.update_version_content(
-                profile_name,
-                1,
-                restrictions=restrictions
-            )
-            
-            print(f"✅ Catálogo importado exitosamente: {len(vehicles)} vehículos agregados al perfil '{profile_name}'")
-            return profile_name
+                print(f"✅ Catálogo importado exitosamente: {builder.count} vehículos agregados al perfil '{profile_name}'")
+                return profile_name
             
         except Exception as e:
             print(f"Error importando catálogo de vehículos: {e}")
             import traceback
             traceback.print_exc()
+            # Con commits por bloques parte del perfil ya quedó guardada: descartarla
+            if created and created in self.profiles["profiles"]:
+                self.delete_profile(created)
             return None
-
+    
+    # ===== IMPORTACIÓN MASIVA =====
+    
+    def import_csv_directory(self, directory: str, workers: Optional[int] = None, skip_invalid: bool = False,
+                             dry_run: bool = False, progress: Optional[ProgressCallback] = None) -> Dict:
+        """Importar todos los CSV de un directorio (perfiles Campo,Valor y catálogos de vehículos)
+        
+        Los archivos se leen y validan en paralelo en un pool de procesos; después
+        se aplican en orden de nombre dentro de un solo batch, con un único
+        guardado al final. Si algún archivo es inválido no se aplica ninguno
+        (salvo con skip_invalid), y si falla la aplicación se descarta todo.
+        Los catálogos se importan como "Catálogo de Vehículos - <archivo>".
+        
+        Args:
+            directory: Directorio con los CSV
+            workers: Procesos para la lectura (por defecto, uno por CPU; 1 lee en este proceso)
+            skip_invalid: Importar los archivos válidos aunque haya inválidos
+            dry_run: Solo leer y validar, sin modificar perfiles
+            progress: Callback opcional (archivos leídos, fracción de archivos leída)
+        
+        Returns:
+            Reporte {files: [{file, kind, rows, seconds, apply_seconds, status, profile,
+            errors, warnings}], imported, invalid, workers, parse_seconds, apply_seconds,
+            commit_seconds, total_seconds, error}
+        """
+        start = time.perf_counter()
+        paths = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.lower().endswith('.csv') and os.path.isfile(os.path.join(directory, name))
+        )
+        workers = max(1, min(workers or os.cpu_count() or 1, len(paths) or 1))
+        report = {"files": [], "imported": 0, "invalid": 0, "workers": workers, "parse_seconds": 0.0,
+                  "apply_seconds": 0.0, "commit_seconds": 0.0, "total_seconds": 0.0, "error": None}
+        
+        # Lectura y validación en paralelo (el contenido viaja serializado entre procesos)
+        results = {}
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(parse_import_file, path): path for path in paths}
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
+                    if progress:
+                        progress(len(results), len(results) / len(paths))
+        else:
+            for path in paths:
+                results[path] = parse_import_file(path)
+                if progress:
+                    progress(len(results), len(results) / len(paths))
+        report["parse_seconds"] = time.perf_counter() - start
+        
+        items = [results[path] for path in paths]
+        for item in items:
+            item.update(apply_seconds=None, profile=None, status="inválido" if item["errors"] else "válido")
+        report["files"] = items
+        report["invalid"] = sum(1 for item in items if item["errors"])
+        
+        if report["invalid"] and not skip_invalid:
+            report["error"] = "Hay archivos inválidos: no se importó nada (usa skip_invalid para importar el resto)"
+        elif not dry_run:
+            apply_start = time.perf_counter()
+            applied = []
+            try:
+                with self.batch():
+                    for item in items:
+                        if item["errors"]:
+                            continue
+                        item_start = time.perf_counter()
+                        payload = item.pop("payload")
+                        if item["kind"] == "profile":
+                            profile_name = self._apply_profile_import(payload)
+                        else:
+                            stem = os.path.splitext(os.path.basename(item["file"]))[0]
+                            profile_name = self._unique_profile_name(f"Catálogo de Vehículos - {stem}", " ")
+                            self.create_profile(profile_name, "", "ventas")
+                            for kb_key, vehicle_info in payload["knowledge_base"]:
+                                self.add_to_knowledge_base(profile_name, 1, kb_key, vehicle_info)
+                            self._apply_catalog_content(profile_name, payload["content"])
+                        item.update(profile=profile_name, apply_seconds=time.perf_counter() - item_start)
+                        applied.append(item)
+                    commit_start = time.perf_counter()
+                report["commit_seconds"] = time.perf_counter() - commit_start
+                for item in applied:
+                    item["status"] = "importado"
+                report["imported"] = len(applied)
+            except Exception as e:
+                report["error"] = f"Importación revertida: {type(e).__name__}: {e}"
+                for item in applied:
+                    item.update(status="revertido", profile=None)
+            report["apply_seconds"] = time.perf_counter() - apply_start - report["commit_seconds"]
+        
+        for item in items:
+            item.pop("payload", None)
+        report["total_seconds"] = time.perf_counter() - start
+        return report
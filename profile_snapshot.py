@@ -0,0 +1,241 @@
+"""
+Instantáneas inmutables del estado activo de los perfiles
+ProfileManager edita su diccionario anidado en el lugar; quien atiende
+mensajes lee en cambio una ProfileSnapshot: ajustes, perfiles activos, rutas
+por chat y la versión activa de cada perfil en uso, congelados. Después de
+cada guardado se arma la siguiente copiando solo lo que cambió (según los
+eventos de cambio) y compartiendo el resto con la anterior, y se publica
+reemplazando una referencia: un lector que ya tomó una instantánea la sigue
+viendo completa y consistente, sin locks ni copias profundas.
+"""
+
+from typing import Dict, Iterable, List, Optional
+
+from profile_events import (
+    PROFILE_CREATED, PROFILE_DELETED, SECTION_UPDATED, SETTINGS_UPDATED, STORE_RELOADED, ChangeEvent
+)
+
+# Marca de "cambió todo" (perfil completo o sección completa)
+ALL = None
+
+
+class FrozenDict(dict):
+    """dict de solo lectura
+
+    Sigue siendo un dict, así que json, content_hash y el código que ya lee
+    perfiles lo tratan igual que al original.
+    """
+
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Las instantáneas de perfiles son de solo lectura")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+def freeze(value):
+    """Copia inmutable de un valor de perfil (dict -> FrozenDict, list -> tuple)
+
+    Los textos y números ya son inmutables y se comparten, no se copian.
+    """
+    if isinstance(value, FrozenDict):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(map(freeze, value))
+    return value
+
+
+def _freeze_meta(profile: Dict, versions: Dict) -> FrozenDict:
+    """Campos del perfil congelados, con solo las versiones indicadas"""
+    fields = {key: freeze(value) for key, value in profile.items() if key != "versions"}
+    fields["versions"] = FrozenDict(versions)
+    return FrozenDict(fields)
+
+
+class ProfileSnapshot:
+    """Estado activo congelado, con la misma API de lectura que ProfileManager
+
+    Incluye los perfiles que usa algún conjunto (activos, perfil activo
+    legado o rutas por chat) y, de cada uno, solo su versión activa.
+    """
+
+    __slots__ = ("seq", "profiles", "active_profiles", "active_profile", "chat_routes", "metadata")
+
+    def __init__(self, seq: int, profiles: FrozenDict, active_profiles: tuple, active_profile: Optional[str],
+                 chat_routes: FrozenDict, metadata: FrozenDict):
+        self.seq = seq
+        self.profiles = profiles
+        self.active_profiles = active_profiles
+        self.active_profile = active_profile
+        self.chat_routes = chat_routes
+        self.metadata = metadata
+
+    def __repr__(self):
+        return f"ProfileSnapshot(#{self.seq} {', '.join(self.profiles) or 'sin perfiles'})"
+
+    def get_profile(self, name: str) -> Optional[Dict]:
+        return self.profiles.get(name)
+
+    def get_version(self, profile_name: str, version: int) -> Optional[Dict]:
+        profile = self.profiles.get(profile_name)
+        return profile["versions"].get(str(version)) if profile else None
+
+    def get_active_profiles(self) -> tuple:
+        return self.active_profiles
+
+    def get_context_profiles(self) -> tuple:
+        """Perfiles que aportan contexto: los activos o, si no hay, el perfil activo legado"""
+        if self.active_profiles:
+            return self.active_profiles
+        if self.active_profile:
+            return (FrozenDict(name=self.active_profile, priority=1),)
+        return ()
+
+    def has_chat_routes(self) -> bool:
+        return bool(self.chat_routes.get("chats") or self.chat_routes.get("chat_types"))
+
+    def get_chat_route(self, chat_id, chat_type: Optional[str] = None) -> Optional[tuple]:
+        """Conjunto asignado explícitamente al chat o a su tipo; None si usa el global"""
+        profiles = (self.chat_routes.get("chats") or {}).get(str(chat_id))
+        if profiles is None and chat_type:
+            profiles = (self.chat_routes.get("chat_types") or {}).get(chat_type)
+        return profiles
+
+    def get_chat_profiles(self, chat_id, chat_type: Optional[str] = None) -> tuple:
+        """Conjunto de perfiles de un chat: el del chat, el de su tipo o el global"""
+        profiles = self.get_chat_route(chat_id, chat_type)
+        if profiles is None:
+            profiles = self.get_context_profiles()
+        return profiles
+
+    def get_active_version_key(self, active_profiles: Optional[Iterable[Dict]] = None) -> str:
+        """Clave tipo "Perfil A@v2|Perfil B@v1" de las versiones en uso"""
+        if active_profiles is None:
+            active_profiles = self.get_context_profiles()
+        return "|".join(f"{ap['name']}@v{self.profiles[ap['name']]['active_version']}"
+                        for ap in active_profiles if ap["name"] in self.profiles)
+
+    def is_compact_context(self) -> bool:
+        return self.metadata.get("context_render_mode", "pretty") == "compact"
+
+    def is_context_dedup_enabled(self) -> bool:
+        return bool(self.metadata.get("context_dedup", True))
+
+    def get_context_token_budget(self) -> int:
+        return int(self.metadata.get("context_token_budget", 0) or 0)
+
+
+def referenced_profiles(state: Dict) -> List[str]:
+    """Perfiles que usa algún conjunto: activos, perfil activo legado y rutas por chat"""
+    names = [ap["name"] for ap in state.get("active_profiles") or []]
+    if state.get("active_profile"):
+        names.append(state["active_profile"])
+    routes = state.get("chat_routes") or {}
+    for group in ("chats", "chat_types"):
+        for profiles in (routes.get(group) or {}).values():
+            names.extend(ap["name"] for ap in profiles)
+    return list(dict.fromkeys(names))
+
+
+def _collect_changes(events: List[ChangeEvent]) -> Optional[Dict]:
+    """Qué cambió según los eventos; None si hay que reconstruir todo
+
+    Returns:
+        {"settings": {ajuste}, "profiles": {perfil: ALL o {(versión, sección): {claves} o ALL}}}
+    """
+    settings = set()
+    profiles = {}
+    for event in events:
+        if event.kind == STORE_RELOADED:
+            return None
+        if event.kind == SETTINGS_UPDATED:
+            settings.add(event.section)
+        elif event.profile is None:
+            continue
+        elif event.kind in (PROFILE_CREATED, PROFILE_DELETED):
+            profiles[event.profile] = ALL
+        else:
+            sections = profiles.setdefault(event.profile, {})
+            if sections is ALL or event.kind != SECTION_UPDATED:
+                continue
+            where = (event.version, event.section)
+            if event.key is None or event.section != "knowledge_base":
+                sections[where] = ALL
+            elif sections.get(where, set()) is not ALL:
+                sections.setdefault(where, set()).add(event.key)
+    return {"settings": settings, "profiles": profiles}
+
+
+def _patch_version(current: Dict, previous: FrozenDict, sections: Dict) -> FrozenDict:
+    """Versión congelada copiando solo las secciones cambiadas y compartiendo el resto"""
+    fields = dict(previous)
+    for section, keys in sections.items():
+        if section not in current:
+            fields.pop(section, None)
+            continue
+        value = current[section]
+        old = previous.get(section)
+        if keys is not ALL and isinstance(old, FrozenDict) and isinstance(value, dict):
+            # add_to_knowledge_base agrega o reemplaza entradas: el orden se conserva
+            entries = dict(old)
+            for key in keys:
+                if key in value:
+                    entries[key] = freeze(value[key])
+            if len(entries) == len(value):
+                fields[section] = FrozenDict(entries)
+                continue
+        fields[section] = freeze(value)
+    return FrozenDict(fields)
+
+
+def build_snapshot(state: Dict, seq: int = 0, previous: Optional[ProfileSnapshot] = None,
+                   events: Optional[List[ChangeEvent]] = None) -> ProfileSnapshot:
+    """Armar la instantánea del estado actual
+
+    Args:
+        state: Diccionario de ProfileManager.profiles (no se modifica)
+        seq: Secuencia del último evento incluido
+        previous: Instantánea anterior, de la que se comparte lo que no cambió
+        events: Eventos desde `previous`; sin ellos se congela todo de nuevo
+
+    Returns:
+        Nueva ProfileSnapshot
+    """
+    changes = _collect_changes(events) if previous is not None and events is not None else None
+    changed_profiles = changes["profiles"] if changes else {}
+
+    routes = state.get("chat_routes") or {}
+    if changes and "chat_routes" not in changes["settings"]:
+        chat_routes = previous.chat_routes
+    else:
+        chat_routes = freeze({"chats": routes.get("chats") or {}, "chat_types": routes.get("chat_types") or {}})
+
+    profiles = {}
+    for name in referenced_profiles(state):
+        profile = state["profiles"].get(name)
+        if profile is None:
+            continue
+        old = previous.profiles.get(name) if changes else None
+        if old is not None and name not in changed_profiles:
+            profiles[name] = old
+            continue
+
+        active = profile.get("active_version")
+        version = profile["versions"].get(str(active))
+        sections = changed_profiles.get(name, ALL)
+        if old is None or sections is ALL or old["active_version"] != active or version is None:
+            frozen = freeze(version) if version is not None else None
+        else:
+            frozen = _patch_version(version, old["versions"][str(active)],
+                                    {section: keys for (v, section), keys in sections.items() if v == active})
+        profiles[name] = _freeze_meta(profile, {str(active): frozen} if frozen is not None else {})
+
+    return ProfileSnapshot(seq, FrozenDict(profiles), freeze(state.get("active_profiles") or []),
+                           state.get("active_profile"), chat_routes, freeze(state.get("metadata") or {}))
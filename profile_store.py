@@ -0,0 +1,694 @@
+"""
+Backends de almacenamiento para ProfileManager
+- JsonProfileStore: el archivo bot_profiles.json de siempre (se reescribe completo,
+  en el formato de STORE_FORMAT: ver serialization.py)
+- SqliteProfileStore: perfiles, versiones, entradas de la base de conocimientos y
+  documentos como filas; cada guardado escribe solo las filas que cambiaron y
+  varios procesos (bot y app de entrenamiento) pueden compartir la base
+
+En ambos backends el contenido de las versiones (entradas de la base de
+conocimientos, documentos y catálogo de vehículos) se guarda direccionado por
+contenido: cada valor distinto es un blob identificado por su hash y las
+versiones solo guardan la referencia {"$blob": hash}. Una versión nueva que no
+cambia nada cuesta una referencia por entrada, y los blobs que ya no referencia
+ninguna versión se eliminan.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from serialization import dump_file, load_file
+
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+
+BLOB_REF = "$blob"
+# Secciones de la versión guardadas como blobs
+BLOB_SECTIONS = ("knowledge_base", "documents", "vehicle_catalog")
+
+# Destino de los blobs al guardar: (hash, valor, texto serializado o None)
+BlobSink = Callable[[str, Any, Optional[str]], None]
+
+
+class StaleStoreError(Exception):
+    """Otro proceso guardó después de la última lectura: hay que recargar antes de escribir"""
+
+
+def open_store(path: str, fmt: Optional[str] = None):
+    """Elegir el backend según la extensión del archivo
+
+    Args:
+        path: Archivo de perfiles (.db/.sqlite/.sqlite3 para SQLite)
+        fmt: Formato de serialización del backend de archivo (por defecto STORE_FORMAT)
+    """
+    if path.lower().endswith(SQLITE_EXTENSIONS):
+        return SqliteProfileStore(path)
+    return JsonProfileStore(path, fmt)
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def blob_id(text: str) -> str:
+    """Hash de contenido de un blob serializado"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+# Elementos por trozo al serializar listas largas para calcular su hash
+_STREAM_CHUNK = 1000
+
+
+def _stream_into(value, update: Callable[[bytes], None]):
+    """Pasar a `update` los mismos bytes que _dumps(value), por trozos"""
+    if isinstance(value, dict):
+        update(b"{")
+        for index, (key, item) in enumerate(value.items()):
+            update((("," if index else "") + _dumps(key) + ":").encode("utf-8"))
+            _stream_into(item, update)
+        update(b"}")
+    elif isinstance(value, list) and len(value) > _STREAM_CHUNK:
+        update(b"[")
+        for start in range(0, len(value), _STREAM_CHUNK):
+            chunk = _dumps(value[start:start + _STREAM_CHUNK])[1:-1]
+            update((("," if start else "") + chunk).encode("utf-8"))
+        update(b"]")
+    else:
+        update(_dumps(value).encode("utf-8"))
+
+
+def stream_blob_id(value) -> str:
+    """blob_id(_dumps(value)) sin construir el texto completo (para el catálogo columnar)"""
+    h = hashlib.blake2b(digest_size=16)
+    _stream_into(value, h.update)
+    return h.hexdigest()
+
+
+def is_blob_ref(value) -> bool:
+    return isinstance(value, dict) and len(value) == 1 and BLOB_REF in value
+
+
+class BlobCodec:
+    """Convierte versiones entre la forma en memoria y la forma con referencias a blobs
+
+    Las entradas de la base de conocimientos, los documentos y el catálogo se
+    reemplazan, nunca se modifican en sitio: el hash de un objeto ya visto se
+    reutiliza por identidad, así que cada valor se serializa una sola vez
+    aunque el perfil se guarde muchas veces (p. ej. en commits por bloques).
+    """
+
+    def __init__(self):
+        # id(objeto) -> (objeto, hash) de los valores vistos en el guardado anterior
+        self._memo: Dict[int, Tuple[Any, str]] = {}
+        self._next_memo: Dict[int, Tuple[Any, str]] = {}
+
+    def begin(self):
+        """Empezar un guardado (el memo conserva solo lo visto en el guardado anterior)"""
+        self._next_memo = {}
+
+    def end(self):
+        self._memo = self._next_memo
+        self._next_memo = {}
+
+    def reset(self):
+        """Olvidar los hashes memorizados (p. ej. tras un guardado fallido)"""
+        self._memo = {}
+        self._next_memo = {}
+
+    def _ref(self, value, sink: BlobSink, large: bool = False) -> Dict:
+        cached = self._memo.get(id(value)) or self._next_memo.get(id(value))
+        if cached and cached[0] is value:
+            digest, text = cached[1], None
+        elif large:
+            # Hash por trozos: el texto completo solo se arma si el destino lo necesita
+            digest, text = stream_blob_id(value), None
+        else:
+            text = _dumps(value)
+            digest = blob_id(text)
+        self._next_memo[id(value)] = (value, digest)
+        sink(digest, value, text)
+        return {BLOB_REF: digest}
+
+    def pack_version(self, data: Dict, sink: BlobSink) -> Dict:
+        """Copia de la versión con sus secciones reemplazadas por referencias
+
+        Args:
+            data: Versión en memoria
+            sink: Recibe (hash, valor, texto serializado o None si no se volvió a serializar)
+                  por cada blob referenciado
+        """
+        packed = dict(data)
+        if "knowledge_base" in data:
+            packed["knowledge_base"] = {key: self._ref(entry, sink)
+                                        for key, entry in data["knowledge_base"].items()}
+        if "documents" in data:
+            packed["documents"] = [self._ref(document, sink) for document in data["documents"]]
+        if data.get("vehicle_catalog"):
+            packed["vehicle_catalog"] = self._ref(data["vehicle_catalog"], sink, large=True)
+        return packed
+
+
+def unpack_version(data: Dict, resolve: Callable[[str], Any]) -> Dict:
+    """Reemplazar las referencias a blobs de una versión por sus valores"""
+    knowledge_base = data.get("knowledge_base")
+    if knowledge_base:
+        data["knowledge_base"] = {key: resolve(entry[BLOB_REF]) if is_blob_ref(entry) else entry
+                                  for key, entry in knowledge_base.items()}
+    documents = data.get("documents")
+    if documents:
+        data["documents"] = [resolve(doc[BLOB_REF]) if is_blob_ref(doc) else doc for doc in documents]
+    if is_blob_ref(data.get("vehicle_catalog")):
+        data["vehicle_catalog"] = resolve(data["vehicle_catalog"][BLOB_REF])
+    return data
+
+
+def blob_resolver(texts: Dict[str, Any]) -> Callable[[str], Any]:
+    """Resolver de blobs que deserializa cada uno una sola vez
+
+    Las versiones que comparten un blob reciben el mismo objeto, igual que
+    las que comparten entradas en memoria tras create_version.
+    """
+    parsed: Dict[str, Any] = {}
+
+    def resolve(digest: str):
+        if digest not in parsed:
+            value = texts[digest]
+            parsed[digest] = json.loads(value) if isinstance(value, str) else value
+        return parsed[digest]
+    return resolve
+
+
+class LazyVersions(MutableMapping):
+    """Versiones de un perfil cuyo contenido se lee al primer acceso
+
+    Se comporta como el diccionario {"1": {...}, "2": {...}} de siempre: las
+    claves están disponibles desde el inicio y cada versión se carga con
+    `loader(clave)` la primera vez que se accede a ella.
+    """
+
+    def __init__(self, keys: Iterable[str], loader: Callable[[str], Dict]):
+        self._data: Dict[str, Optional[Dict]] = dict.fromkeys(keys)
+        self._loader = loader
+
+    def __getitem__(self, key: str) -> Dict:
+        value = self._data[key]
+        if value is None:
+            value = self._data[key] = self._loader(key)
+        return value
+
+    def __setitem__(self, key: str, value: Dict):
+        self._data[key] = value
+
+    def __delitem__(self, key: str):
+        del self._data[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def __repr__(self) -> str:
+        loaded = sum(value is not None for value in self._data.values())
+        return f"LazyVersions({list(self._data)}, cargadas={loaded})"
+
+    def loaded_items(self):
+        """Versiones ya cargadas (las únicas que pueden haber cambiado)"""
+        return [(key, value) for key, value in self._data.items() if value is not None]
+
+    def is_loaded(self, key: str) -> bool:
+        return self._data.get(key) is not None
+
+    def unload(self, key: str):
+        """Liberar una versión sin cambios (se vuelve a leer al próximo acceso)"""
+        if key in self._data:
+            self._data[key] = None
+
+
+def loaded_versions(versions) -> list:
+    """Pares (clave, versión) cargados en memoria de un dict o LazyVersions"""
+    if isinstance(versions, LazyVersions):
+        return versions.loaded_items()
+    return list(versions.items())
+
+
+class JsonProfileStore:
+    """Todo el universo de perfiles en un único archivo JSON
+
+    El contenido de las versiones va en la clave "blobs" (hash -> valor) y cada
+    versión guarda referencias. Cada guardado escribe solo los blobs
+    referenciados, así que los que quedan sin uso desaparecen al guardar.
+    Los archivos sin "blobs" (formato anterior) se leen igual. El formato del
+    archivo (JSON, orjson, msgpack, con zstd opcional) se detecta al leer.
+    """
+
+    def __init__(self, path: str, fmt: Optional[str] = None):
+        self.path = path
+        self.format = fmt
+        self._codec = BlobCodec()
+        # Cada guardado reescribe el archivo completo
+        self.row_level = False
+
+    def signature(self) -> Optional[Tuple]:
+        """Firma barata (mtime, tamaño) para detectar cambios de otros procesos"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def load(self) -> Optional[Dict]:
+        """Cargar todo; None si el archivo no existe"""
+        if not os.path.exists(self.path):
+            return None
+        data = load_file(self.path)
+        blobs = data.pop("blobs", None)
+        if blobs is not None:
+            resolve = blob_resolver(blobs)
+            for profile in data.get("profiles", {}).values():
+                for version in profile.get("versions", {}).values():
+                    unpack_version(version, resolve)
+        return data
+
+    def save(self, profiles: Dict, touched: Optional[Set[str]] = None):
+        """Reescribir el archivo completo (touched se ignora)"""
+        blobs: Dict[str, Any] = {}
+        packed = {}
+
+        def sink(digest, value, text):
+            blobs.setdefault(digest, value)
+
+        self._codec.begin()
+        for name, profile in profiles.get("profiles", {}).items():
+            versions = {version: self._codec.pack_version(data, sink)
+                        for version, data in profile.get("versions", {}).items()}
+            packed[name] = dict(profile, versions=versions)
+        self._codec.end()
+
+        data = dict(profiles, profiles=packed)
+        data["blobs"] = blobs
+        dump_file(self.path, data, self.format)
+
+    def size_bytes(self) -> int:
+        """Tamaño del archivo en disco"""
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def compact(self) -> int:
+        """Nada que reescribir: cada guardado ya omite los blobs sin referencias"""
+        return 0
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS profiles (
+    name TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS versions (
+    profile TEXT NOT NULL,
+    version TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (profile, version)
+);
+CREATE TABLE IF NOT EXISTS kb_entries (
+    profile TEXT NOT NULL,
+    version TEXT NOT NULL,
+    key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    blob TEXT NOT NULL,
+    PRIMARY KEY (profile, version, key)
+);
+CREATE TABLE IF NOT EXISTS documents (
+    profile TEXT NOT NULL,
+    version TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    blob TEXT NOT NULL,
+    PRIMARY KEY (profile, version, position)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS kb_entries_blob ON kb_entries (blob);
+CREATE INDEX IF NOT EXISTS documents_blob ON documents (blob);
+"""
+
+# Secciones de la versión guardadas como filas propias
+ROW_SECTIONS = ("knowledge_base", "documents")
+
+# Blobs que ninguna fila referencia (el catálogo se referencia desde la fila de la versión)
+SQLITE_GC = """
+DELETE FROM blobs
+WHERE hash NOT IN (SELECT blob FROM kb_entries)
+  AND hash NOT IN (SELECT blob FROM documents)
+  AND hash NOT IN (SELECT json_extract(data, '$.vehicle_catalog."$blob"') FROM versions
+                   WHERE json_extract(data, '$.vehicle_catalog."$blob"') IS NOT NULL)
+"""
+
+
+def _kb_row(position: int, blob: str) -> str:
+    return f'[{position},"{blob}"]'
+
+
+def _doc_row(blob: str) -> str:
+    return f'"{blob}"'
+
+
+def profile_rows(name: str, profile: Dict, codec: BlobCodec, sink: BlobSink) -> Dict[Tuple, Tuple[str, str]]:
+    """Filas de un perfil: clave de fila -> (datos serializados, huella)
+
+    Las filas de entradas y documentos solo llevan el hash del blob (son tan
+    cortas que su huella es el propio texto); las demás usan el sha1 de sus
+    datos. Cada blob referenciado pasa por `sink`. Las versiones sin cargar
+    no se recorren (no pueden haber cambiado).
+    """
+    rows = {}
+
+    def put(key, value):
+        text = _dumps(value)
+        rows[key] = (text, _digest(text))
+
+    put(("profiles", name), {k: v for k, v in profile.items() if k != "versions"})
+    for version, data in loaded_versions(profile.get("versions", {})):
+        packed = codec.pack_version(data, sink)
+        put(("versions", name, version), {k: v for k, v in packed.items() if k not in ROW_SECTIONS})
+        for position, (key, ref) in enumerate(packed.get("knowledge_base", {}).items()):
+            text = _kb_row(position, ref[BLOB_REF])
+            rows[("kb_entries", name, version, key)] = (text, text)
+        for position, ref in enumerate(packed.get("documents", [])):
+            text = _doc_row(ref[BLOB_REF])
+            rows[("documents", name, version, position)] = (text, text)
+    return rows
+
+
+class SqliteProfileStore:
+    """Perfiles en SQLite (WAL) con escrituras a nivel de fila
+
+    Guarda el hash de cada fila escrita o leída; al guardar solo se serializan
+    los perfiles marcados como modificados (o todos si no hay indicación) y solo
+    se escriben las filas cuyo hash cambió. Las filas de entradas y documentos
+    referencian blobs de la tabla blobs, que se insertan una sola vez y se
+    recolectan cuando un guardado reemplaza o elimina filas.
+
+    load() lee solo un índice (metadatos, perfiles y claves de versión); el
+    contenido de cada versión se lee al primer acceso, así que el arranque
+    no crece con el historial de versiones.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SQLITE_SCHEMA)
+        self._codec = BlobCodec()
+        # Cada guardado escribe solo las filas que cambiaron: admite commits frecuentes
+        self.row_level = True
+        self._row_hashes: Dict[str, Dict[Tuple, str]] = {}
+        self._meta_hashes: Dict[str, str] = {}
+        # Claves de versión de cada perfil presentes en la base
+        self._version_keys: Dict[str, Set[str]] = {}
+        # Blobs ya deserializados: las versiones que comparten un blob reciben el mismo objeto
+        self._parsed_blobs: Dict[str, Any] = {}
+        # Hashes de blobs presentes en la base (None = releer antes de guardar)
+        self._blob_ids: Optional[Set[str]] = None
+        # data_version de la última lectura: si otra conexión escribió después, el estado en memoria es viejo
+        self._data_version = self._read_data_version()
+        self.rows_written = 0
+        self.blobs_written = 0
+        self.blobs_collected = 0
+        self.versions_loaded = 0
+
+    def _read_data_version(self) -> int:
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def signature(self) -> Optional[Tuple]:
+        """Cambia cuando otra conexión confirma una escritura (PRAGMA data_version)"""
+        with self._lock:
+            return (self._read_data_version(),)
+
+    def load(self) -> Optional[Dict]:
+        """Leer el índice de perfiles; None si la base está vacía
+
+        Cada perfil lleva en "versions" un LazyVersions que lee la versión
+        con load_version() al primer acceso.
+        """
+        with self._lock:
+            db = self._conn
+            self._data_version = self._read_data_version()
+            meta = {key: json.loads(value) for key, value in db.execute("SELECT key, value FROM meta")}
+            if not meta:
+                return None
+
+            self._row_hashes = {}
+            self._meta_hashes = {key: _digest(_dumps(value)) for key, value in meta.items()}
+            self._version_keys = {}
+            self._parsed_blobs = {}
+            self._blob_ids = None
+            keys: Dict[str, list] = {}
+            for name, version in db.execute("SELECT profile, version FROM versions ORDER BY profile, rowid"):
+                keys.setdefault(name, []).append(version)
+
+            profiles: Dict[str, Dict] = {}
+            for name, data in db.execute("SELECT name, data FROM profiles"):
+                self._row_hashes[name] = {("profiles", name): _digest(data)}
+                self._version_keys[name] = set(keys.get(name, ()))
+                profiles[name] = json.loads(data)
+                profiles[name]["versions"] = LazyVersions(
+                    keys.get(name, ()), lambda version, name=name: self.load_version(name, version))
+
+            result = dict(meta)
+            result["profiles"] = profiles
+            return result
+
+    def _resolve(self, db: sqlite3.Connection, digest: str):
+        if digest not in self._parsed_blobs:
+            row = db.execute("SELECT data FROM blobs WHERE hash = ?", (digest,)).fetchone()
+            if row is None:
+                raise KeyError(f"Blob {digest} no encontrado")
+            self._parsed_blobs[digest] = json.loads(row[0])
+        return self._parsed_blobs[digest]
+
+    def load_version(self, name: str, version: str) -> Dict:
+        """Leer el contenido completo de una versión (fila, entradas, documentos y blobs)"""
+        with self._lock:
+            db = self._conn
+            # Una sola transacción de lectura: la versión se lee consistente aunque otro proceso escriba
+            db.execute("BEGIN")
+            try:
+                row = db.execute("SELECT data FROM versions WHERE profile = ? AND version = ?",
+                                 (name, version)).fetchone()
+                if row is None:
+                    raise KeyError(f"Versión {version} de '{name}' no encontrada")
+                hashes = self._row_hashes.setdefault(name, {})
+                hashes[("versions", name, version)] = _digest(row[0])
+                body = unpack_version(json.loads(row[0]), lambda digest: self._resolve(db, digest))
+                body["knowledge_base"] = {}
+                body["documents"] = []
+
+                for key, position, blob in db.execute(
+                        "SELECT key, position, blob FROM kb_entries WHERE profile = ? AND version = ? "
+                        "ORDER BY position", (name, version)).fetchall():
+                    body["knowledge_base"][key] = self._resolve(db, blob)
+                    hashes[("kb_entries", name, version, key)] = _kb_row(position, blob)
+                for position, blob in db.execute(
+                        "SELECT position, blob FROM documents WHERE profile = ? AND version = ? "
+                        "ORDER BY position", (name, version)).fetchall():
+                    body["documents"].append(self._resolve(db, blob))
+                    hashes[("documents", name, version, position)] = _doc_row(blob)
+            finally:
+                db.execute("COMMIT")
+            self.versions_loaded += 1
+            return body
+
+    def save(self, profiles: Dict, touched: Optional[Set[str]] = None):
+        """Escribir solo las filas que cambiaron
+
+        Args:
+            profiles: Diccionario completo de perfiles
+            touched: Perfiles modificados (None = comparar todos; vacío = solo metadatos)
+
+        Raises:
+            StaleStoreError: si otro proceso guardó después de la última lectura
+                (no se escribe nada; hay que recargar con load())
+        """
+        with self._lock:
+            db = self._conn
+            current = profiles.get("profiles", {})
+            names: Iterable[str] = current.keys() if touched is None else touched
+            deleted = [name for name in self._row_hashes if name not in current]
+
+            db.execute("BEGIN IMMEDIATE")
+            if self._read_data_version() != self._data_version:
+                # Los hashes de filas y los blobs conocidos ya no describen la base
+                db.execute("ROLLBACK")
+                self._blob_ids = None
+                raise StaleStoreError(f"{self.path} cambió desde la última lectura")
+            try:
+                if self._blob_ids is None:
+                    self._blob_ids = {digest for digest, in db.execute("SELECT hash FROM blobs")}
+                for key, value in profiles.items():
+                    if key == "profiles":
+                        continue
+                    text = _dumps(value)
+                    digest = _digest(text)
+                    if self._meta_hashes.get(key) != digest:
+                        db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, text))
+                        self._meta_hashes[key] = digest
+                        self.rows_written += 1
+
+                for name in deleted:
+                    for table in ("profiles", "versions", "kb_entries", "documents"):
+                        column = "name" if table == "profiles" else "profile"
+                        db.execute(f"DELETE FROM {table} WHERE {column} = ?", (name,))
+                    del self._row_hashes[name]
+                    self._version_keys.pop(name, None)
+
+                def sink(digest, value, text):
+                    # Los blobs nuevos se insertan al encontrarlos, sin acumular sus textos
+                    if digest not in self._blob_ids:
+                        db.execute("INSERT OR IGNORE INTO blobs (hash, data) VALUES (?, ?)",
+                                   (digest, text if text is not None else _dumps(value)))
+                        self._blob_ids.add(digest)
+                        self.blobs_written += 1
+
+                released = bool(deleted)
+                self._codec.begin()
+                for name in names:
+                    if name not in current:
+                        continue
+                    released |= self._save_profile_rows(db, name, current[name], sink)
+                self._codec.end()
+
+                if released:
+                    self._collect(db)
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                # Las filas pueden no coincidir con lo que creemos escrito: la próxima vez comparar todo
+                self._row_hashes = {}
+                self._meta_hashes = {}
+                self._version_keys = {}
+                self._blob_ids = None
+                self._codec.reset()
+                raise
+
+    def _save_profile_rows(self, db: sqlite3.Connection, name: str, profile: Dict, sink: BlobSink) -> bool:
+        """Escribir las filas cambiadas de un perfil
+
+        Returns:
+            True si se reemplazó o eliminó alguna fila (puede haber blobs sin uso)
+        """
+        versions = profile.get("versions", {})
+        loaded = {version for version, _ in loaded_versions(versions)}
+        released = False
+
+        # Versiones eliminadas (cargadas o no): borrar todas sus filas
+        removed = self._version_keys.get(name, set()) - set(versions)
+        for version in removed:
+            for table in ("versions", "kb_entries", "documents"):
+                db.execute(f"DELETE FROM {table} WHERE profile = ? AND version = ?", (name, version))
+            released = True
+
+        rows = profile_rows(name, profile, self._codec, sink)
+        old = {}
+        kept = {}
+        for key, digest in self._row_hashes.get(name, {}).items():
+            if key[0] == "profiles" or key[2] in loaded:
+                old[key] = digest
+            elif key[2] not in removed:
+                # Filas de versiones sin cargar: siguen igual en la base
+                kept[key] = digest
+
+        for key in old.keys() - rows.keys():
+            table, *ids = key
+            if table == "profiles":
+                db.execute("DELETE FROM profiles WHERE name = ?", ids)
+            elif table == "versions":
+                db.execute("DELETE FROM versions WHERE profile = ? AND version = ?", ids)
+            elif table == "kb_entries":
+                db.execute("DELETE FROM kb_entries WHERE profile = ? AND version = ? AND key = ?", ids)
+            else:
+                db.execute("DELETE FROM documents WHERE profile = ? AND version = ? AND position = ?", ids)
+            released = True
+        for key, (text, digest) in rows.items():
+            if old.get(key) == digest:
+                continue
+            released |= key in old
+            table, *ids = key
+            if table == "profiles":
+                db.execute("INSERT OR REPLACE INTO profiles (name, data) VALUES (?, ?)", (name, text))
+            elif table == "versions":
+                db.execute("INSERT OR REPLACE INTO versions (profile, version, data) VALUES (?, ?, ?)",
+                           (*ids, text))
+            elif table == "kb_entries":
+                position, blob = json.loads(text)
+                db.execute("INSERT OR REPLACE INTO kb_entries (profile, version, key, position, blob) "
+                           "VALUES (?, ?, ?, ?, ?)", (*ids, position, blob))
+            else:
+                db.execute("INSERT OR REPLACE INTO documents (profile, version, position, blob) "
+                           "VALUES (?, ?, ?, ?)", (*ids, json.loads(text)))
+            self.rows_written += 1
+        kept.update((key, digest) for key, (_, digest) in rows.items())
+        self._row_hashes[name] = kept
+        self._version_keys[name] = set(versions)
+        return released
+
+    def _collect(self, db: sqlite3.Connection) -> int:
+        removed = db.execute(SQLITE_GC).rowcount
+        if removed:
+            self._blob_ids = {digest for digest, in db.execute("SELECT hash FROM blobs")}
+            self.blobs_collected += removed
+        return removed
+
+    def gc(self) -> int:
+        """Eliminar los blobs que ninguna versión referencia
+
+        Returns:
+            Número de blobs eliminados
+        """
+        with self._lock:
+            db = self._conn
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                removed = self._collect(db)
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                self._blob_ids = None
+                raise
+            return removed
+
+    def size_bytes(self) -> int:
+        """Tamaño en disco (base más WAL)"""
+        return sum(os.path.getsize(path) for path in (self.path, self.path + "-wal") if os.path.exists(path))
+
+    def compact(self) -> int:
+        """Recolectar blobs sin referencias y reescribir la base (VACUUM) para liberar el espacio
+
+        Returns:
+            Número de blobs eliminados
+        """
+        removed = self.gc()
+        with self._lock:
+            self._conn.execute("VACUUM")
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return removed
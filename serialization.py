@@ -0,0 +1,163 @@
+"""
+Serialización de los almacenes en disco (perfiles, memoria de conversación y
+datos analizados por chat)
+Formatos: json (indentado, el de siempre), json-compact, orjson y msgpack, con
+sufijo "+zstd" opcional para comprimir. Al leer se detecta el formato por el
+contenido, así que cambiar STORE_FORMAT no invalida los archivos existentes.
+"""
+
+import json
+import os
+import tempfile
+from typing import Any, Callable, Optional
+
+# Dependencias opcionales: sin ellas esos formatos caen a json-compact / sin comprimir
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+FORMATS = ("json", "json-compact", "orjson", "msgpack")
+DEFAULT_FORMAT = "json"
+ZSTD_SUFFIX = "+zstd"
+ZSTD_LEVEL = 3
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+_warned = set()
+
+
+def _warn_once(message: str):
+    if message not in _warned:
+        _warned.add(message)
+        print(message)
+
+
+def resolve_format(fmt: Optional[str] = None) -> str:
+    """Formato efectivo: el pedido (o STORE_FORMAT), degradado si falta la librería
+
+    Raises:
+        ValueError: si el formato no existe
+    """
+    fmt = (fmt or os.getenv("STORE_FORMAT") or DEFAULT_FORMAT).strip().lower()
+    base, compressed = fmt, fmt.endswith(ZSTD_SUFFIX)
+    if compressed:
+        base = fmt[:-len(ZSTD_SUFFIX)]
+    if base not in FORMATS:
+        raise ValueError(f"Formato de almacenamiento desconocido: {fmt} (opciones: {', '.join(FORMATS)}, "
+                         f"con {ZSTD_SUFFIX} opcional)")
+    if base == "orjson" and not ORJSON_AVAILABLE:
+        _warn_once("orjson no está instalado: se usa json-compact")
+        base = "json-compact"
+    if base == "msgpack" and not MSGPACK_AVAILABLE:
+        _warn_once("msgpack no está instalado: se usa json-compact")
+        base = "json-compact"
+    if compressed and not ZSTD_AVAILABLE:
+        _warn_once("zstandard no está instalado: se guarda sin comprimir")
+        compressed = False
+    return base + ZSTD_SUFFIX if compressed else base
+
+
+def dumps(obj: Any, fmt: Optional[str] = None, default: Optional[Callable] = None) -> bytes:
+    """Serializar `obj` en el formato indicado (ver resolve_format)
+
+    Args:
+        obj: Valor a serializar (dict/list/str/números)
+        fmt: Formato; por defecto STORE_FORMAT o "json"
+        default: Conversión para tipos no serializables (como en json.dump)
+    """
+    fmt = resolve_format(fmt)
+    base = fmt[:-len(ZSTD_SUFFIX)] if fmt.endswith(ZSTD_SUFFIX) else fmt
+    if base == "json":
+        data = json.dumps(obj, ensure_ascii=False, indent=2, default=default).encode("utf-8")
+    elif base == "json-compact":
+        data = json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=default).encode("utf-8")
+    elif base == "orjson":
+        # Claves no str (p. ej. chat_id) se convierten a texto, igual que con json
+        data = orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+    else:
+        # msgpack conserva las claves enteras tal cual
+        data = msgpack.packb(obj, default=default, use_bin_type=True)
+    if base != fmt:
+        data = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return data
+
+
+def sniff_format(data: bytes) -> str:
+    """Formato de un contenido serializado: "zstd", "json" o "msgpack" ("" si está vacío)"""
+    if data.startswith(ZSTD_MAGIC):
+        return "zstd"
+    head = data[:64].lstrip(b" \t\r\n")
+    if not head:
+        return ""
+    if head.startswith(b"\xef\xbb\xbf") or head[:1] in (b"{", b"["):
+        return "json"
+    return "msgpack"
+
+
+def loads(data: bytes) -> Any:
+    """Deserializar un contenido escrito con dumps (o un JSON cualquiera)"""
+    kind = sniff_format(data)
+    if kind == "zstd":
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("El archivo está comprimido con zstd y zstandard no está instalado")
+        # stream_reader no necesita el tamaño original en la cabecera
+        with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+            data = reader.read()
+        kind = sniff_format(data)
+    if kind == "msgpack":
+        if not MSGPACK_AVAILABLE:
+            raise RuntimeError("El archivo está en msgpack y msgpack no está instalado")
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # BOM o NaN/Infinity escritos por json.dump: los lee el módulo estándar
+    return json.loads(data.decode("utf-8-sig"))
+
+
+def dump_file(path: str, obj: Any, fmt: Optional[str] = None, default: Optional[Callable] = None):
+    """Escribir `obj` en `path` (ver dumps)
+    
+    Se escribe en un temporal del mismo directorio y se reemplaza con
+    os.replace: quien lea a la vez ve el archivo anterior o el nuevo completo.
+    """
+    data = dumps(obj, fmt, default)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            try:
+                mode = os.stat(path).st_mode & 0o777
+            except OSError:
+                mode = 0o644  # mkstemp crea con 0600
+            os.fchmod(f.fileno(), mode)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def load_file(path: str) -> Any:
+    """Leer un archivo escrito con dump_file o con json.dump"""
+    with open(path, 'rb') as f:
+        return loads(f.read())
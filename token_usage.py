@@ -0,0 +1,224 @@
+"""
+Contabilidad de tokens para las llamadas a Gemini
+Agrega el consumo por chat, por versión de perfil y por día, y aplica
+presupuestos suaves y duros configurables
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+# Relación caracteres/token de partida para texto en español con Gemini
+DEFAULT_CHARS_PER_TOKEN = 4.0
+
+BUDGET_OK = "ok"
+BUDGET_SOFT = "soft"
+BUDGET_HARD = "hard"
+
+
+def estimate_tokens(text: str, chars_per_token: float = DEFAULT_CHARS_PER_TOKEN) -> int:
+    """Estimar tokens de un texto sin llamar a la API"""
+    if not text:
+        return 0
+    return max(1, int(round(len(text) / chars_per_token)))
+
+
+def trim_to_lines(text: str, max_chars: int) -> str:
+    """Recortar un texto a max_chars sin cortar una línea (o una entrada) por la mitad"""
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind("\n", 0, max_chars + 1)
+    return text[:cut].rstrip() if cut > 0 else text[:max_chars]
+
+
+def _env_int(name: str) -> Optional[int]:
+    """Leer un entero opcional desde el entorno"""
+    value = os.getenv(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        print(f"Valor inválido para {name}: {value}")
+        return None
+
+
+class TokenUsageTracker:
+    """Registro de tokens consumidos con presupuestos diarios por chat y por perfil
+
+    Solo se conservan los últimos keep_days días (0 = todos).
+    """
+
+    def __init__(self, usage_file: str = "token_usage.json",
+                 chat_soft_budget: Optional[int] = None, chat_hard_budget: Optional[int] = None,
+                 profile_soft_budget: Optional[int] = None, profile_hard_budget: Optional[int] = None,
+                 save_interval: float = 30.0, keep_days: int = 30):
+        self.usage_file = usage_file
+        self.keep_days = keep_days
+        self.chat_soft_budget = chat_soft_budget
+        self.chat_hard_budget = chat_hard_budget
+        self.profile_soft_budget = profile_soft_budget
+        self.profile_hard_budget = profile_hard_budget
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._last_save = 0.0
+        self._dirty = False
+        self.data = self._load()
+        self._prune_days()
+
+    @classmethod
+    def from_env(cls, usage_file: str = "token_usage.json") -> "TokenUsageTracker":
+        """Crear el registro leyendo los presupuestos desde variables de entorno"""
+        keep_days = _env_int("TOKEN_USAGE_KEEP_DAYS")
+        return cls(
+            usage_file,
+            chat_soft_budget=_env_int("TOKEN_BUDGET_CHAT_SOFT"),
+            chat_hard_budget=_env_int("TOKEN_BUDGET_CHAT_HARD"),
+            profile_soft_budget=_env_int("TOKEN_BUDGET_PROFILE_SOFT"),
+            profile_hard_budget=_env_int("TOKEN_BUDGET_PROFILE_HARD"),
+            keep_days=30 if keep_days is None else keep_days,
+        )
+
+    def _load(self) -> Dict:
+        """Cargar el historial de consumo desde archivo JSON"""
+        if os.path.exists(self.usage_file):
+            try:
+                with open(self.usage_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"Error cargando consumo de tokens: {e}")
+        return {"calibration": {"chars": 0, "tokens": 0}, "days": {}}
+
+    def save(self, force: bool = True):
+        """Guardar el historial (si force=False solo cada save_interval segundos)"""
+        with self._lock:
+            if not self._dirty:
+                return
+            if not force and time.monotonic() - self._last_save < self.save_interval:
+                return
+            try:
+                with open(self.usage_file, 'w', encoding='utf-8') as f:
+                    json.dump(self.data, f, ensure_ascii=False, indent=2)
+                self._dirty = False
+                self._last_save = time.monotonic()
+            except Exception as e:
+                print(f"Error guardando consumo de tokens: {e}")
+
+    # ===== ESTIMACIÓN CALIBRADA =====
+
+    @property
+    def chars_per_token(self) -> float:
+        """Relación caracteres/token aprendida de las respuestas con usageMetadata"""
+        calibration = self.data["calibration"]
+        if calibration["tokens"] > 0 and calibration["chars"] > 0:
+            return calibration["chars"] / calibration["tokens"]
+        return DEFAULT_CHARS_PER_TOKEN
+
+    def estimate(self, text: str) -> int:
+        """Estimar tokens con la relación calibrada"""
+        return estimate_tokens(text, self.chars_per_token)
+
+    def _calibrate(self, prompt_text: str, prompt_tokens: int):
+        if prompt_text and prompt_tokens > 0:
+            self.data["calibration"]["chars"] += len(prompt_text)
+            self.data["calibration"]["tokens"] += prompt_tokens
+
+    # ===== REGISTRO =====
+
+    def record(self, chat_id, profile_key: str, prompt_text: str, response_text: str,
+               usage_metadata: Optional[Dict] = None) -> Dict:
+        """Registrar una llamada a Gemini
+
+        Usa usageMetadata cuando la API lo devuelve; en otro caso estima.
+
+        Returns:
+            Diccionario con {prompt_tokens, response_tokens, total_tokens, estimated}
+        """
+        with self._lock:
+            if usage_metadata and usage_metadata.get("promptTokenCount"):
+                prompt_tokens = int(usage_metadata.get("promptTokenCount", 0))
+                response_tokens = int(usage_metadata.get("candidatesTokenCount", 0))
+                self._calibrate(prompt_text, prompt_tokens)
+                estimated = False
+            else:
+                prompt_tokens = self.estimate(prompt_text)
+                response_tokens = self.estimate(response_text)
+                estimated = True
+
+            entry = {
+                "prompt_tokens": prompt_tokens,
+                "response_tokens": response_tokens,
+                "total_tokens": prompt_tokens + response_tokens,
+                "estimated": estimated
+            }
+
+            day = self._day_bucket(datetime.now().strftime("%Y-%m-%d"))
+            self._accumulate(day["total"], entry)
+            self._accumulate(day["chats"].setdefault(str(chat_id), {}), entry)
+            self._accumulate(day["profiles"].setdefault(profile_key or "sin_perfil", {}), entry)
+            self._dirty = True
+
+        self.save(force=False)
+        return entry
+
+    def _day_bucket(self, day: str) -> Dict:
+        if day not in self.data["days"]:
+            self.data["days"][day] = {"total": {}, "chats": {}, "profiles": {}}
+            self._prune_days()
+        return self.data["days"][day]
+
+    def _prune_days(self):
+        """Eliminar los días anteriores a los últimos keep_days"""
+        if self.keep_days <= 0:
+            return
+        cutoff = (datetime.now() - timedelta(days=self.keep_days - 1)).strftime("%Y-%m-%d")
+        for day in [day for day in self.data["days"] if day < cutoff]:
+            del self.data["days"][day]
+            self._dirty = True
+
+    @staticmethod
+    def _accumulate(bucket: Dict, entry: Dict):
+        bucket["calls"] = bucket.get("calls", 0) + 1
+        bucket["prompt_tokens"] = bucket.get("prompt_tokens", 0) + entry["prompt_tokens"]
+        bucket["response_tokens"] = bucket.get("response_tokens", 0) + entry["response_tokens"]
+        bucket["total_tokens"] = bucket.get("total_tokens", 0) + entry["total_tokens"]
+        if entry["estimated"]:
+            bucket["estimated_calls"] = bucket.get("estimated_calls", 0) + 1
+
+    # ===== CONSULTAS =====
+
+    def get_day_usage(self, day: Optional[str] = None) -> Dict:
+        """Consumo total de un día (hoy por defecto)"""
+        day = day or datetime.now().strftime("%Y-%m-%d")
+        return self.data["days"].get(day, {}).get("total", {})
+
+    def get_chat_usage(self, chat_id, day: Optional[str] = None) -> Dict:
+        """Consumo de un chat en un día (hoy por defecto)"""
+        day = day or datetime.now().strftime("%Y-%m-%d")
+        return self.data["days"].get(day, {}).get("chats", {}).get(str(chat_id), {})
+
+    def get_profile_usage(self, profile_key: str, day: Optional[str] = None) -> Dict:
+        """Consumo de una versión de perfil en un día (hoy por defecto)"""
+        day = day or datetime.now().strftime("%Y-%m-%d")
+        return self.data["days"].get(day, {}).get("profiles", {}).get(profile_key or "sin_perfil", {})
+
+    # ===== PRESUPUESTOS =====
+
+    def budget_status(self, chat_id, profile_key: str = "") -> str:
+        """Estado del presupuesto diario: 'ok', 'soft' o 'hard'
+
+        Se toma el peor estado entre el presupuesto del chat y el del perfil.
+        """
+        chat_total = self.get_chat_usage(chat_id).get("total_tokens", 0)
+        profile_total = self.get_profile_usage(profile_key).get("total_tokens", 0)
+
+        if (self.chat_hard_budget and chat_total >= self.chat_hard_budget) or \
+                (self.profile_hard_budget and profile_total >= self.profile_hard_budget):
+            return BUDGET_HARD
+        if (self.chat_soft_budget and chat_total >= self.chat_soft_budget) or \
+                (self.profile_soft_budget and profile_total >= self.profile_soft_budget):
+            return BUDGET_SOFT
+        return BUDGET_OK
@@ -0,0 +1,323 @@
+"""
+Índice columnar del catálogo de vehículos
+Guarda el catálogo como tabla tipada (columnas numéricas y categóricas) con
+índices de facetas precalculados, para resolver consultas como
+"SUV automática de 7 asientos con más de 180 HP" sin volcar todo el catálogo
+"""
+
+import hashlib
+import math
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from context_retrieval import fold_accents
+
+NUMERIC_COLUMNS = ["potencia_hp", "año", "asientos", "garantia_km"]
+CATEGORICAL_COLUMNS = ["marca", "tipo_carroceria", "transmision"]
+TEXT_COLUMNS = [
+    "id", "modelo", "version", "capacidad_combustible_lt", "colores", "modelo_motor", "cilindrada",
+    "neumaticos", "puertas", "equipamiento_destacado", "garantia_años", "link_foto", "kb_key"
+]
+
+# Sinónimos de carrocería -> fragmento a buscar en el valor normalizado de la faceta
+BODY_SYNONYMS = {
+    "suv": "suv", "camioneta": "suv", "todoterreno": "suv", "crossover": "suv",
+    "sedan": "sedan", "pickup": "pick", "pick-up": "pick", "hatchback": "hatch",
+    "coupe": "coupe", "van": "van", "minivan": "van", "convertible": "convertible"
+}
+TRANSMISSION_SYNONYMS = {
+    "automatica": "autom", "automatico": "autom", "automaticas": "autom", "automaticos": "autom",
+    "manual": "manual", "manuales": "manual", "cvt": "cvt", "sincronica": "manual", "mecanica": "manual"
+}
+
+_MISSING = float("nan")
+
+
+def parse_number(value) -> float:
+    """Convertir '180', '100,000 km' o '2.0' en número (NaN si no hay número)"""
+    if value is None:
+        return _MISSING
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.search(r"\d[\d.,]*", str(value))
+    if not match:
+        return _MISSING
+    digits = match.group(0)
+    # "100,000" y "100.000" son miles; "2.0" y "2,5" son decimales
+    if re.fullmatch(r"\d{1,3}([.,]\d{3})+", digits):
+        digits = re.sub(r"[.,]", "", digits)
+    else:
+        digits = digits.replace(",", ".")
+    try:
+        return float(digits)
+    except ValueError:
+        return _MISSING
+
+
+def _bitset(rows: Iterable[int], size: int) -> int:
+    """Construir un bitset (entero de Python) en O(n) a partir de índices de fila"""
+    buffer = bytearray((size + 7) // 8)
+    for row in rows:
+        buffer[row >> 3] |= 1 << (row & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def _rows_from_bitset(bits: int, limit: Optional[int] = None) -> List[int]:
+    rows = []
+    while bits and (limit is None or len(rows) < limit):
+        low = bits & -bits
+        rows.append(low.bit_length() - 1)
+        bits ^= low
+    return rows
+
+
+# Columnas casi siempre únicas por fila: no vale la pena compartir sus valores
+UNIQUE_COLUMNS = ("id", "kb_key")
+
+
+def kb_value_hash(value) -> str:
+    """Huella de la ficha de un vehículo en la base de conocimientos, para detectar ediciones posteriores"""
+    return hashlib.sha1(str(value).encode("utf-8")).hexdigest()[:12]
+
+
+class CatalogColumnsBuilder:
+    """Forma columnar del catálogo construida fila a fila, sin conservar las filas
+
+    to_dict() produce lo mismo que VehicleCatalogIndex.from_rows(rows, kb_keys).to_dict(),
+    más la huella de la ficha de cada fila tal como se importó (kb_hashes).
+    Los valores repetidos de una columna (marca, año, colores...) se guardan
+    una sola vez.
+    """
+
+    def __init__(self):
+        self.size = 0
+        self._kb_hashes: List[Optional[str]] = []
+        self._columns: Dict[str, list] = {name: [] for name in TEXT_COLUMNS + NUMERIC_COLUMNS + CATEGORICAL_COLUMNS}
+        self._interned: Dict[str, Dict] = {name: {} for name in self._columns if name not in UNIQUE_COLUMNS}
+
+    def _append(self, name: str, value):
+        interned = self._interned.get(name)
+        if interned is not None:
+            value = interned.setdefault(value, value)
+        self._columns[name].append(value)
+
+    def add(self, row: Dict, kb_key: Optional[str] = None, kb_value: Optional[str] = None):
+        """Agregar una fila de csv.DictReader (y la clave y el texto de su ficha en la base de conocimientos)"""
+        self._kb_hashes.append(kb_value_hash(kb_value) if kb_value is not None else None)
+        for name in TEXT_COLUMNS:
+            self._append(name, kb_key if name == "kb_key" and kb_key is not None else row.get(name, ""))
+        for name in NUMERIC_COLUMNS:
+            number = parse_number(row.get(name, ""))
+            self._append(name, None if math.isnan(number) else (int(number) if number.is_integer() else number))
+        for name in CATEGORICAL_COLUMNS:
+            self._append(name, (row.get(name, "") or "").strip())
+        self.size += 1
+
+    def to_dict(self) -> Dict:
+        """Forma serializada que se guarda en la versión del perfil"""
+        return {"rows": self.size, "columns": self._columns, "kb_hashes": self._kb_hashes}
+
+
+class VehicleCatalogIndex:
+    """Catálogo en columnas tipadas con facetas precalculadas"""
+
+    def __init__(self, columns: Dict[str, list]):
+        self.size = len(columns.get("marca", []))
+        self.text = {name: list(columns.get(name, [""] * self.size)) for name in TEXT_COLUMNS}
+
+        # Numéricas: arreglo de dobles + (valores ordenados, filas) para rangos
+        self.numeric: Dict[str, array] = {}
+        self._sorted: Dict[str, Tuple[List[float], List[int]]] = {}
+        for name in NUMERIC_COLUMNS:
+            values = array("d", (parse_number(v) for v in columns.get(name, [None] * self.size)))
+            self.numeric[name] = values
+            pairs = sorted((v, row) for row, v in enumerate(values) if not math.isnan(v))
+            self._sorted[name] = ([v for v, _ in pairs], [row for _, row in pairs])
+
+        # Categóricas: códigos de diccionario + bitset por valor
+        self.categories: Dict[str, List[str]] = {}
+        self.codes: Dict[str, array] = {}
+        self.facets: Dict[str, Dict[str, int]] = {}
+        for name in CATEGORICAL_COLUMNS:
+            dictionary: Dict[str, int] = {}
+            codes = array("I")
+            members: Dict[int, List[int]] = {}
+            for row, raw in enumerate(columns.get(name, [""] * self.size)):
+                value = (raw or "").strip()
+                code = dictionary.setdefault(value, len(dictionary))
+                codes.append(code)
+                members.setdefault(code, []).append(row)
+            self.categories[name] = list(dictionary)
+            self.codes[name] = codes
+            self.facets[name] = {
+                fold_accents(value): _bitset(members[code], self.size)
+                for value, code in dictionary.items()
+            }
+
+    @classmethod
+    def from_rows(cls, rows: List[Dict], kb_keys: Optional[List[str]] = None) -> "VehicleCatalogIndex":
+        """Construir el índice desde filas de csv.DictReader"""
+        columns = {name: [row.get(name, "") for row in rows]
+                   for name in NUMERIC_COLUMNS + CATEGORICAL_COLUMNS + TEXT_COLUMNS}
+        if kb_keys is not None:
+            columns["kb_key"] = list(kb_keys)
+        return cls(columns)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "VehicleCatalogIndex":
+        """Reconstruir desde la forma serializada en la versión del perfil"""
+        return cls(data.get("columns", {}))
+
+    def to_dict(self) -> Dict:
+        """Forma columnar serializable a JSON"""
+        columns = {name: list(values) for name, values in self.text.items()}
+        for name, values in self.numeric.items():
+            columns[name] = [None if math.isnan(v) else (int(v) if v.is_integer() else v) for v in values]
+        for name, codes in self.codes.items():
+            dictionary = self.categories[name]
+            columns[name] = [dictionary[c] for c in codes]
+        return {"rows": self.size, "columns": columns}
+
+    # ===== FILTRADO =====
+
+    def _all_rows(self) -> int:
+        return (1 << self.size) - 1
+
+    def _numeric_bits(self, name: str, low: Optional[float], high: Optional[float],
+                      low_inclusive: bool = True, high_inclusive: bool = True) -> int:
+        values, rows = self._sorted[name]
+        start = 0
+        end = len(values)
+        if low is not None:
+            start = bisect_left(values, low) if low_inclusive else bisect_right(values, low)
+        if high is not None:
+            end = bisect_right(values, high) if high_inclusive else bisect_left(values, high)
+        return _bitset(rows[start:end], self.size) if start < end else 0
+
+    def _category_bits(self, name: str, fragment: str) -> int:
+        fragment = fold_accents(fragment)
+        bits = 0
+        for value, value_bits in self.facets[name].items():
+            if fragment in value:
+                bits |= value_bits
+        return bits
+
+    def filter(self, criteria: Dict) -> List[int]:
+        """Filtrar filas
+
+        Args:
+            criteria: {columna_categórica: fragmento} y
+                {columna_numérica: (mín, máx, mín_inclusivo, máx_inclusivo)}
+
+        Returns:
+            Índices de fila que cumplen todos los criterios
+        """
+        bits = self._all_rows()
+        for name, condition in criteria.items():
+            if name in self.facets:
+                bits &= self._category_bits(name, condition)
+            elif name in self._sorted:
+                bits &= self._numeric_bits(name, *condition)
+            if not bits:
+                break
+        return _rows_from_bitset(bits)
+
+    def facet_counts(self, name: str) -> Dict[str, int]:
+        """Número de vehículos por valor de una faceta categórica"""
+        counts = [0] * len(self.categories[name])
+        for code in self.codes[name]:
+            counts[code] += 1
+        return dict(zip(self.categories[name], counts))
+
+    # ===== CONSULTAS EN LENGUAJE NATURAL =====
+
+    def parse_query(self, query: str) -> Dict:
+        """Extraer filtros de facetas desde un mensaje en español"""
+        text = fold_accents(query)
+        words = set(re.findall(r"[\w-]+", text))
+        criteria: Dict = {}
+
+        for value in self.facets["marca"]:
+            if value and re.search(rf"\b{re.escape(value)}\b", text):
+                criteria["marca"] = value
+                break
+
+        for word, fragment in BODY_SYNONYMS.items():
+            if word in words and self._category_bits("tipo_carroceria", fragment):
+                criteria["tipo_carroceria"] = fragment
+                break
+
+        for word, fragment in TRANSMISSION_SYNONYMS.items():
+            if word in words and self._category_bits("transmision", fragment):
+                criteria["transmision"] = fragment
+                break
+
+        numeric_patterns = [
+            ("potencia_hp", r"(\d[\d.,]*)\s*(?:hp|caballos|cv)\b"),
+            ("asientos", r"(\d+)\s*(?:asientos|plazas|pasajeros|puestos)\b"),
+            ("garantia_km", r"(\d[\d.,]*)\s*(?:km|kilometros)\b"),
+        ]
+        for name, pattern in numeric_patterns:
+            match = re.search(rf"(mas de|mayor a|superior a|minimo|al menos|desde|menos de|hasta|maximo)?\s*(?:de\s+)?{pattern}", text)
+            if match:
+                criteria[name] = self._range(match.group(1), parse_number(match.group(2)))
+
+        year = re.search(r"(mas de|desde|despues de|antes de|hasta)?\s*\b((?:19|20)\d{2})\b", text)
+        if year:
+            criteria["año"] = self._range(year.group(1), float(year.group(2)))
+
+        return criteria
+
+    @staticmethod
+    def _range(qualifier: Optional[str], value: float) -> Tuple:
+        if qualifier in ("mas de", "mayor a", "superior a", "despues de"):
+            return (value, None, False, True)
+        if qualifier in ("minimo", "al menos", "desde"):
+            return (value, None, True, True)
+        if qualifier in ("menos de", "antes de"):
+            return (None, value, True, False)
+        if qualifier in ("hasta", "maximo"):
+            return (None, value, True, True)
+        return (value, value, True, True)
+
+    def search(self, query: str) -> Tuple[Dict, List[int]]:
+        """Resolver un mensaje: (filtros detectados, filas que cumplen); sin filtros no hay filas"""
+        criteria = self.parse_query(query)
+        if not criteria:
+            return criteria, []
+        return criteria, self.filter(criteria)
+
+    # ===== RENDERIZADO =====
+
+    def row(self, row: int) -> Dict:
+        """Reconstruir una fila como diccionario"""
+        data = {name: values[row] for name, values in self.text.items()}
+        for name, values in self.numeric.items():
+            value = values[row]
+            data[name] = None if math.isnan(value) else (int(value) if value.is_integer() else value)
+        for name, codes in self.codes.items():
+            data[name] = self.categories[name][codes[row]]
+        return data
+
+    def render_rows(self, rows: List[int]) -> List[str]:
+        """Una línea compacta clave:valor por vehículo (omite campos vacíos)"""
+        labels = [
+            ("tipo_carroceria", "carrocería"), ("transmision", "transmisión"), ("potencia_hp", "hp"),
+            ("modelo_motor", "motor"), ("cilindrada", "cilindrada"), ("asientos", "asientos"),
+            ("puertas", "puertas"), ("capacidad_combustible_lt", "combustible_lt"),
+            ("neumaticos", "neumáticos"), ("colores", "colores"),
+            ("equipamiento_destacado", "equipamiento"), ("garantia_años", "garantía_años"),
+            ("garantia_km", "garantía_km"), ("link_foto", "foto")
+        ]
+        lines = []
+        for row in rows:
+            data = self.row(row)
+            fields = [f"{data['marca']} {data['modelo']} {data['version']} ({data['año'] or 'N/A'})".strip()]
+            for key, label in labels:
+                value = data.get(key)
+                if value not in (None, "", "N/A"):
+                    fields.append(f"{label}: {value}")
+            lines.append("• " + " | ".join(fields))
+        return lines